@@ -0,0 +1,228 @@
+# Dashboard rollups: per restaurant, per hour and per local day, kept
+# current as calls, orders and reservations commit, so the dashboard reads
+# a handful of rows however much history there is.
+#
+# Writers turn what they just did into Deltas and write them with
+# write_rollups(conn, ...) inside their own transaction, so a rollup counts
+# exactly what committed. Rollups for history written before this existed
+# (or after a fix to the counting) come from the backfill:
+#     python -m api.analytics --since 2025-01-01
+#     python -m api.analytics --since 2025-01-01 --until 2025-07-01 --restaurant 12
+#
+# Hour buckets are UTC hours; day buckets start at local midnight in the
+# restaurant's timezone (its first location's, like timeslots.py).
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import date, datetime, time as clock, timezone
+from decimal import Decimal
+from typing import NamedTuple
+from .database import init_pool, close_pool, acquire, fetch_all, transaction
+from .timeslots import load_zone
+
+logger = logging.getLogger(__name__)
+
+# Restaurant timezones are re-read after this many seconds.
+ANALYTICS_ZONE_TTL = float(os.getenv("ANALYTICS_ZONE_TTL", 3600.0))
+
+GRANULARITIES = ("hour", "day")
+ROLLUP_FIELDS = ("calls", "timed_calls", "call_seconds", "handovers", "orders", "order_revenue", "reservations", "covers")
+
+ZONES_QUERY = (
+    "SELECT DISTINCT ON (restaurant_id) restaurant_id, timezone FROM locations "
+    "WHERE restaurant_id = ANY($1::int[]) ORDER BY restaurant_id, id"
+)
+# Rows arrive aggregated and sorted by key (see rollup_rows), so concurrent
+# writers lock buckets in the same order and never deadlock.
+ROLLUP_QUERY = f"""
+INSERT INTO analytics_rollups AS r (restaurant_id, granularity, bucket, {", ".join(ROLLUP_FIELDS)})
+SELECT * FROM unnest($1::int[], $2::text[], $3::timestamptz[], $4::int[], $5::int[], $6::float8[], $7::int[],
+                     $8::int[], $9::numeric[], $10::int[], $11::int[])
+ON CONFLICT (restaurant_id, granularity, bucket) DO UPDATE SET
+    {", ".join(f"{field} = r.{field} + EXCLUDED.{field}" for field in ROLLUP_FIELDS)},
+    updated_at = CURRENT_TIMESTAMP
+"""
+DASHBOARD_QUERY = (
+    f"SELECT bucket, {', '.join(ROLLUP_FIELDS)} FROM analytics_rollups "
+    "WHERE restaurant_id = $1 AND granularity = $2 AND bucket >= $3 AND bucket < $4 ORDER BY bucket"
+)
+# Recomputes one restaurant's buckets in [$2, $3) from the source tables.
+# $2 and $3 are local midnights, so every day bucket in range is whole.
+# Handover requests aren't stored anywhere else, so they keep their live
+# counts; everything else is zeroed and rewritten.
+BACKFILL_RESET_QUERY = (
+    "UPDATE analytics_rollups SET "
+    + ", ".join(f"{field} = 0" for field in ROLLUP_FIELDS if field != "handovers")
+    + " WHERE restaurant_id = $1 AND bucket >= $2 AND bucket < $3"
+)
+BACKFILL_QUERY = f"""
+INSERT INTO analytics_rollups (restaurant_id, granularity, bucket, {", ".join(ROLLUP_FIELDS)})
+SELECT $1, g.granularity,
+       CASE g.granularity WHEN 'hour' THEN date_trunc('hour', e.at, 'UTC') ELSE date_trunc('day', e.at, $4) END AS bucket,
+       sum(e.calls), sum(e.timed_calls), sum(e.call_seconds), 0, sum(e.orders), sum(e.order_revenue), sum(e.reservations), sum(e.covers)
+FROM (
+    SELECT start_time AS at, 1 AS calls, (end_time IS NOT NULL)::int AS timed_calls,
+           COALESCE(extract(epoch FROM end_time - start_time), 0) AS call_seconds,
+           0 AS orders, 0 AS order_revenue, 0 AS reservations, 0 AS covers
+      FROM call_logs WHERE restaurant_id = $1 AND start_time >= $2 AND start_time < $3
+    UNION ALL
+    SELECT created_at, 0, 0, 0, 1, total_amount, 0, 0
+      FROM orders WHERE restaurant_id = $1 AND created_at >= $2 AND created_at < $3
+    UNION ALL
+    SELECT created_at, 0, 0, 0, 0, 0, 1, party_size
+      FROM reservations WHERE restaurant_id = $1 AND created_at >= $2 AND created_at < $3
+) e CROSS JOIN (VALUES ('hour'), ('day')) AS g(granularity)
+GROUP BY 1, 2, 3
+ON CONFLICT (restaurant_id, granularity, bucket) DO UPDATE SET
+    {", ".join(f"{field} = EXCLUDED.{field}" for field in ROLLUP_FIELDS if field != "handovers")},
+    updated_at = CURRENT_TIMESTAMP
+"""
+RESTAURANTS_QUERY = "SELECT id FROM restaurants ORDER BY id"
+
+
+class Delta(NamedTuple):
+    # Something that happened at `at` for one restaurant
+    restaurant_id: int
+    at: datetime
+    calls: int = 0
+    timed_calls: int = 0  # calls that ended, so have a duration
+    call_seconds: float = 0.0
+    handovers: int = 0
+    orders: int = 0
+    order_revenue: Decimal = Decimal(0)
+    reservations: int = 0
+    covers: int = 0
+
+
+_zones = {}  # restaurant_id -> (tzinfo, monotonic time loaded)
+
+
+async def restaurant_zones(restaurant_ids):
+    # {restaurant_id: tzinfo}, from the in-process cache where fresh
+    now = time.monotonic()
+    stale = sorted({rid for rid in restaurant_ids if rid not in _zones or now - _zones[rid][1] > ANALYTICS_ZONE_TTL})
+    if stale:
+        names = {row["restaurant_id"]: row["timezone"] for row in await fetch_all(ZONES_QUERY, stale)}
+        for rid in stale:
+            _zones[rid] = (load_zone(names.get(rid)), now)
+    return {rid: _zones[rid][0] for rid in restaurant_ids}
+
+
+def _utc(at):
+    return (at if at.tzinfo else at.replace(tzinfo=timezone.utc)).astimezone(timezone.utc)
+
+
+def bucket_start(granularity, at, zone):
+    if granularity == "hour":
+        return _utc(at).replace(minute=0, second=0, microsecond=0)
+    return datetime.combine(_utc(at).astimezone(zone).date(), clock(), tzinfo=zone)
+
+
+def rollup_rows(deltas, zones):
+    # Deltas -> one row per (restaurant, granularity, bucket), sorted
+    totals = {}
+    for delta in deltas:
+        for granularity in GRANULARITIES:
+            key = (delta.restaurant_id, granularity, bucket_start(granularity, delta.at, zones[delta.restaurant_id]))
+            row = totals.get(key)
+            if row is None:
+                totals[key] = list(delta[2:])
+            else:
+                for i, value in enumerate(delta[2:]):
+                    row[i] += value
+    return [(*key, *values) for key, values in sorted(totals.items())]
+
+
+async def write_rollups(conn, rows):
+    # Rows from rollup_rows; call inside the transaction whose writes they count
+    if rows:
+        await conn.execute(ROLLUP_QUERY, *(list(column) for column in zip(*rows)))
+
+
+async def record_deltas(deltas):
+    # For events with no write of their own to ride along with
+    zones = await restaurant_zones({delta.restaurant_id for delta in deltas})
+    async with transaction() as conn:
+        await write_rollups(conn, rollup_rows(deltas, zones))
+
+
+async def dashboard(restaurant_id, since: datetime, until: datetime, granularity="day"):
+    # Buckets starting in [since, until) plus their totals. Reads at most
+    # one row per bucket in range: no scans of call_logs / orders.
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    rows = await fetch_all(DASHBOARD_QUERY, restaurant_id, granularity, since, until)
+    series = [{"bucket": row["bucket"].isoformat(), **_figures({field: row[field] for field in ROLLUP_FIELDS})} for row in rows]
+    totals = {field: sum(row[field] for row in rows) for field in ROLLUP_FIELDS}
+    return {
+        "restaurant_id": restaurant_id,
+        "granularity": granularity,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "series": series,
+        "totals": _figures(totals),
+    }
+
+
+def _figures(counts):
+    # Raw counts plus the rates the dashboard shows. Conversion is bookings
+    # (orders + reservations) per call; handover rate is requests per call.
+    calls = counts["calls"]
+    return {
+        **counts,
+        "call_seconds": round(float(counts["call_seconds"]), 1),
+        "order_revenue": float(counts["order_revenue"]),
+        "avg_call_seconds": round(float(counts["call_seconds"]) / counts["timed_calls"], 1) if counts["timed_calls"] else None,
+        "conversion_rate": round((counts["orders"] + counts["reservations"]) / calls, 4) if calls else None,
+        "handover_rate": round(counts["handovers"] / calls, 4) if calls else None,
+    }
+
+
+async def backfill_restaurant(conn, restaurant_id, since: date, until: date):
+    # Returns the rows written. Live writers keep adding to buckets in range
+    # while this runs only if `until` is in the future; the default stops at
+    # the start of today.
+    zone = (await restaurant_zones([restaurant_id]))[restaurant_id]
+    start = datetime.combine(since, clock(), tzinfo=zone)
+    end = datetime.combine(until, clock(), tzinfo=zone)
+    async with conn.transaction():
+        await conn.execute(BACKFILL_RESET_QUERY, restaurant_id, start, end)
+        status = await conn.execute(BACKFILL_QUERY, restaurant_id, start, end, getattr(zone, "key", "UTC"))
+    return int(status.split()[-1])
+
+
+async def run(args):
+    await init_pool()
+    try:
+        async with acquire() as conn:
+            if args.restaurant:
+                restaurant_ids = args.restaurant
+            else:
+                restaurant_ids = [row["id"] for row in await conn.fetch(RESTAURANTS_QUERY)]
+            total = 0
+            for restaurant_id in restaurant_ids:
+                zone = (await restaurant_zones([restaurant_id]))[restaurant_id]
+                until = args.until or datetime.now(zone).date()
+                written = await backfill_restaurant(conn, restaurant_id, args.since, until)
+                logger.info("Restaurant %s: %s rollup rows for %s to %s", restaurant_id, written, args.since, until)
+                total += written
+    finally:
+        await close_pool()
+    print(f"Backfilled {total} rollup rows for {len(restaurant_ids)} restaurant(s).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute dashboard rollups from call_logs, orders and reservations")
+    parser.add_argument("--since", type=date.fromisoformat, required=True, help="first local day to recompute")
+    parser.add_argument("--until", type=date.fromisoformat, help="local day to stop before (default: today)")
+    parser.add_argument("--restaurant", type=int, action="append", help="only this restaurant (repeatable)")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Sends one campaign to --recipients contacts (--optout of them opted out)
+# through FakeProvider and reports sends/sec for each --concurrency, then
+# kills a run partway through (--crash-at), discarding the outcomes it had
+# not flushed yet, resumes it from the stored checkpoint and reports
+# duplicate and missed sends. Duplicates should be 0: recipients claimed
+# before the crash are not retried, and those left without an outcome are
+# counted as unconfirmed (at most about CAMPAIGN_CLAIM_BATCH plus the send
+# queue). Opted-out contacts that were messaged are counted in every run
+# and should always be 0.
+#
+# In-memory only (fake_database.py); --db-latency-ms stands in for the
+# round trip to Postgres.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_campaigns --recipients 100000 --rate 2000
+#     python -m api.bench_campaigns --recipients 5000 --concurrency 1,10,50 --rate 1000
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from collections import Counter
+
+
+def make_audience(args):
+    rng = random.Random(args.seed)
+    contacts = [(f"+1555{n:07d}", rng.random() >= args.optout) for n in range(args.recipients)]
+    rng.shuffle(contacts)
+    return contacts
+
+
+async def send(store, campaign_id, provider, bucket, concurrency, crash_at=None):
+    from .campaigns import CampaignRun
+    run = CampaignRun(store.campaigns[campaign_id], provider, bucket, concurrency=concurrency)
+    task = asyncio.create_task(run.run())
+    if crash_at is not None:
+        while len(provider.sent) < crash_at and not task.done():
+            await asyncio.sleep(0.01)
+        # A crash loses whatever hadn't been flushed yet
+        run._results.clear()
+        task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return run
+
+
+def audit(store, campaign_id, provider, opted_in):
+    sends = Counter(recipient for recipient, _ in provider.sent)
+    duplicates = sum(count - 1 for count in sends.values())
+    opted_out = sum(1 for recipient in sends if recipient not in opted_in)
+    missing = sum(1 for contact in opted_in if (campaign_id, contact) not in store.deliveries)
+    unconfirmed = sum(1 for (campaign, _), status in store.deliveries.items() if campaign == campaign_id and status == "sending")
+    return duplicates, opted_out, missing, unconfirmed
+
+
+async def run(args):
+    from . import fake_database
+    from .campaigns import FakeProvider, TokenBucket
+
+    contacts = make_audience(args)
+    opted_in = {contact for contact, ok in contacts if ok}
+    print(f"{args.recipients} contacts, {len(opted_in)} opted in, provider {args.latency_ms:g} ms/send, "
+          f"{args.failure_rate:.1%} failures, rate limit {args.rate:g}/s")
+    print(f"{'run':<22}{'sent':>9}{'failed':>8}{'seconds':>9}{'sends/s':>9}{'dupes':>7}{'opted-out':>11}{'missing':>9}{'unconfirmed':>13}{'statements':>12}")
+
+    def report(label, store, campaign_id, provider, runs, elapsed):
+        duplicates, opted_out, missing, unconfirmed = audit(store, campaign_id, provider, opted_in)
+        sent = sum(r.stats["sent"] for r in runs)
+        failed = sum(r.stats["failed"] for r in runs)
+        print(f"{label:<22}{sent:>9}{failed:>8}{elapsed:>9.2f}{(sent + failed) / elapsed:>9.0f}"
+              f"{duplicates:>7}{opted_out:>11}{missing:>9}{unconfirmed:>13}{store.statements:>12}")
+
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        store = fake_database.install(latency=args.db_latency_ms / 1000)
+        store.add_audience(args.channel, contacts)
+        campaign_id = store.add_campaign(args.channel)
+        provider = FakeProvider(latency=args.latency_ms / 1000, failure_rate=args.failure_rate, seed=args.seed)
+        started = time.perf_counter()
+        result = await send(store, campaign_id, provider, TokenBucket(args.rate), concurrency)
+        report(f"concurrency {concurrency}", store, campaign_id, provider, [result], time.perf_counter() - started)
+
+    if args.crash_at:
+        concurrency = int(args.concurrency.split(",")[-1])
+        store = fake_database.install(latency=args.db_latency_ms / 1000)
+        store.add_audience(args.channel, contacts)
+        campaign_id = store.add_campaign(args.channel)
+        provider = FakeProvider(latency=args.latency_ms / 1000, failure_rate=args.failure_rate, seed=args.seed)
+        bucket = TokenBucket(args.rate)
+        started = time.perf_counter()
+        first = await send(store, campaign_id, provider, bucket, concurrency, crash_at=int(args.crash_at * len(opted_in)))
+        checkpoint = store.campaigns[campaign_id]["checkpoint"]
+        second = await send(store, campaign_id, provider, bucket, concurrency)
+        report("crash + resume", store, campaign_id, provider, [first, second], time.perf_counter() - started)
+        print(f"crashed after {first.stats['sent'] + first.stats['failed']} sends, resumed after checkpoint {checkpoint!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Campaign sender throughput and resume benchmark")
+    parser.add_argument("--recipients", type=int, default=100000)
+    parser.add_argument("--optout", type=float, default=0.1, help="share of contacts whose latest opt-in row is an opt-out")
+    parser.add_argument("--channel", choices=("SMS", "Email"), default="SMS")
+    parser.add_argument("--concurrency", default="50", help="comma-separated sender pool sizes to compare")
+    parser.add_argument("--rate", type=float, default=2000.0, help="provider token-bucket rate, messages/sec")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="fake provider time per send")
+    parser.add_argument("--failure-rate", type=float, default=0.01)
+    parser.add_argument("--crash-at", type=float, default=0.5, help="share of the audience sent before the simulated crash; 0 skips it")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
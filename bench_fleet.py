@@ -0,0 +1,72 @@
+# Provisions --locations locations against the fake Retell API
+# (fake_retell.py) for each --concurrency, then, at the last concurrency,
+# reruns with nothing changed and again after renaming --changed of the
+# locations, to show that unchanged agents cost no Retell requests.
+#
+# In-memory database (fake_database.py); --latency-ms is the fake Retell
+# response time and --rate-limit the share of requests answered 429.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_fleet --locations 100 --concurrency 1,20
+#     python -m api.bench_fleet --locations 500 --concurrency 50 --rate-limit 0.1
+
+import argparse
+import asyncio
+import os
+import time
+
+
+async def provision(label, store, fake, concurrency):
+    from .bootstrap import provision_fleet, summarize
+    client = fake.client()
+    started = time.perf_counter()
+    try:
+        results = await provision_fleet(client, concurrency=concurrency)
+    finally:
+        await client.close()
+    elapsed = time.perf_counter() - started
+    counts = ", ".join(f"{count} {action}" for action, count in sorted(summarize(results).items()))
+    print(f"{label:<22}{elapsed:>9.2f}{client.stats['requests']:>10}{client.stats['retries']:>9}  {counts}")
+    return results
+
+
+async def run(args):
+    os.environ.setdefault("RETELL_PUBLIC_URL", "https://bench.example")
+    from . import fake_database
+    from .fake_retell import FakeRetell
+
+    print(f"{args.locations} locations, fake Retell {args.latency_ms:g} ms/request, {args.rate_limit:.0%} answered 429")
+    print(f"{'run':<22}{'seconds':>9}{'requests':>10}{'retries':>9}  outcome")
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        store = fake_database.install(latency=args.db_latency_ms / 1000)
+        store.add_locations(args.locations)
+        fake = FakeRetell(latency=args.latency_ms / 1000, rate_limit=args.rate_limit, seed=args.seed)
+        await provision(f"fresh, concurrency {concurrency}", store, fake, concurrency)
+
+    await provision("rerun, unchanged", store, fake, concurrency)
+    for location in list(store.locations.values())[:args.changed]:
+        location["name"] += " (renamed)"
+    await provision(f"rerun, {args.changed} renamed", store, fake, concurrency)
+
+    live = sum(1 for agent in fake.agents.values() if agent["published_version"] == agent["version"])
+    numbers = set(store.numbers.values())
+    print(f"fake Retell: {len(fake.agents)} agents ({live} published at their latest version), {len(fake.numbers)} numbers; "
+          f"database: {len(store.agents)} agents, {len(numbers)} with a number")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fleet provisioning benchmark against a fake Retell API")
+    parser.add_argument("--locations", type=int, default=100)
+    parser.add_argument("--concurrency", default="1,20", help="comma-separated values to compare")
+    parser.add_argument("--changed", type=int, default=10, help="locations renamed before the last rerun")
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--rate-limit", type=float, default=0.05)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
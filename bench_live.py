@@ -0,0 +1,95 @@
+# Fan-out cost of the live call board (live.py). --subscribers boards are
+# spread over --restaurants restaurants, each read by its own task the way
+# the SSE endpoint reads it, plus --slow boards per restaurant that never
+# read. --calls calls per restaurant then publish --events transcript
+# fragments between them.
+#
+# Reports the memory an idle subscriber costs, time per event to publish
+# it and for every reader to take it, whether every reading board got
+# every event, that the slow ones were dropped, and how many NOTIFYs the
+# events would take between workers.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_live --subscribers 5000
+#     python -m api.bench_live --subscribers 20000 --restaurants 50 --events 50000
+
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+
+async def reader(subscriber, received):
+    while True:
+        frames = await subscriber.next()
+        if frames is None:
+            return
+        received[0] += len(frames)
+
+
+async def run(args):
+    from .live import LiveBoard, LIVE_BUFFER, _batches
+    from .tools import dumps
+    board = LiveBoard()
+    received = [0]
+    restaurants = list(range(1, args.restaurants + 1))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    readers = []
+    for i in range(args.subscribers):
+        readers.append(asyncio.ensure_future(reader(board.subscribe(restaurants[i % len(restaurants)]), received)))
+    await asyncio.sleep(0)  # every reader parked on its future
+    idle = (tracemalloc.get_traced_memory()[0] - before) / max(1, args.subscribers)
+    tracemalloc.stop()
+    slow = [board.subscribe(restaurant_id) for restaurant_id in restaurants for _ in range(args.slow)]
+
+    for restaurant_id in restaurants:
+        for c in range(args.calls):
+            board.apply({"type": "call.started", "call_id": f"call_{restaurant_id}_{c}", "restaurant_id": restaurant_id,
+                         "at": time.time(), "from_number": "+14155550100"})
+    calls = [f"call_{restaurant_id}_{c}" for restaurant_id in restaurants for c in range(args.calls)]
+    events = [{"type": "transcript", "call_id": calls[i % len(calls)], "restaurant_id": None, "at": time.time(),
+               "text": f"caller words {i} "} for i in range(args.events)]
+    await asyncio.sleep(0)
+    received[0] = 0
+
+    started = time.perf_counter()
+    for n, event in enumerate(events, 1):
+        board.apply(event)
+        if n % args.yield_every == 0:
+            # Let readers run, as the event loop would between requests
+            await asyncio.sleep(0)
+    published = time.perf_counter() - started
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    per_restaurant = args.subscribers / len(restaurants)
+    expected = round(args.events * per_restaurant)
+    notifies = sum(1 for _ in _batches(dumps(event) for event in events))
+    print(f"{args.subscribers} subscribers over {len(restaurants)} restaurants ({per_restaurant:.0f} each), "
+          f"{args.slow} slow per restaurant, buffer {LIVE_BUFFER}")
+    print(f"idle subscriber      {idle / 1024:>8.2f} KiB  (board entry + parked reader task)")
+    print(f"publish + read       {published / args.events * 1e6:>8.1f} µs per event  ({published * 1e9 / max(1, expected):.0f} ns per delivery)")
+    print(f"delivered            {received[0]:>8} of {expected}")
+    print(f"slow boards dropped  {sum(subscriber.dropped for subscriber in slow):>8} of {len(slow)}")
+    print(f"NOTIFYs              {notifies:>8} for {args.events} events")
+    for task in readers:
+        task.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live call board fan-out benchmark")
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--restaurants", type=int, default=100)
+    parser.add_argument("--slow", type=int, default=1, help="boards per restaurant that never read")
+    parser.add_argument("--calls", type=int, default=5, help="calls in progress per restaurant")
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--yield-every", type=int, default=50, help="events published between event loop turns")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# Scripted Retell client for the custom-LLM websocket. Plays a few short
+# calls turn by turn and reports time-to-first-chunk (what the caller hears
+# as response latency) for the greeting, plain answers and answers that
+# needed a tool, plus a barge-in check: the caller speaks over an answer
+# and no chunk of the stale response may arrive after the new request.
+#
+# In-process by default (TestClient, fake_database.py, stub LLM unless
+# LLM_PROVIDER is set); --url targets a running server and needs the
+# `websockets` package.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_llm_socket --calls 20
+#     python -m api.bench_llm_socket --url ws://localhost:8000 --agent-id agent_123
+
+import argparse
+import json
+import os
+import time
+import uuid
+
+SCRIPT = [
+    "Hi, what's on the vegetarian menu?",
+    "Lovely, thank you.",
+    "Can I book a table for four tomorrow?",
+    "That's all, thanks.",
+]
+WEBSOCKET_PATH = "/api/voice/retell/llm-websocket/"
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Connection:
+    def __init__(self, socket, sync_client):
+        self.socket = socket
+        self.sync_client = sync_client
+
+    def send(self, message):
+        if self.sync_client:
+            self.socket.send(json.dumps(message))
+        else:
+            self.socket.send_text(json.dumps(message))
+
+    def receive(self):
+        return json.loads(self.socket.recv() if self.sync_client else self.socket.receive_text())
+
+
+def read_response(conn, response_id, sent_at):
+    # Returns (first chunk seconds, complete seconds, used a tool, stale chunks)
+    first = None
+    used_tool = False
+    stale = 0
+    while True:
+        message = conn.receive()
+        kind = message.get("response_type")
+        if kind == "tool_call_invocation":
+            used_tool = True
+        if kind != "response":
+            continue
+        if message["response_id"] != response_id:
+            stale += 1
+            continue
+        if message["content"] and first is None:
+            first = time.perf_counter() - sent_at
+        if message["content_complete"]:
+            return first, time.perf_counter() - sent_at, used_tool, stale
+
+
+def play_call(conn, agent_id, results):
+    assert conn.receive()["response_type"] == "config"
+    sent_at = time.perf_counter()
+    conn.send({"interaction_type": "call_details", "call": {"agent_id": agent_id}})
+    first, _, _, _ = read_response(conn, 0, sent_at)
+    results["greeting"].append(first)
+
+    transcript = []
+    for response_id, utterance in enumerate(SCRIPT, start=1):
+        transcript.append({"role": "user", "content": utterance})
+        sent_at = time.perf_counter()
+        conn.send({"interaction_type": "response_required", "response_id": response_id, "transcript": transcript})
+        first, complete, used_tool, _ = read_response(conn, response_id, sent_at)
+        results["tool turn" if used_tool else "plain turn"].append(first)
+        results["full response"].append(complete)
+        transcript.append({"role": "agent", "content": "..."})
+
+    # Barge-in: interrupt a tool answer after its first chunk
+    barge_id = len(SCRIPT) + 1
+    transcript.append({"role": "user", "content": "Do you have anything spicy on the menu?"})
+    conn.send({"interaction_type": "response_required", "response_id": barge_id, "transcript": transcript})
+    while True:
+        message = conn.receive()
+        if message.get("response_type") == "response" and message["content"]:
+            break
+    conn.send({"interaction_type": "update_only", "turntaking": "user_turn", "transcript": transcript})
+    transcript.append({"role": "user", "content": "Actually, never mind."})
+    sent_at = time.perf_counter()
+    conn.send({"interaction_type": "response_required", "response_id": barge_id + 1, "transcript": transcript})
+    first, _, _, stale = read_response(conn, barge_id + 1, sent_at)
+    results["after barge-in"].append(first)
+    results["stale chunks"].append(stale)
+
+
+def run_in_process(args, results):
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from . import fake_database
+    fake_database.install(latency=args.db_latency_ms / 1000)
+    from fastapi.testclient import TestClient
+    from .main import app
+    with TestClient(app) as client:
+        for _ in range(args.calls):
+            with client.websocket_connect(WEBSOCKET_PATH + f"bench-{uuid.uuid4().hex[:8]}") as socket:
+                play_call(Connection(socket, False), args.agent_id or fake_database.LOAD_TEST_AGENT_ID, results)
+
+
+def run_remote(args, results):
+    from websockets.sync.client import connect
+    for _ in range(args.calls):
+        with connect(args.url.rstrip("/") + WEBSOCKET_PATH + f"bench-{uuid.uuid4().hex[:8]}") as socket:
+            play_call(Connection(socket, True), args.agent_id, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM websocket time-to-first-chunk benchmark")
+    parser.add_argument("--url", help="ws:// base URL of a running server; omit to run in-process")
+    parser.add_argument("--agent-id", default=None)
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    results = {name: [] for name in ("greeting", "plain turn", "tool turn", "full response", "after barge-in", "stale chunks")}
+    (run_remote if args.url else run_in_process)(args, results)
+
+    print(f"{'time to first chunk':<22}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    for name, values in results.items():
+        if name == "stale chunks" or not values:
+            continue
+        ordered = sorted(values)
+        print(f"{name:<22}{len(ordered):>7}{percentile(ordered, 0.5) * 1000:>9.1f}{percentile(ordered, 0.95) * 1000:>9.1f}{ordered[-1] * 1000:>9.1f}")
+    print(f"stale chunks after barge-in: {sum(results['stale chunks'])}")
+
+
+if __name__ == "__main__":
+    main()
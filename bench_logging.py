@@ -0,0 +1,104 @@
+# Handler throughput with logging off, with a synchronous stdout handler
+# (what print() did), and with the queue-backed handler from logs.py.
+#
+# Each iteration runs a no-op tool through tools.dispatch_tool and emits the
+# same kind of records a real call produces: one per tool call plus a burst
+# of transcript.delta records. Both logging modes use StructuredFormatter;
+# the sink sleeps --sink-latency-ms per write to stand in for a stdout pipe
+# that the log collector is draining slowly.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_logging --iterations 5000 --sink-latency-ms 0.2
+
+import argparse
+import asyncio
+import logging
+import time
+from . import logs, tools
+from .models import CreateReservationPayload
+
+logger = logging.getLogger(f"{__package__}.bench" if __package__ else "bench")
+
+PARAMETERS = {"datetime": "2030-05-01T19:30:00", "party_size": 4, "name": "Sam Doe", "phone": "+1 555 555 0100"}
+
+
+async def handler(payload):
+    logger.info("Executing create_reservation for %s on %s", payload.party_size, payload.datetime,
+                extra={"tool": "create_reservation", "customer_name": payload.name, "customer_phone": payload.phone})
+    for i in range(5):
+        logger.info("Transcript delta", extra={"event": "transcript.delta", "transcript": f"caller said something {i}"})
+    return {"status": "success"}
+
+
+class SlowSink:
+    def __init__(self, latency):
+        self.latency = latency
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def flush(self):
+        pass
+
+
+def reset_logger():
+    package_logger = logging.getLogger(__package__ or None)
+    for existing in list(package_logger.handlers):
+        package_logger.removeHandler(existing)
+    logs.shutdown_logging()
+    return package_logger
+
+
+async def measure(iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await tools.dispatch_tool("create_reservation", PARAMETERS)
+    return iterations / (time.perf_counter() - started)
+
+
+async def run(iterations, sink_latency):
+    tools.TOOLS.clear()
+    tools.register_tool("create_reservation", CreateReservationPayload)(handler)
+    results = {}
+
+    package_logger = reset_logger()
+    package_logger.setLevel(logging.CRITICAL)
+    results["logging off"] = await measure(iterations)
+
+    # Synchronous: every record, formatted and written on the event loop
+    package_logger = reset_logger()
+    sync_handler = logging.StreamHandler(SlowSink(sink_latency))
+    sync_handler.setFormatter(logs.StructuredFormatter())
+    package_logger.addHandler(sync_handler)
+    package_logger.setLevel(logging.INFO)
+    package_logger.propagate = False
+    results["synchronous stream"] = await measure(iterations)
+
+    # Queued: sampling on the loop, formatting and writes on the listener thread
+    reset_logger()
+    sink = SlowSink(sink_latency)
+    logs.setup_logging(stream=sink)
+    results["queue + sampling"] = await measure(iterations)
+    dropped = logs.logging_stats()["dropped"]
+    logs.shutdown_logging()
+
+    baseline = results["logging off"]
+    print(f"{'mode':<22}{'calls/s':>12}{'vs off':>10}")
+    for mode, rate in results.items():
+        print(f"{mode:<22}{rate:>12,.0f}{rate / baseline:>9.0%}")
+    print(f"queued records written: {sink.writes}, dropped by full queue: {dropped}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Logging overhead benchmark")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--sink-latency-ms", type=float, default=0.2)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations, args.sink_latency_ms / 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Accuracy and latency of resolve_menu_item's index on a synthetic menu.
+#
+# Builds a --items menu from sizes x styles x proteins x dishes, then asks
+# for random items the way a caller (through speech-to-text) would: extra
+# filler words, dropped size/style words, and sound-alike misspellings.
+# Reports top-1 / top-5 accuracy and per-lookup latency, against a difflib
+# scan over all names as the baseline, plus index build and incremental
+# update cost.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_menu_search --items 2000 --queries 2000
+
+import argparse
+import difflib
+import random
+import re
+import time
+from .menu_search import MenuSearchIndex, normalize
+
+SIZES = ["Small", "Regular", "Large", "Family"]
+STYLES = ["Classic", "Spicy", "Crispy", "Smoked", "Garlic", "House", "Grilled", "Creamy", "Tandoori", "Stuffed"]
+PROTEINS = ["Chicken", "Lamb", "Paneer", "Shrimp", "Beef", "Tofu", "Mushroom", "Pork", "Salmon", "Veggie", "Chickpea", "Duck"]
+DISHES = [
+    "Tikka Masala", "Korma", "Vindaloo", "Margherita Pizza", "Pepperoni Pizza", "Carbonara", "Alfredo",
+    "Pad Thai", "Burrito", "Tacos", "Caesar Salad", "Gnocchi", "Risotto", "Biryani", "Ramen", "Pho",
+    "Quesadilla", "Shawarma Wrap", "Gyoza", "Teriyaki Bowl", "Schnitzel", "Bruschetta", "Focaccia",
+    "Chow Mein", "Bibimbap", "Goulash", "Paella", "Jambalaya", "Lasagne", "Moussaka",
+]
+TAGS = ["vegetarian", "vegan", "spicy", "gluten-free", "popular", "kids"]
+FILLERS = ["", "the ", "can i get the ", "i'd like a ", "one ", "could i have the "]
+# Sound-alike spellings speech-to-text produces
+MISHEARINGS = [
+    (r"ph", "f"), (r"ck", "k"), (r"([a-z])\1", r"\1"), (r"qu", "kw"), (r"gh", "g"), (r"c([aou])", r"k\1"),
+    (r"ee", "i"), (r"ai", "ay"), (r"ie", "ee"), (r"tion", "shun"), (r"gn", "ny"), (r"sch", "sh"), (r"z", "s"),
+]
+
+
+def build_menu(count, rng):
+    names = set()
+    while len(names) < count:
+        parts = [rng.choice(SIZES) if rng.random() < 0.5 else "", rng.choice(STYLES) if rng.random() < 0.6 else "", rng.choice(PROTEINS), rng.choice(DISHES)]
+        names.add(" ".join(part for part in parts if part))
+    return [
+        {
+            "id": item_id,
+            "name": name,
+            "description": f"{name.split()[-1]} made fresh to order",
+            "tags": rng.sample(TAGS, rng.randint(0, 2)),
+            "price": 10.0,
+            "is_available": True,
+            "is_86d": False,
+        }
+        for item_id, name in enumerate(sorted(names), start=1)
+    ]
+
+
+def spoken(name, rng):
+    words = normalize(name).split()
+    # Callers often leave out the size or style
+    if len(words) > 3 and rng.random() < 0.3:
+        words.pop(0)
+    text = " ".join(words)
+    for pattern, replacement in rng.sample(MISHEARINGS, 3):
+        if rng.random() < 0.6:
+            text = re.sub(pattern, replacement, text, count=1)
+    return rng.choice(FILLERS) + text
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def evaluate(label, search, cases):
+    top1 = top5 = 0
+    latencies = []
+    for query, acceptable in cases:
+        started = time.perf_counter()
+        ranked = search(query)
+        latencies.append(time.perf_counter() - started)
+        if ranked and ranked[0] in acceptable:
+            top1 += 1
+        if acceptable.intersection(ranked[:5]):
+            top5 += 1
+    latencies.sort()
+    print(f"{label:<16}{top1 / len(cases):>8.1%}{top5 / len(cases):>8.1%}"
+          f"{percentile(latencies, 0.5) * 1000:>10.3f}{percentile(latencies, 0.99) * 1000:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Menu item resolution benchmark")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    menu = build_menu(args.items, rng)
+    started = time.perf_counter()
+    index = MenuSearchIndex(menu)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    # A query counts as resolved if it lands on any item with the same
+    # normalized name once the dropped words are accounted for
+    by_name = {}
+    for item in menu:
+        by_name.setdefault(normalize(item["name"]), set()).add(item["id"])
+    cases = []
+    for _ in range(args.queries):
+        item = rng.choice(menu)
+        words = normalize(item["name"]).split()
+        acceptable = {item["id"]} | {i for name, ids in by_name.items() if name.endswith(" ".join(words[1:])) and len(words) > 3 for i in ids}
+        cases.append((spoken(item["name"], rng), acceptable))
+
+    names = {item["id"]: normalize(item["name"]) for item in menu}
+    name_list = list(names.items())
+
+    def difflib_search(query):
+        query = normalize(query)
+        scored = sorted(name_list, key=lambda pair: difflib.SequenceMatcher(None, query, pair[1]).ratio(), reverse=True)
+        return [item_id for item_id, _ in scored[:5]]
+
+    def index_search(query):
+        return [item_id for item_id, _ in index.search(query, 5)]
+
+    print(f"{args.items} items, {args.queries} spoken queries, e.g. {cases[0][0]!r}")
+    print(f"{'method':<16}{'top-1':>8}{'top-5':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    evaluate("index", index_search, cases)
+    evaluate("difflib scan", difflib_search, cases[:200])
+
+    started = time.perf_counter()
+    for item in rng.sample(menu, 200):
+        index.add({**item, "name": item["name"] + " Special"})
+    update_us = (time.perf_counter() - started) / 200 * 1e6
+    print(f"index build {build_ms:.0f} ms, incremental upsert {update_us:.0f} us/item")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Cost of the metrics on the request path: a single histogram observation,
+# an in-flight gauge enter/exit, and a full /metrics render.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_metrics --iterations 1000000
+
+import argparse
+import time
+from .metrics import Histogram, Gauge, render_metrics
+
+
+def per_call_ns(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics overhead benchmark")
+    parser.add_argument("--iterations", type=int, default=1000000)
+    args = parser.parse_args()
+
+    histogram = Histogram("bench_latency_seconds", "Benchmark histogram.", ("tool",))
+    gauge = Gauge("bench_in_flight", "Benchmark gauge.", ("handler",))
+    samples = [0.0004, 0.003, 0.02, 0.15, 1.7]
+
+    def observe():
+        histogram.since(time.perf_counter() - samples[0], "get_menu")
+
+    def track():
+        with gauge.track("retell_action"):
+            pass
+
+    baseline = per_call_ns(lambda: time.perf_counter(), args.iterations)
+    print(f"perf_counter() baseline   {baseline:8.0f} ns")
+    print(f"histogram observation     {per_call_ns(observe, args.iterations):8.0f} ns")
+    print(f"in-flight gauge enter/exit {per_call_ns(track, args.iterations):7.0f} ns")
+
+    for i in range(50):
+        for sample in samples:
+            histogram.observe(sample, f"tool_{i}")
+    started = time.perf_counter()
+    text = render_metrics()
+    print(f"render with {text.count(chr(10))} lines   {(time.perf_counter() - started) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
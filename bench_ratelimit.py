@@ -0,0 +1,110 @@
+# Replays simulated Retell traffic through --workers rate limiters (one per
+# worker process, requests spread round-robin as a load balancer would) and
+# reports what each flood got through against the configured limit, and how
+# many well-behaved requests were wrongly rejected. Each scenario runs with
+# workers limiting on their own and sharing usage through
+# MemoryUsageBackend, the local stand-in for the rate_limit_usage table.
+#
+# Time is simulated, so --seconds of traffic replay in well under that.
+# Finishes with the cost of one admit() call.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_ratelimit --workers 4
+#     python -m api.bench_ratelimit --workers 8 --sync-interval 0.25
+
+import argparse
+import asyncio
+import time
+from itertools import cycle
+
+
+def arrivals(sources, seconds):
+    # sources: [(rate per second, restaurant, agent, caller, flood?)] ->
+    # time-ordered [(t, restaurant, agent, caller, flood?)], evenly spaced
+    events = []
+    for rate, *identity in sources:
+        step = 1.0 / rate
+        events.extend((i * step, *identity) for i in range(int(seconds * rate)))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+async def replay(events, workers, shared, sync_interval, limits):
+    from .ratelimit import RateLimiter, MemoryUsageBackend
+    totals = {}
+    limiters = [
+        RateLimiter(limits, backend=MemoryUsageBackend(totals, stale_after=4 * sync_interval) if shared else None)
+        for _ in range(workers)
+    ]
+    admitted = {True: 0, False: 0}
+    rejected = {True: 0, False: 0}
+    next_sync = sync_interval
+    for (t, restaurant, agent, caller, flood), limiter in zip(events, cycle(limiters)):
+        while t >= next_sync:
+            for each in limiters:
+                await each.sync(now=next_sync)
+            next_sync += sync_interval
+        if limiter.admit((("restaurant", restaurant), ("agent", agent), ("caller", caller)), now=t) is None:
+            admitted[flood] += 1
+        else:
+            rejected[flood] += 1
+    return admitted, rejected
+
+
+async def scenario(label, sources, limit, args, limits):
+    events = arrivals(sources, args.seconds)
+    offered = sum(rate for rate, *_, flood in sources if flood)
+    for shared in (False, True):
+        admitted, rejected = await replay(events, args.workers, shared, args.sync_interval, limits)
+        normal = admitted[False] + rejected[False]
+        print(f"{label:<26}{'shared' if shared else 'local':<8}{offered:>9.0f}{limit:>8.0f}"
+              f"{admitted[True] / args.seconds:>10.1f}{rejected[False]:>8}/{normal:<8}")
+
+
+async def run(args):
+    from .ratelimit import LIMITS, RateLimiter
+    caller_rate = LIMITS["caller"][0]
+    restaurant_rate = LIMITS["restaurant"][0]
+    # Ordinary traffic: --restaurants restaurants with --calls live calls
+    # each, every call sending a few events a second
+    normal = [
+        (4.0, r, f"agent_{r}", f"+1415{r:03d}{c:04d}", False)
+        for r in range(1, args.restaurants + 1) for c in range(args.calls)
+    ]
+    print(f"{args.workers} workers, {args.seconds:g} s simulated, sync every {args.sync_interval:g} s")
+    print(f"{'scenario':<26}{'limits':<8}{'offered':>9}{'limit':>8}{'admitted':>10}  false rejects")
+    await scenario(
+        "one caller flooding", normal + [(args.flood, 1, "agent_1", "+19995550000", True)],
+        caller_rate, args, LIMITS,
+    )
+    flood_callers = int(args.flood / 2)
+    await scenario(
+        "one restaurant flooding",
+        normal + [(2.0, 999, "agent_999", f"+1999{c:07d}", True) for c in range(flood_callers)],
+        restaurant_rate, args, LIMITS,
+    )
+
+    limiter = RateLimiter(LIMITS)
+    keys = [(("restaurant", r % 50), ("agent", f"agent_{r % 50}"), ("caller", f"+1415{r:07d}")) for r in range(10000)]
+    started = time.perf_counter()
+    for i in range(args.admits):
+        limiter.admit(keys[i % len(keys)])
+    elapsed = time.perf_counter() - started
+    print(f"admit(): {elapsed / args.admits * 1e6:.2f} µs per call over {len(limiter._buckets)} buckets")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate limiter benchmark on simulated Retell traffic")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--sync-interval", type=float, default=0.5)
+    parser.add_argument("--restaurants", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=5, help="live calls per restaurant")
+    parser.add_argument("--flood", type=float, default=500.0, help="requests per second from each flood")
+    parser.add_argument("--admits", type=int, default=200000)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# Schedules --reminders reminders over a --spread second window and reports
+# dispatch lag (delivery time minus due_at) and double/missed deliveries
+# with --workers dispatchers sharing the table, as separate replicas would.
+# Half the reminders exist before the dispatchers start; the rest are
+# inserted while they run, --notice seconds before they are due, so both
+# the heap sync and the NOTIFY path are exercised. --failure-rate of first
+# delivery attempts fail, so those reminders are only delivered once their
+# --lease runs out and another claim picks them up. --poll-interval adds a
+# run of the same dispatchers polling on a fixed interval instead of
+# sleeping until the next due_at.
+#
+# In-memory by default (fake_database.py, which publishes the reminder
+# insert notification itself and models leases and attempts, but not row
+# locks or the server's clock). Claim correctness -- exactly one delivery
+# per reminder with several dispatchers, failed ones re-leased -- is
+# verified with --db postgres, which needs DATABASE_URL with schema.sql
+# applied and uses a throwaway restaurant.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_reminders --reminders 100000 --workers 3
+#     python -m api.bench_reminders --reminders 20000 --poll-interval 1
+#     python -m api.bench_reminders --db postgres --reminders 20000 --workers 4 --failure-rate 0.05
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+INSERT_QUERY = "INSERT INTO reminders (restaurant_id, assignee, due_at, payload, is_completed) VALUES ($1, $2, $3, $4, FALSE) RETURNING id"
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def insert_reminders(restaurant_id, dues, concurrency=100):
+    from .database import fetch_one
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(due):
+        async with slots:
+            await fetch_one(INSERT_QUERY, restaurant_id, "chef", datetime.fromtimestamp(due, timezone.utc), '{"note": "bench"}')
+
+    await asyncio.gather(*(one(due) for due in dues))
+
+
+async def run_once(args, label, poll_interval=None):
+    from . import reminders
+    from .database import fetch_one, execute_query
+    from .notifications import subscribe, start_listener, stop_listener
+
+    store = None
+    if args.db == "memory":
+        from . import fake_database
+        store = fake_database.install(latency=args.db_latency_ms / 1000)
+        restaurant_id = fake_database.LOAD_TEST_RESTAURANT_ID
+    else:
+        row = await fetch_one("INSERT INTO restaurants (name, api_key) VALUES ($1, $2) RETURNING id", "Reminder benchmark", f"bench-{os.urandom(8).hex()}")
+        restaurant_id = row["id"]
+
+    deliveries = {}  # reminder id -> [lag seconds, ...]
+    failures = random.Random(args.seed + 1)
+
+    async def record(reminder):
+        if reminder["attempts"] == 1 and failures.random() < args.failure_rate:
+            raise RuntimeError("bench delivery failure")
+        due = reminder["due_at"].timestamp()
+        deliveries.setdefault(reminder["id"], []).append(time.time() - due)
+
+    class PollingDispatcher(reminders.ReminderDispatcher):
+        async def run(self):
+            while True:
+                await self.dispatch_due(time.time())
+                await asyncio.sleep(poll_interval)
+
+    # --lead has to cover writing the preload, or its first reminders are
+    # already overdue when the dispatchers start
+    rng = random.Random(args.seed)
+    start = time.time() + args.lead
+    dues = sorted(start + rng.uniform(0, args.spread) for _ in range(args.reminders))
+    preload, live = dues[::2], dues[1::2]
+    await insert_reminders(restaurant_id, preload)
+    if time.time() > start:
+        print(f"warning: preload took {time.time() - start + args.lead:.1f}s, longer than --lead")
+
+    dispatcher_class = PollingDispatcher if poll_interval else reminders.ReminderDispatcher
+    dispatchers = [dispatcher_class(deliver=record, batch_size=args.batch_size) for _ in range(args.workers)]
+    for dispatcher in dispatchers:
+        await subscribe(reminders.NOTIFY_CHANNEL, dispatcher.on_notify, on_reset=dispatcher.request_resync)
+    if args.db == "postgres":
+        await start_listener()
+    for dispatcher in dispatchers:
+        dispatcher.start()
+
+    try:
+        # Live inserts land while earlier reminders are already going out,
+        # each about --notice seconds before it is due
+        for chunk_start in range(0, len(live), 200):
+            chunk = live[chunk_start:chunk_start + 200]
+            delay = chunk[0] - args.notice - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await insert_reminders(restaurant_id, chunk, concurrency=10)
+        deadline = start + args.spread + 30
+        while len(deliveries) < args.reminders and time.time() < deadline:
+            await asyncio.sleep(0.2)
+    finally:
+        for dispatcher in dispatchers:
+            await dispatcher.stop()
+        if args.db == "postgres":
+            await stop_listener()
+            await execute_query("DELETE FROM restaurants WHERE id = $1", restaurant_id)
+
+    lags = sorted(lag for lags in deliveries.values() for lag in lags)
+    duplicates = sum(len(lags) - 1 for lags in deliveries.values())
+    missing = args.reminders - len(deliveries)
+    claims = sum(d.stats["claims"] for d in dispatchers)
+    retried = sum(d.stats["failed"] for d in dispatchers)
+    print(f"{label:<18}{len(deliveries):>10}{duplicates:>6}{missing:>8}{retried:>8}"
+          f"{percentile(lags, 0.5) * 1000:>9.1f}{percentile(lags, 0.95) * 1000:>9.1f}"
+          f"{percentile(lags, 0.99) * 1000:>9.1f}{lags[-1] * 1000:>9.1f}{claims:>8}"
+          + (f"{store.statements:>12}" if store else ""))
+
+
+async def run(args):
+    if args.db == "postgres":
+        from .database import init_pool, close_pool
+        await init_pool()
+    from . import reminders
+    # Read at claim time, so a short lease brings failed reminders back
+    # within the run
+    reminders.REMINDER_CLAIM_LEASE = args.lease
+    print(f"{args.reminders} reminders due over {args.spread:.0f}s, {args.workers} dispatchers, batch {args.batch_size}, "
+          f"{args.failure_rate:.1%} first attempts fail, lease {args.lease:g}s")
+    print(f"{'dispatcher':<18}{'delivered':>10}{'dupes':>6}{'missing':>8}{'retried':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'claims':>8}"
+          + ("  statements" if args.db == "memory" else ""))
+    try:
+        await run_once(args, "heap + notify")
+        if args.poll_interval:
+            await run_once(args, f"poll every {args.poll_interval:g}s", poll_interval=args.poll_interval)
+    finally:
+        if args.db == "postgres":
+            await close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reminder dispatch lag benchmark")
+    parser.add_argument("--reminders", type=int, default=100000)
+    parser.add_argument("--spread", type=float, default=20.0, help="seconds over which reminders fall due")
+    parser.add_argument("--lead", type=float, default=15.0, help="seconds before the first reminder is due")
+    parser.add_argument("--notice", type=float, default=2.0, help="seconds between a live insert and its due_at")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--failure-rate", type=float, default=0.01, help="share of first delivery attempts that fail")
+    parser.add_argument("--lease", type=float, default=2.0, help="REMINDER_CLAIM_LEASE for the run, seconds")
+    parser.add_argument("--poll-interval", type=float, default=0.0)
+    parser.add_argument("--db", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
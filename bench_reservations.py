@@ -0,0 +1,108 @@
+# Hammers a single reservation slot with concurrent create_reservation
+# payloads and checks that capacity is never exceeded.
+#
+# Needs a Postgres with schema.sql applied (DATABASE_URL). A throwaway
+# restaurant is created for the run and deleted afterwards.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_reservations --requests 500 --max-covers 40
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import date, datetime, timedelta
+from .database import init_pool, close_pool, fetch_one, execute_query
+from .models import CreateReservationPayload
+from .reservations import book_reservation, SlotUnavailableError
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def setup(max_covers, dining_minutes):
+    restaurant = await fetch_one(
+        "INSERT INTO restaurants (name, api_key) VALUES ($1, $2) RETURNING id",
+        "Reservation benchmark", f"bench-{os.urandom(8).hex()}"
+    )
+    restaurant_id = restaurant["id"]
+    await execute_query(
+        "INSERT INTO locations (restaurant_id, name, timezone) VALUES ($1, $2, $3)",
+        restaurant_id, "Bench", "UTC"
+    )
+    await execute_query(
+        "INSERT INTO reservation_settings (restaurant_id, max_covers, slot_minutes, dining_minutes) VALUES ($1, $2, 15, $3)",
+        restaurant_id, max_covers, dining_minutes
+    )
+    for day_of_week in range(1, 8):
+        await execute_query(
+            "INSERT INTO opening_hours (restaurant_id, day_of_week, open_time, close_time) VALUES ($1, $2, '17:00', '23:00')",
+            restaurant_id, day_of_week
+        )
+    return restaurant_id
+
+
+async def run(args):
+    await init_pool()
+    restaurant_id = await setup(args.max_covers, args.dining_minutes)
+    slot = datetime.combine(date.today() + timedelta(days=7), datetime.min.time()).replace(hour=19)
+    payloads = [
+        CreateReservationPayload(datetime=slot, party_size=args.party_size, name=f"Guest {i}", phone=f"+1555{i:07d}")
+        for i in range(args.requests)
+    ]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    outcomes = {"booked": 0, "rejected": 0, "errors": 0}
+
+    async def attempt(payload):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await book_reservation(restaurant_id, payload.datetime, payload.party_size, payload.name, payload.phone)
+                outcomes["booked"] += 1
+            except SlotUnavailableError:
+                outcomes["rejected"] += 1
+            except Exception as e:
+                outcomes["errors"] += 1
+                print(f"Reservation failed: {e}")
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(attempt(payload) for payload in payloads))
+        elapsed = time.perf_counter() - started
+
+        booked = await fetch_one(
+            "SELECT COALESCE(SUM(party_size), 0) AS covers FROM reservations WHERE restaurant_id = $1 AND datetime = $2",
+            restaurant_id, slot
+        )
+        overbooked = max(0, booked["covers"] - args.max_covers)
+
+        print(f"{args.requests} requests for one slot, concurrency {args.concurrency}, capacity {args.max_covers} covers")
+        print(f"throughput   {args.requests / elapsed:,.0f} req/s")
+        print(f"latency p50  {percentile(latencies, 50) * 1000:.1f} ms")
+        print(f"latency p99  {percentile(latencies, 99) * 1000:.1f} ms")
+        print(f"booked       {outcomes['booked']} ({booked['covers']} covers), rejected {outcomes['rejected']}, errors {outcomes['errors']}")
+        print(f"overbooked   {overbooked} covers")
+        return 1 if overbooked else 0
+    finally:
+        await execute_query("DELETE FROM restaurants WHERE id = $1", restaurant_id)
+        await close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent reservation benchmark")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--party-size", type=int, default=2)
+    parser.add_argument("--max-covers", type=int, default=40)
+    parser.add_argument("--dining-minutes", type=int, default=90)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Concurrent updates to shared call sessions (sessions.py). --workers
+# SessionStores, each with its own local tier, share one
+# MemorySessionBackend the way uvicorn workers share call_sessions. Every
+# worker adds its own items to the same --calls calls at once, so most
+# writes race; the check is that no update that returned is lost, and what
+# the compare-and-set retries cost. Updates that ran out of retries raised
+# to their caller and are counted separately.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_sessions --workers 4 --updates 50
+#     python -m api.bench_sessions --workers 16 --latency-ms 2
+
+import argparse
+import asyncio
+import time
+
+
+async def worker(store, worker_id, calls, updates, gave_up):
+    from .sessions import SessionConflictError
+    for n in range(updates):
+        for call_id in calls:
+            def add(state, item=f"w{worker_id}-{n}"):
+                state.setdefault("items", {})[item] = {"name": item, "qty": 1}
+            try:
+                await store.update(call_id, add)
+            except SessionConflictError:
+                gave_up.append(call_id)
+
+
+async def run(args):
+    from .sessions import SessionStore, MemorySessionBackend
+    backend = MemorySessionBackend(latency=args.latency_ms / 1000)
+    stores = [SessionStore(backend) for _ in range(args.workers)]
+    calls = [f"call_{i}" for i in range(args.calls)]
+    gave_up = []
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(store, worker_id, calls, args.updates, gave_up) for worker_id, store in enumerate(stores)))
+    elapsed = time.perf_counter() - started
+
+    expected = args.workers * args.updates
+    stored = [len((await backend.get(call_id))[1].get("items", {})) for call_id in calls]
+    totals = {key: sum(store.stats[key] for store in stores) for key in stores[0].stats}
+    updates = expected * args.calls
+    print(f"{args.workers} workers x {args.calls} calls x {args.updates} updates, backend {args.latency_ms:g} ms per operation")
+    print(f"updates        {updates:>8}  in {elapsed:.2f}s ({updates / elapsed:.0f}/s)")
+    print(f"writes         {totals['writes']:>8}")
+    print(f"conflicts      {totals['conflicts']:>8}  ({totals['conflicts'] / max(1, updates):.2f} per update)")
+    print(f"local reads    {totals['local_hits']:>8}  shared reads {totals['shared_reads']}")
+    print(f"gave up        {len(gave_up):>8}  (raised SessionConflictError)")
+    print(f"lost updates   {updates - len(gave_up) - sum(stored):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Call session compare-and-set benchmark")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--calls", type=int, default=10)
+    parser.add_argument("--updates", type=int, default=50, help="updates per worker per call")
+    parser.add_argument("--latency-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
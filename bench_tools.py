@@ -0,0 +1,96 @@
+# Per-tool dispatch overhead of retell_action, with the tool bodies replaced
+# by no-ops so only routing, validation and encoding are measured.
+#
+# Compares the old path (if/elif routing, Model(**parameters), FastAPI's
+# jsonable_encoder + json.dumps) with the tools.py registry (dict lookup,
+# prebuilt TypeAdapter, direct dumps).
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_tools --iterations 20000
+
+import argparse
+import asyncio
+import json
+import time
+from fastapi.encoders import jsonable_encoder
+from . import tools
+from .models import (
+    GetMenuPayload,
+    CheckItemAvailabilityPayload,
+    CreateOrderPayload,
+    GetTimeslotsPayload,
+    CreateReservationPayload,
+    CreateReminderPayload,
+    HandoverHumanPayload
+)
+
+SAMPLES = {
+    "get_menu": (GetMenuPayload, {"tags": ["vegetarian", "spicy"]}),
+    "check_item_availability": (CheckItemAvailabilityPayload, {"item_id": "42", "qty": 2}),
+    "create_order": (CreateOrderPayload, {
+        "items": [{"item_id": str(i), "qty": 1, "notes": "no onions"} for i in range(8)],
+        "customer": {"name": "Sam Doe", "phone": "+15555550100", "email": "sam@example.com"},
+    }),
+    "get_timeslots": (GetTimeslotsPayload, {"date": "2030-05-01", "party_size": 4}),
+    "create_reservation": (CreateReservationPayload, {"datetime": "2030-05-01T19:30:00", "party_size": 4, "name": "Sam Doe", "phone": "+15555550100"}),
+    "create_reminder": (CreateReminderPayload, {"assignee": "chef", "due_at": "2030-05-01T10:00:00", "payload": {"event": "birthday", "party_size": 30}}),
+    "handover_human": (HandoverHumanPayload, {"reason": "Caller asked for a manager"}),
+}
+
+RESULT = {"status": "success", "data": [{"id": i, "name": f"Item {i}", "price": 12.5, "tags": ["a", "b"]} for i in range(20)]}
+
+
+async def _noop(payload):
+    return RESULT
+
+
+async def legacy_dispatch(tool_name, parameters):
+    # Shape of the original seven-branch chain; later branches pay for earlier misses
+    for name, (model, _) in SAMPLES.items():
+        if tool_name == name:
+            payload = model(**parameters)
+            return await _noop(payload)
+    raise ValueError(tool_name)
+
+
+async def measure(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def run(iterations):
+    tools.TOOLS.clear()
+    for name, (model, _) in SAMPLES.items():
+        tools.register_tool(name, model)(_noop)
+
+    print(f"{'tool':<26}{'legacy us':>12}{'registry us':>14}{'speedup':>10}")
+    for name, (_, parameters) in SAMPLES.items():
+        body = json.dumps({"tool_name": name, "parameters": parameters}).encode("utf-8")
+
+        async def legacy():
+            request = json.loads(body)
+            result = await legacy_dispatch(request["tool_name"], request["parameters"])
+            json.dumps(jsonable_encoder(result))
+
+        async def registry():
+            request = tools.loads(body)
+            result = await tools.dispatch_tool(request["tool_name"], request["parameters"])
+            tools.dumps(result)
+
+        before = await measure(legacy, iterations)
+        after = await measure(registry, iterations)
+        print(f"{name:<26}{before:>12.1f}{after:>14.1f}{before / after:>9.1f}x")
+    print(f"json encoder: {'orjson' if tools.orjson is not None else 'stdlib json'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tool dispatch overhead benchmark")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Write amplification of transcript storage for one long call.
+#
+# Before: every transcript.delta ran
+#     UPDATE call_logs SET transcript = COALESCE(transcript, '') || $1
+# which writes a brand new call_logs tuple (and TOAST chunks) holding the
+# whole transcript so far, so bytes written grow quadratically with length.
+# After: deltas are buffered and appended to call_transcript_segments in
+# batches, and call_logs.transcript is written once at call.ended.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bench_transcripts --minutes 20
+
+import argparse
+import random
+import string
+from .transcripts import TranscriptBuffer, TRANSCRIPT_FLUSH_SEGMENTS
+
+# Rough on-disk size of a heap tuple header plus item pointer
+TUPLE_OVERHEAD = 28
+# call_logs columns other than transcript (ids, timestamps, status, raw_event)
+CALL_LOGS_FIXED_BYTES = 600
+# call_transcript_segments columns other than the text (id, call id, seq, created_at)
+SEGMENT_FIXED_BYTES = 60
+
+
+def synthetic_deltas(minutes, seconds_per_delta, avg_chars, seed=7):
+    rng = random.Random(seed)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(500)]
+    deltas = []
+    for _ in range(int(minutes * 60 / seconds_per_delta)):
+        text = []
+        while sum(len(w) + 1 for w in text) < avg_chars:
+            text.append(rng.choice(words))
+        deltas.append(" ".join(text) + " ")
+    return deltas
+
+
+def concatenation_cost(deltas):
+    written = 0
+    transcript_len = 0
+    for delta in deltas:
+        transcript_len += len(delta.encode("utf-8"))
+        written += TUPLE_OVERHEAD + CALL_LOGS_FIXED_BYTES + transcript_len
+    return {"statements": len(deltas), "bytes_written": written, "final_bytes": transcript_len}
+
+
+def segment_cost(deltas, flush_segments):
+    buffer = TranscriptBuffer(flush_segments=flush_segments)
+    batches = 0
+    written = 0
+    transcript_len = 0
+    for delta in deltas:
+        if buffer.append("call", delta):
+            rows = buffer.drain("call")
+            batches += 1
+            for _, _, _, raw, normalized in rows:
+                written += TUPLE_OVERHEAD + SEGMENT_FIXED_BYTES + len(raw.encode("utf-8")) + len(normalized.encode("utf-8"))
+        transcript_len += len(delta.encode("utf-8"))
+    rows = buffer.drain("call")
+    if rows:
+        batches += 1
+        for _, _, _, raw, normalized in rows:
+            written += TUPLE_OVERHEAD + SEGMENT_FIXED_BYTES + len(raw.encode("utf-8")) + len(normalized.encode("utf-8"))
+    # One final call_logs update carrying the assembled transcript
+    written += TUPLE_OVERHEAD + CALL_LOGS_FIXED_BYTES + transcript_len
+    return {"statements": batches + 1, "bytes_written": written, "final_bytes": transcript_len}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcript write amplification benchmark")
+    parser.add_argument("--minutes", type=float, default=20)
+    parser.add_argument("--seconds-per-delta", type=float, default=1.5)
+    parser.add_argument("--avg-chars", type=int, default=80)
+    parser.add_argument("--flush-segments", type=int, default=TRANSCRIPT_FLUSH_SEGMENTS)
+    args = parser.parse_args()
+
+    deltas = synthetic_deltas(args.minutes, args.seconds_per_delta, args.avg_chars)
+    before = concatenation_cost(deltas)
+    after = segment_cost(deltas, args.flush_segments)
+
+    print(f"{len(deltas)} deltas over {args.minutes:g} minutes, final transcript {before['final_bytes'] / 1024:.1f} KiB")
+    print(f"{'':<24}{'statements':>12}{'bytes written':>16}{'amplification':>15}")
+    for label, cost in (("concatenate (before)", before), ("segments (after)", after)):
+        amplification = cost["bytes_written"] / cost["final_bytes"]
+        print(f"{label:<24}{cost['statements']:>12}{cost['bytes_written']:>16,}{amplification:>14.1f}x")
+    print(f"bytes written reduced {before['bytes_written'] / after['bytes_written']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
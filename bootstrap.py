@@ -1,51 +1,330 @@
+# Provisions a Retell agent, a published version and a phone number for
+# every row in `locations`, and records them in retell_agents and
+# phone_numbers (which tenants.py routes calls by).
+#
+# Each location's desired agent config is hashed and compared with the
+# config stored on its retell_agents row, so a rerun only touches
+# locations whose config changed or whose last run stopped partway.
+# Agent names carry the location id, so an agent created by a run that
+# died before recording it is found and adopted rather than created again.
+# Locations are provisioned --concurrency at a time; Retell requests are
+# retried on rate limits and transient errors.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.bootstrap --dry-run
+#     python -m api.bootstrap --concurrency 20
+#     python -m api.bootstrap --location 12 --location 14
+#     python -m api.bootstrap --fake-retell     # local fake API (fake_retell.py)
 
+import argparse
+import asyncio
+import hashlib
+import json
 import os
-from dotenv import load_dotenv, find_dotenv, set_key
-from create_agent import create_or_update_agent
-from publish_agent import publish_agent
-from provision_number import provision_number
-
-def bootstrap_retell_setup():
-    print("Starting Retell API bootstrap process...")
-
-    # Ensure .env.local exists for writing
-    if not os.path.exists(".env.local"):
-        open(".env.local", "a").close()
-
-    # Load environment variables from .env.local
-    load_dotenv(dotenv_path=".env.local")
-
-    # 1. Create or Update Agent
-    agent_id = create_or_update_agent()
-    if not agent_id:
-        print("Failed to create or update agent. Exiting bootstrap.")
-        return
-    
-    # Update .env.local with the new agent_id if it was created
-    set_key(find_dotenv(usecwd=True), "RETELL_AGENT_ID", agent_id)
-    load_dotenv(dotenv_path=".env.local", override=True) # Reload to ensure new agent_id is available
-
-    # 2. Publish Agent (placeholder for now)
-    if not publish_agent(agent_id):
-        print("Failed to publish agent. Exiting bootstrap.")
-        return
-
-    # 3. Provision Phone Number
-    # You might want to pass area_code or other parameters here dynamically
-    provisioned_number = provision_number(agent_id)
-    if not provisioned_number:
-        print("Failed to provision phone number. Exiting bootstrap.")
-        return
-    
-    # Update .env.local with the new phone number
-    set_key(find_dotenv(usecwd=True), "RETELL_PHONE_NUMBER", provisioned_number)
-    load_dotenv(dotenv_path=".env.local", override=True) # Reload
-
-    print("Retell API bootstrap process completed successfully!")
-    print(f"Agent ID: {os.getenv("RETELL_AGENT_ID")}")
-    print(f"Phone Number: {os.getenv("RETELL_PHONE_NUMBER")}")
+import random
+import re
+import time
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from .database import init_pool, close_pool, fetch_all, execute_query
+from .prompts import SYSTEM_PROMPT, TOOL_SCHEMA
+
+try:
+    import httpx
+except ImportError:  # Only needed to talk to the Retell API
+    httpx = None
+
+load_dotenv()
+
+RETELL_API_KEY = os.getenv("RETELL_API_KEY")
+RETELL_BASE_URL = os.getenv("RETELL_BASE_URL", "https://api.retellai.com")
+RETELL_TIMEOUT = float(os.getenv("RETELL_TIMEOUT", 30.0))
+# Where Retell reaches this backend (llm websocket and call webhook).
+RETELL_PUBLIC_URL = os.getenv("RETELL_PUBLIC_URL", "https://your-backend-url")
+RETELL_VOICE_ID = os.getenv("RETELL_VOICE_ID", "11labs-Adrian")
+# Locations provisioned at once.
+FLEET_CONCURRENCY = int(os.getenv("FLEET_CONCURRENCY", 10))
+# Retries per Retell request on 429s and transient errors, with exponential
+# backoff from FLEET_RETRY_BASE_DELAY seconds (or the server's Retry-After).
+FLEET_RETRIES = int(os.getenv("FLEET_RETRIES", 4))
+FLEET_RETRY_BASE_DELAY = float(os.getenv("FLEET_RETRY_BASE_DELAY", 0.5))
+
+LOCATIONS_QUERY = """
+SELECT l.id AS location_id, l.restaurant_id, l.name, l.phone, r.name AS restaurant_name,
+       a.retell_agent_id, a.version, a.config, a.is_live,
+       (SELECT p.retell_phone_number FROM phone_numbers p
+         WHERE p.retell_agent_id = a.retell_agent_id AND p.is_active
+         ORDER BY p.id LIMIT 1) AS phone_number
+  FROM locations l
+  JOIN restaurants r ON r.id = l.restaurant_id
+  LEFT JOIN retell_agents a ON a.location_id = l.id
+ WHERE $1::int[] IS NULL OR l.id = ANY($1::int[])
+ ORDER BY l.id
+"""
+INSERT_AGENT_QUERY = (
+    "INSERT INTO retell_agents (restaurant_id, location_id, retell_agent_id, version, config, is_live) "
+    "VALUES ($1, $2, $3, 1, $4::jsonb, FALSE)"
+)
+UPDATE_AGENT_QUERY = (
+    "UPDATE retell_agents SET config = $2::jsonb, version = version + 1, is_live = FALSE, "
+    "updated_at = CURRENT_TIMESTAMP WHERE retell_agent_id = $1"
+)
+PUBLISH_AGENT_QUERY = "UPDATE retell_agents SET is_live = TRUE, updated_at = CURRENT_TIMESTAMP WHERE retell_agent_id = $1"
+# Suffix of every agent_name agent_config() builds; how list-agents
+# results are matched back to their location.
+AGENT_LOCATION_TAG = re.compile(r"\[location (\d+)\]$")
+INSERT_NUMBER_QUERY = (
+    "INSERT INTO phone_numbers (restaurant_id, retell_phone_number, retell_agent_id, webhook_url) VALUES ($1, $2, $3, $4) "
+    "ON CONFLICT (retell_phone_number) DO UPDATE SET retell_agent_id = EXCLUDED.retell_agent_id, "
+    "webhook_url = EXCLUDED.webhook_url, is_active = TRUE, updated_at = CURRENT_TIMESTAMP"
+)
+
+
+class RetellAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Retell API {status}: {message}")
+        self.status = status
+
+
+class RetellClient:
+    # Async client for the Retell REST endpoints provisioning needs. One
+    # instance (and connection pool) is shared by every location.
+
+    def __init__(self, api_key=None, base_url=RETELL_BASE_URL, transport=None, retries=FLEET_RETRIES):
+        if httpx is None:
+            raise RuntimeError("Provisioning requires the httpx package.")
+        api_key = api_key or RETELL_API_KEY
+        if not api_key:
+            raise RuntimeError("RETELL_API_KEY is not set.")
+        self.retries = retries
+        self.stats = {"requests": 0, "retries": 0}
+        self._client = httpx.AsyncClient(
+            base_url=base_url, timeout=RETELL_TIMEOUT, transport=transport,
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        )
+
+    async def _request(self, method, path, body=None, idempotent=True):
+        # Creates are only retried when Retell can't have acted on the
+        # request (429, or the connection never opened); anything else
+        # could leave a duplicate agent or a second number billed.
+        content = json.dumps(body).encode("utf-8") if body is not None else None
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            self.stats["requests"] += 1
+            try:
+                response = await self._client.request(method, path, content=content)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                if attempt == self.retries:
+                    raise
+            except httpx.TransportError:
+                if not idempotent or attempt == self.retries:
+                    raise
+            else:
+                retryable = response.status_code == 429 or (idempotent and response.status_code >= 500)
+                if response.status_code < 400:
+                    return response.json() if response.content else None
+                if not retryable or attempt == self.retries:
+                    raise RetellAPIError(response.status_code, response.text[:200])
+                try:
+                    retry_after = float(response.headers.get("Retry-After", ""))
+                except ValueError:
+                    pass
+            self.stats["retries"] += 1
+            await asyncio.sleep(retry_after if retry_after is not None else FLEET_RETRY_BASE_DELAY * 2 ** attempt * (0.5 + random.random()))
+
+    async def create_agent(self, config):
+        return await self._request("POST", "/create-agent", config, idempotent=False)
+
+    async def update_agent(self, agent_id, config):
+        return await self._request("PATCH", f"/update-agent/{agent_id}", config)
+
+    async def publish_agent(self, agent_id):
+        return await self._request("POST", f"/publish-agent/{agent_id}")
+
+    async def list_agents(self):
+        return await self._request("GET", "/list-agents")
+
+    async def list_phone_numbers(self):
+        return await self._request("GET", "/list-phone-numbers")
+
+    async def create_phone_number(self, agent_id, area_code=None, nickname=None, webhook_url=None):
+        body = {"inbound_agent_id": agent_id, "nickname": nickname, "inbound_webhook_url": webhook_url}
+        if area_code:
+            body["area_code"] = area_code
+        return await self._request("POST", "/create-phone-number", body, idempotent=False)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def _public_urls():
+    base = urlsplit(RETELL_PUBLIC_URL)
+    scheme = "wss" if base.scheme == "https" else "ws"
+    return (
+        f"{scheme}://{base.netloc}{base.path.rstrip('/')}/api/voice/retell/llm-websocket",
+        f"{RETELL_PUBLIC_URL.rstrip('/')}/api/voice/retell/webhook",
+    )
 
-if __name__ == "__main__":
-    bootstrap_retell_setup()
 
+def agent_config(location):
+    # Everything Retell stores for a location's agent. Any change here (or
+    # to the prompt / tool schema) changes config_hash and is pushed on the
+    # next run.
+    llm_websocket_url, webhook_url = _public_urls()
+    return {
+        "agent_name": f"{location['restaurant_name']} - {location['name']} [location {location['location_id']}]",
+        "llm_websocket_url": llm_websocket_url,
+        "webhook_url": webhook_url,
+        "voice_id": RETELL_VOICE_ID,
+        "voice_speed": 1.0,
+        "voice_temperature": 1.0,
+        "enable_backchannel": True,
+        "reminder_prompt": "Just a reminder, I'm here to help with reservations, takeout orders, or any questions you have about our events. What can I do for you?",
+        "system_prompt": SYSTEM_PROMPT,
+        "tools": TOOL_SCHEMA,
+    }
 
+
+def config_hash(config):
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _area_code(phone):
+    # A NANP location number keeps its area code on the Retell number
+    digits = "".join(ch for ch in phone or "" if ch.isdigit())
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    return int(digits[:3]) if len(digits) == 10 else None
+
+
+async def provision_location(client, location, numbers_by_agent, agents_by_location=None, dry_run=False):
+    # Returns the actions taken (or, with dry_run, that would be taken).
+    desired = agent_config(location)
+    agent_id = location["retell_agent_id"]
+    stored = location["config"]
+    if isinstance(stored, str):
+        stored = json.loads(stored)
+    actions = []
+    if agent_id is None:
+        actions.append("adopt agent" if (agents_by_location or {}).get(location["location_id"]) else "create")
+    elif config_hash(stored) != config_hash(desired):
+        actions.append("update")
+    if actions or not location["is_live"]:
+        actions.append("publish")
+    if not location["phone_number"]:
+        actions.append("adopt number" if agent_id in numbers_by_agent else "provision number")
+    if dry_run or not actions:
+        return actions
+
+    # Each step is recorded as soon as it succeeds, so a failed or
+    # interrupted run resumes where this location stopped
+    config_json = json.dumps(desired)
+    if "adopt agent" in actions:
+        # Its config may predate this run's, so it's pushed again
+        agent_id = agents_by_location[location["location_id"]]
+        await client.update_agent(agent_id, desired)
+        await execute_query(INSERT_AGENT_QUERY, location["restaurant_id"], location["location_id"], agent_id, config_json)
+    elif agent_id is None:
+        agent_id = (await client.create_agent(desired))["agent_id"]
+        await execute_query(INSERT_AGENT_QUERY, location["restaurant_id"], location["location_id"], agent_id, config_json)
+    elif "update" in actions:
+        await client.update_agent(agent_id, desired)
+        await execute_query(UPDATE_AGENT_QUERY, agent_id, config_json)
+    if "publish" in actions:
+        await client.publish_agent(agent_id)
+        await execute_query(PUBLISH_AGENT_QUERY, agent_id)
+    if not location["phone_number"]:
+        number = numbers_by_agent.get(agent_id)
+        if number is None:
+            created = await client.create_phone_number(
+                agent_id, area_code=_area_code(location["phone"]), nickname=desired["agent_name"], webhook_url=desired["webhook_url"],
+            )
+            number = created["phone_number"]
+        await execute_query(INSERT_NUMBER_QUERY, location["restaurant_id"], number, agent_id, desired["webhook_url"])
+    return actions
+
+
+async def provision_fleet(client, location_ids=None, concurrency=FLEET_CONCURRENCY, dry_run=False):
+    # Returns one {"location_id", "name", "actions", "error"} per location.
+    locations = await fetch_all(LOCATIONS_QUERY, location_ids)
+    agents_by_location = {}
+    if not dry_run and any(location["retell_agent_id"] is None for location in locations):
+        # An agent created by an earlier run that failed before recording
+        # it is adopted instead of creating a second one
+        for agent in await client.list_agents() or ():
+            tag = AGENT_LOCATION_TAG.search(agent.get("agent_name") or "")
+            if tag:
+                agents_by_location.setdefault(int(tag.group(1)), agent["agent_id"])
+    numbers_by_agent = {}
+    if not dry_run and any(not location["phone_number"] for location in locations):
+        # A number bought by an earlier run that failed before recording it
+        # is re-attached instead of buying another
+        for number in await client.list_phone_numbers() or ():
+            if number.get("inbound_agent_id"):
+                numbers_by_agent[number["inbound_agent_id"]] = number["phone_number"]
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(location):
+        result = {"location_id": location["location_id"], "name": location["name"], "actions": [], "error": None}
+        async with slots:
+            try:
+                result["actions"] = await provision_location(client, location, numbers_by_agent, agents_by_location, dry_run)
+            except Exception as e:
+                result["error"] = str(e)
+        return result
+
+    return await asyncio.gather(*(one(location) for location in locations))
+
+
+def summarize(results):
+    counts = {}
+    for result in results:
+        for action in ("failed",) if result["error"] else result["actions"] or ("unchanged",):
+            counts[action] = counts.get(action, 0) + 1
+    return counts
+
+
+async def run(args):
+    client = None
+    if args.fake_retell:
+        from .fake_retell import FakeRetell
+        client = FakeRetell().client()
+    elif not args.dry_run:
+        client = RetellClient()
+    await init_pool()
+    try:
+        started = time.perf_counter()
+        results = await provision_fleet(client, args.location or None, args.concurrency, args.dry_run)
+        elapsed = time.perf_counter() - started
+    finally:
+        if client is not None:
+            await client.close()
+        await close_pool()
+    for result in results:
+        if result["error"]:
+            print(f"location {result['location_id']} ({result['name']}): FAILED: {result['error']}")
+        elif result["actions"] and (args.verbose or args.dry_run):
+            print(f"location {result['location_id']} ({result['name']}): {', '.join(result['actions'])}")
+    counts = ", ".join(f"{count} {action}" for action, count in sorted(summarize(results).items()))
+    if args.dry_run:
+        print(f"{len(results)} locations: {counts or 'nothing to do'} (dry run)")
+    else:
+        print(f"{len(results)} locations in {elapsed:.1f}s: {counts or 'nothing to do'} "
+              f"({client.stats['requests']} Retell requests, {client.stats['retries']} retries)")
+    return 1 if any(result["error"] for result in results) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Provision Retell agents and numbers for every location")
+    parser.add_argument("--location", type=int, action="append", help="only this location id (repeatable)")
+    parser.add_argument("--concurrency", type=int, default=FLEET_CONCURRENCY)
+    parser.add_argument("--dry-run", action="store_true", help="show what would change without calling Retell")
+    parser.add_argument("--fake-retell", action="store_true", help="use the in-process fake Retell API")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import logging
+import os
+import json
+import asyncio
+from collections import OrderedDict
+from contextvars import ContextVar
+from .database import fetch_one
+from .tenants import resolve_tenant, normalize_number
+
+logger = logging.getLogger(__name__)
+
+# Profiles held for calls in progress; the least recently used is dropped
+# past this. Entries normally leave at call.ended.
+CALLER_PROFILE_MAX = int(os.getenv("CALLER_PROFILE_MAX", 5000))
+# How much history a profile carries into the prompt.
+CALLER_RECENT_ORDERS = int(os.getenv("CALLER_RECENT_ORDERS", 3))
+CALLER_RECENT_RESERVATIONS = int(os.getenv("CALLER_RECENT_RESERVATIONS", 3))
+
+# Everything about one caller at one restaurant in a single round trip.
+# Phones are matched against every spelling in $2 (see phone_variants) via
+# the (restaurant_id, customer_phone) indexes.
+PROFILE_QUERY = """
+SELECT
+    (SELECT json_agg(o) FROM (
+        SELECT o.id, o.customer_name, o.customer_email, o.status, o.total_amount, o.created_at,
+               (SELECT json_agg(json_build_object('name', m.name, 'quantity', i.quantity))
+                  FROM order_items i JOIN menu_items m ON m.id = i.menu_item_id
+                 WHERE i.order_id = o.id) AS items
+          FROM orders o
+         WHERE o.restaurant_id = $1 AND o.customer_phone = ANY($2::text[])
+         ORDER BY o.created_at DESC LIMIT $3
+    ) o) AS orders,
+    (SELECT json_agg(r) FROM (
+        SELECT id, customer_name, datetime, party_size, status, created_at
+          FROM reservations
+         WHERE restaurant_id = $1 AND customer_phone = ANY($2::text[])
+         ORDER BY datetime DESC LIMIT $4
+    ) r) AS reservations,
+    (SELECT optin_status AND optout_timestamp IS NULL
+       FROM customer_optins
+      WHERE restaurant_id = $1 AND optin_type = 'SMS' AND phone_or_email = ANY($2::text[])
+      ORDER BY optin_timestamp DESC LIMIT 1) AS sms_opt_in
+"""
+
+
+def phone_variants(number):
+    # Spellings a caller's number may have been stored under: orders and
+    # reservations take whatever the model passed, Retell sends E.164.
+    normalized = normalize_number(number)
+    if not normalized:
+        return []
+    digits = normalized.lstrip("+")
+    variants = {str(number), normalized, digits, "+" + digits}
+    if len(digits) == 11 and digits.startswith("1"):
+        variants.add(digits[1:])
+    return sorted(variants)
+
+
+def _json_list(value):
+    if value is None:
+        return []
+    return json.loads(value) if isinstance(value, str) else list(value)
+
+
+class CallerProfile:
+    # What the restaurant already knows about the number calling, loaded at
+    # call.started so tools and the prompt can use it without a query.
+
+    def __init__(self, restaurant_id, phone, row=None):
+        self.restaurant_id = restaurant_id
+        self.phone = phone
+        self.orders = _json_list(row["orders"]) if row else []
+        self.reservations = _json_list(row["reservations"]) if row else []
+        self.sms_opt_in = row["sms_opt_in"] if row else None  # None: never asked
+        self.version = 0
+
+    @property
+    def returning(self):
+        return bool(self.orders or self.reservations)
+
+    @property
+    def name(self):
+        latest = max(
+            (entry for entry in self.orders + self.reservations if entry.get("customer_name")),
+            # Entries recorded during this call have no created_at yet and are newest
+            key=lambda entry: (entry.get("created_at") is None, str(entry.get("created_at"))),
+            default=None,
+        )
+        return latest["customer_name"] if latest else None
+
+    @property
+    def email(self):
+        return next((order["customer_email"] for order in self.orders if order.get("customer_email")), None)
+
+    def record_order(self, order_id, name, email, total_amount, items):
+        # Keeps the profile true for the rest of the call after a tool writes
+        self.orders.insert(0, {
+            "id": order_id, "customer_name": name, "customer_email": email, "status": "pending",
+            "total_amount": total_amount, "created_at": None, "items": items,
+        })
+        del self.orders[CALLER_RECENT_ORDERS:]
+        self.version += 1
+
+    def record_reservation(self, reservation_id, name, when, party_size):
+        self.reservations.insert(0, {
+            "id": reservation_id, "customer_name": name, "datetime": when.isoformat(),
+            "party_size": party_size, "status": "confirmed", "created_at": None,
+        })
+        self.reservations.sort(key=lambda entry: str(entry["datetime"]), reverse=True)
+        del self.reservations[CALLER_RECENT_RESERVATIONS:]
+        self.version += 1
+
+    def prompt_notes(self):
+        if not self.returning:
+            return "The caller has not ordered or booked with us before."
+        lines = [f"Returning caller: {self.name or 'name not on file'}, calling from {self.phone}."]
+        if self.email:
+            lines.append(f"Email on file: {self.email}.")
+        for order in self.orders:
+            items = ", ".join(f"{item['quantity']} x {item['name']}" for item in order.get("items") or ())
+            lines.append(f"Order {order['id']} ({order['status']}): {items or 'no items'}.")
+        for reservation in self.reservations:
+            lines.append(f"Reservation {reservation['id']} ({reservation['status']}): party of {reservation['party_size']} at {reservation['datetime']}.")
+        if self.sms_opt_in is not None:
+            lines.append("Has opted in to text messages." if self.sms_opt_in else "Has opted out of text messages.")
+        lines.append("Confirm the name and number on file instead of asking for them again.")
+        return "\n".join(lines)
+
+
+_profiles = OrderedDict()  # (restaurant_id, phone) -> Task resolving to a CallerProfile
+_calls = {}                # call_id -> Task resolving to a CallerProfile or None
+_call_keys = {}            # call_id -> (restaurant_id, phone) once resolved
+_refs = {}                 # (restaurant_id, phone) -> calls in progress using it
+
+_stats = {
+    "hits": 0,
+    "loads": 0,
+    "failures": 0,
+    "evictions": 0,
+}
+
+_current_call = ContextVar("current_call", default=None)
+
+
+async def _load(restaurant_id, phone):
+    row = await fetch_one(PROFILE_QUERY, restaurant_id, phone_variants(phone), CALLER_RECENT_ORDERS, CALLER_RECENT_RESERVATIONS)
+    return CallerProfile(restaurant_id, phone, row)
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        _stats["failures"] += 1
+        logger.warning("Could not load caller profile: %s", task.exception())
+
+
+def get_caller_profile(restaurant_id, phone):
+    # Task resolving to the caller's profile, shared by every call from the
+    # same number to the same restaurant. A failed load is retried next time.
+    key = (restaurant_id, phone)
+    task = _profiles.get(key)
+    if task is not None and not (task.done() and (task.cancelled() or task.exception() is not None)):
+        _stats["hits"] += 1
+        _profiles.move_to_end(key)
+        return task
+    _stats["loads"] += 1
+    task = asyncio.ensure_future(_load(restaurant_id, phone))
+    task.add_done_callback(_log_failure)
+    _profiles[key] = task
+    _profiles.move_to_end(key)
+    if len(_profiles) > CALLER_PROFILE_MAX:
+        _profiles.popitem(last=False)
+        _stats["evictions"] += 1
+    return task
+
+
+async def _prefetch(call_id, agent_id, to_number, phone):
+    tenant = await resolve_tenant(agent_id, to_number)
+    key = (tenant.restaurant_id, phone)
+    if call_id in _calls and call_id not in _call_keys:
+        _call_keys[call_id] = key
+        _refs[key] = _refs.get(key, 0) + 1
+    return await asyncio.shield(get_caller_profile(*key))
+
+
+def prefetch_caller(call_id, agent_id=None, to_number=None, from_number=None):
+    # Starts loading the caller's profile in the background; safe to call
+    # again from the websocket or a tool call. Anonymous callers get None.
+    phone = normalize_number(from_number)
+    if not call_id or not phone:
+        return None
+    task = _calls.get(call_id)
+    if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+        if call_id not in _calls and len(_calls) >= CALLER_PROFILE_MAX:
+            # call.ended never arrived for the oldest
+            release_caller(next(iter(_calls)))
+        task = asyncio.ensure_future(_prefetch(call_id, agent_id, to_number, phone))
+        # Load failures are logged by the profile task; unknown tenants by
+        # the websocket / retell_action that resolve the same call
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        _calls[call_id] = task
+    return task
+
+
+def release_caller(call_id):
+    # call.ended: the profile leaves the cache once no other call in
+    # progress shares it, so the next call reads fresh history.
+    task = _calls.pop(call_id, None)
+    if task is not None and not task.done():
+        task.cancel()
+    key = _call_keys.pop(call_id, None)
+    if key is None:
+        return
+    _refs[key] -= 1
+    if not _refs[key]:
+        del _refs[key]
+        _profiles.pop(key, None)
+
+
+def caller_profile(call_id=None):
+    # The profile for this call if it has finished loading, else None;
+    # never waits, so a slow load costs the caller nothing.
+    task = _calls.get(call_id or _current_call.get())
+    if task is None or not task.done() or task.cancelled() or task.exception() is not None:
+        return None
+    return task.result()
+
+
+def current_call_id():
+    return _current_call.get()
+
+
+def set_current_call(call_id):
+    return _current_call.set(call_id)
+
+
+def reset_current_call(token):
+    _current_call.reset(token)
+
+
+def caller_profile_stats():
+    return {
+        **_stats,
+        "profiles": len(_profiles),
+        "calls": len(_calls),
+        "max_size": CALLER_PROFILE_MAX,
+    }
@@ -0,0 +1,331 @@
+import logging
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from .database import acquire, transaction, fetch_all, execute_query
+from .metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Sends in flight per campaign.
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", 50))
+# Provider rate limits (messages per second; bursts up to one second's worth).
+CAMPAIGN_SMS_RATE = float(os.getenv("CAMPAIGN_SMS_RATE", 10))
+CAMPAIGN_EMAIL_RATE = float(os.getenv("CAMPAIGN_EMAIL_RATE", 50))
+# Recipients fetched per cursor round trip, and seconds one cursor (and
+# its snapshot) stays open before it is reopened after the last recipient.
+CAMPAIGN_FETCH_SIZE = int(os.getenv("CAMPAIGN_FETCH_SIZE", 500))
+CAMPAIGN_CURSOR_SECONDS = float(os.getenv("CAMPAIGN_CURSOR_SECONDS", 30.0))
+# Recipients claimed (recorded as 'sending') per round trip before any of
+# them is handed to a sender. A crash can leave up to about this many
+# claimed but never sent; a resumed run skips them rather than risk
+# messaging someone twice.
+CAMPAIGN_CLAIM_BATCH = int(os.getenv("CAMPAIGN_CLAIM_BATCH", 100))
+# Outcomes are written (with the checkpoint) once this many are pending or
+# this many seconds have passed.
+CAMPAIGN_RESULT_BATCH = int(os.getenv("CAMPAIGN_RESULT_BATCH", 500))
+CAMPAIGN_FLUSH_INTERVAL = float(os.getenv("CAMPAIGN_FLUSH_INTERVAL", 1.0))
+# Seconds between checks for campaigns that are due.
+CAMPAIGN_CHECK_INTERVAL = float(os.getenv("CAMPAIGN_CHECK_INTERVAL", 30.0))
+# Register FakeProvider for both channels (development only; nothing is sent).
+CAMPAIGN_FAKE_PROVIDER = os.getenv("CAMPAIGN_FAKE_PROVIDER", "").lower() in ("1", "true", "yes")
+
+# Session advisory lock namespace: (this, campaign id). The lock lives as
+# long as the sending worker's connection, so a crashed worker's campaign
+# is picked up (and resumed from its checkpoint) by the next check.
+_LOCK_NAMESPACE = 0x63616d70  # "camp"
+
+DUE_QUERY = (
+    "SELECT id, restaurant_id, type, subject, body, checkpoint FROM campaigns "
+    "WHERE status IN ('scheduled', 'sending') AND scheduled_at <= CURRENT_TIMESTAMP ORDER BY scheduled_at LIMIT 10"
+)
+# Customers seen on orders/reservations, filtered in one join against each
+# contact's latest customer_optins row, minus anyone this campaign already
+# claimed. Keyset-ordered by contact so a run resumes after its checkpoint.
+AUDIENCE_QUERY = """
+SELECT audience.contact FROM (
+    SELECT customer_phone AS contact FROM orders WHERE restaurant_id = $1 AND $2 = 'SMS'
+    UNION
+    SELECT customer_phone FROM reservations WHERE restaurant_id = $1 AND $2 = 'SMS'
+    UNION
+    SELECT customer_email FROM orders WHERE restaurant_id = $1 AND $2 = 'Email' AND customer_email IS NOT NULL
+) audience
+JOIN (
+    SELECT DISTINCT ON (phone_or_email) phone_or_email, optin_status, optout_timestamp
+    FROM customer_optins WHERE restaurant_id = $1 AND optin_type = $2
+    ORDER BY phone_or_email, optin_timestamp DESC
+) optin ON optin.phone_or_email = audience.contact
+WHERE optin.optin_status AND optin.optout_timestamp IS NULL
+  AND audience.contact > $3
+  AND NOT EXISTS (SELECT 1 FROM campaign_deliveries d WHERE d.campaign_id = $4 AND d.recipient = audience.contact)
+ORDER BY audience.contact
+"""
+CLAIM_QUERY = (
+    "INSERT INTO campaign_deliveries (campaign_id, recipient, status) "
+    "SELECT $1, unnest($2::text[]), 'sending' ON CONFLICT (campaign_id, recipient) DO NOTHING"
+)
+RESULTS_QUERY = (
+    "INSERT INTO campaign_deliveries (campaign_id, recipient, status, provider_message_id, error) "
+    "SELECT $1, * FROM unnest($2::text[], $3::text[], $4::text[], $5::text[]) "
+    "ON CONFLICT (campaign_id, recipient) DO UPDATE SET status = EXCLUDED.status, "
+    "provider_message_id = EXCLUDED.provider_message_id, error = EXCLUDED.error, attempted_at = CURRENT_TIMESTAMP"
+)
+CHECKPOINT_QUERY = "UPDATE campaigns SET checkpoint = $2, updated_at = CURRENT_TIMESTAMP WHERE id = $1"
+START_QUERY = "UPDATE campaigns SET status = 'sending', updated_at = CURRENT_TIMESTAMP WHERE id = $1"
+FINISH_QUERY = "UPDATE campaigns SET status = $2, sent_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE id = $1"
+
+CAMPAIGN_SENDS = Counter("campaign_sends_total", "Campaign messages by channel and outcome.", ("channel", "outcome"))
+CAMPAIGN_SEND_LATENCY = Histogram("campaign_send_seconds", "Provider send time per campaign message, excluding rate-limit waits.", ("channel",))
+
+
+class TokenBucket:
+    # Callers that find the bucket empty reserve a future token and sleep
+    # until it is due, so waiters are served in arrival order and the
+    # long-run rate never exceeds `rate`.
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class FakeProvider:
+    # Local stand-in for an SMS / email API, for development and
+    # bench_campaigns.py: takes `latency` seconds per message and fails
+    # `failure_rate` of them.
+
+    def __init__(self, latency=0.05, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.sent = []  # (recipient, idempotency_key)
+
+    async def send(self, recipient, subject, body, idempotency_key):
+        await asyncio.sleep(self.latency)
+        if self.rng.random() < self.failure_rate:
+            raise RuntimeError("provider rejected the message")
+        self.sent.append((recipient, idempotency_key))
+        return f"fake-{len(self.sent)}"
+
+
+# Campaign type ('SMS' / 'Email') -> provider with
+#     async send(recipient, subject, body, idempotency_key) -> provider message id
+PROVIDERS = {}
+_buckets = {}
+
+
+def register_provider(channel, provider, rate=None):
+    PROVIDERS[channel] = provider
+    _buckets[channel] = TokenBucket(rate or (CAMPAIGN_SMS_RATE if channel == "SMS" else CAMPAIGN_EMAIL_RATE))
+
+
+class CampaignRun:
+    # Sends one campaign: a producer streams the audience off a server-side
+    # cursor into a bounded queue, CAMPAIGN_CONCURRENCY workers send through
+    # the channel's token bucket, and outcomes are written in bulk together
+    # with a checkpoint. Every recipient is claimed (a 'sending' delivery
+    # row) before it is queued, so a run that dies between send and flush
+    # leaves claims, not gaps: the NOT EXISTS in AUDIENCE_QUERY skips them
+    # on resume, trading a possible missed message for a duplicate one.
+    # The checkpoint is the last recipient before which every outcome has
+    # been written, so a resumed run's cursor starts past it.
+
+    def __init__(self, campaign, provider, bucket, concurrency=CAMPAIGN_CONCURRENCY):
+        self.campaign = campaign
+        self.provider = provider
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.checkpoint = campaign["checkpoint"] or ""
+        self._dispatched = deque()  # recipients in audience order, not yet checkpointed
+        self._finished = set()      # recipients whose outcome has been written
+        self._results = []          # (recipient, status, provider_message_id, error)
+        self._flush_lock = asyncio.Lock()
+        self.stats = {"sent": 0, "failed": 0}
+
+    async def _enqueue(self, queue, recipients):
+        await execute_query(CLAIM_QUERY, self.campaign["id"], recipients)
+        for recipient in recipients:
+            self._dispatched.append(recipient)
+            await queue.put(recipient)
+
+    async def _produce(self, queue):
+        campaign = self.campaign
+        after = self.checkpoint
+        while True:
+            # Sends are rate limited, so a big audience takes hours; the
+            # cursor is reopened every CAMPAIGN_CURSOR_SECONDS rather than
+            # holding one transaction open for the whole run
+            exhausted = True
+            deadline = time.monotonic() + CAMPAIGN_CURSOR_SECONDS
+            batch = []
+            async with transaction() as conn:
+                async for row in conn.cursor(AUDIENCE_QUERY, campaign["restaurant_id"], campaign["type"], after, campaign["id"], prefetch=CAMPAIGN_FETCH_SIZE):
+                    after = row["contact"]
+                    batch.append(after)
+                    if len(batch) >= CAMPAIGN_CLAIM_BATCH:
+                        await self._enqueue(queue, batch)
+                        batch = []
+                    if time.monotonic() > deadline:
+                        exhausted = False
+                        break
+            if batch:
+                await self._enqueue(queue, batch)
+            if exhausted:
+                return
+
+    async def _send(self, queue):
+        channel = self.campaign["type"]
+        key_prefix = f"campaign-{self.campaign['id']}:"
+        while True:
+            recipient = await queue.get()
+            try:
+                await self.bucket.acquire()
+                started = time.perf_counter()
+                try:
+                    message_id = await self.provider.send(recipient, self.campaign["subject"], self.campaign["body"], key_prefix + recipient)
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    CAMPAIGN_SENDS.inc(channel, "failed")
+                    self._results.append((recipient, "failed", None, str(e)[:500]))
+                else:
+                    self.stats["sent"] += 1
+                    CAMPAIGN_SENDS.inc(channel, "sent")
+                    self._results.append((recipient, "sent", message_id, None))
+                CAMPAIGN_SEND_LATENCY.since(started, channel)
+                if len(self._results) >= CAMPAIGN_RESULT_BATCH:
+                    await self.flush()
+            finally:
+                queue.task_done()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._results:
+                return
+            results, self._results = self._results, []
+            self._finished.update(recipient for recipient, _, _, _ in results)
+            checkpoint = self.checkpoint
+            while self._dispatched and self._dispatched[0] in self._finished:
+                checkpoint = self._dispatched.popleft()
+                self._finished.discard(checkpoint)
+            columns = list(zip(*results))
+            async with transaction() as conn:
+                await conn.execute(RESULTS_QUERY, self.campaign["id"], *(list(column) for column in columns))
+                if checkpoint != self.checkpoint:
+                    await conn.execute(CHECKPOINT_QUERY, self.campaign["id"], checkpoint)
+            self.checkpoint = checkpoint
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(CAMPAIGN_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def run(self):
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        producer = asyncio.create_task(self._produce(queue))
+        tasks = [asyncio.create_task(self._send(queue)) for _ in range(self.concurrency)]
+        tasks.append(asyncio.create_task(self._flush_periodically()))
+        try:
+            await producer
+            await queue.join()
+        finally:
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(producer, *tasks, return_exceptions=True)
+            # Record whatever was sent before stopping, even when cancelled
+            await asyncio.shield(self.flush())
+        return self.stats
+
+
+_task = None
+_active = {}  # campaign id -> CampaignRun
+
+_stats = {
+    "checks": 0,
+    "started": 0,
+    "completed": 0,
+    "failures": 0,
+}
+
+
+async def send_campaign(campaign):
+    # Sends a due campaign unless another worker already holds it. Returns
+    # the run's stats, or None if it was skipped.
+    provider = PROVIDERS.get(campaign["type"])
+    if provider is None:
+        logger.warning("No %s provider registered; campaign %s stays scheduled", campaign["type"], campaign["id"])
+        return None
+    async with acquire() as lock_conn:
+        if not await lock_conn.fetchval("SELECT pg_try_advisory_lock($1, $2)", _LOCK_NAMESPACE, campaign["id"]):
+            return None
+        try:
+            run = _active[campaign["id"]] = CampaignRun(campaign, provider, _buckets[campaign["type"]])
+            _stats["started"] += 1
+            await execute_query(START_QUERY, campaign["id"])
+            logger.info("Sending campaign %s (%s) from %r", campaign["id"], campaign["type"], run.checkpoint or "the start",
+                        extra={"restaurant_id": campaign["restaurant_id"]})
+            stats = await run.run()
+            await execute_query(FINISH_QUERY, campaign["id"], "sent" if stats["sent"] or not stats["failed"] else "failed")
+            _stats["completed"] += 1
+            logger.info("Campaign %s done: %s sent, %s failed", campaign["id"], stats["sent"], stats["failed"],
+                        extra={"restaurant_id": campaign["restaurant_id"]})
+            return stats
+        finally:
+            _active.pop(campaign["id"], None)
+            await lock_conn.execute("SELECT pg_advisory_unlock($1, $2)", _LOCK_NAMESPACE, campaign["id"])
+
+
+async def _campaign_loop():
+    while True:
+        try:
+            _stats["checks"] += 1
+            for campaign in await fetch_all(DUE_QUERY):
+                await send_campaign(campaign)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _stats["failures"] += 1
+            logger.error("Campaign sender error: %s", e)
+        await asyncio.sleep(CAMPAIGN_CHECK_INTERVAL)
+
+
+async def start_campaigns():
+    global _task
+    if CAMPAIGN_FAKE_PROVIDER:
+        for channel in ("SMS", "Email"):
+            if channel not in PROVIDERS:
+                register_provider(channel, FakeProvider())
+    if _task is None:
+        _task = asyncio.create_task(_campaign_loop())
+
+
+async def stop_campaigns():
+    # A campaign cut short here keeps status 'sending' and its checkpoint;
+    # the next worker to check resumes it.
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def campaign_stats():
+    return {
+        **_stats,
+        "providers": sorted(PROVIDERS),
+        "active": {campaign_id: {**run.stats, "checkpoint": run.checkpoint} for campaign_id, run in _active.items()},
+    }
@@ -0,0 +1,349 @@
+# Query plan regression check. Builds schema.sql plus migrations/ in a
+# scratch schema of DATABASE_URL's Postgres, seeds it at realistic volume
+# (--scale 1 is 500 restaurants, roughly 2M rows), then runs
+# EXPLAIN (ANALYZE, BUFFERS) on every query the API issues on a call's hot
+# path. Exits 1 if any plan sequentially scans a table of more than
+# --seq-scan-rows rows, or runs longer than its latency budget. Last,
+# retention ages out the oldest half of the seeded call partitions, which
+# fails the run if it errors or leaves expired calls behind.
+#
+# Writes run inside a transaction that is rolled back, and the scratch
+# schema is dropped afterwards (--keep leaves it for poking at). Nothing
+# outside the scratch schema is touched.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.check_query_plans
+#     python -m api.check_query_plans --scale 4 --budget-ms 50
+#     python -m api.check_query_plans --show reservations_overlapping
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Callable, NamedTuple, Tuple
+import asyncpg
+from . import database
+from .migrate import migrate
+from .retention import CALL_RETENTION_DAYS, PARTITION_KEYS, ensure_partitions, _drop_expired
+
+
+class PlanCheck(NamedTuple):
+    name: str
+    query: str
+    args: Callable  # sample dict -> query parameters
+    budget_ms: float = None  # None: --budget-ms
+    allow_seq_scan: Tuple[str, ...] = ()  # tables this query reads in full by design
+    write: bool = False
+
+
+SEED_STATEMENTS = [
+    "INSERT INTO restaurants (name, api_key) SELECT 'Restaurant ' || n, 'plancheck-' || n FROM generate_series(1, {restaurants}) n",
+    # One location per restaurant, a second for every fifth
+    "INSERT INTO locations (restaurant_id, name, phone, timezone) "
+    "SELECT r.id, 'Location ' || r.id || '-' || k, '+1415' || lpad((r.id * 10 + k)::text, 7, '0'), 'America/New_York' "
+    "FROM restaurants r, generate_series(1, 2) k WHERE k = 1 OR r.id % 5 = 0",
+    "INSERT INTO opening_hours (restaurant_id, location_id, day_of_week, open_time, close_time) "
+    "SELECT l.restaurant_id, l.id, d, '17:00', '22:00' FROM locations l, generate_series(1, 7) d",
+    "INSERT INTO reservation_settings (restaurant_id, max_covers) SELECT id, 40 FROM restaurants",
+    "INSERT INTO menu_items (restaurant_id, name, description, price, category, tags, is_available, is_86d) "
+    "SELECT r.id, 'Dish ' || i, 'House dish ' || i, 8 + i % 20, (ARRAY['starters', 'mains', 'desserts', 'drinks'])[1 + i % 4], "
+    "ARRAY[(ARRAY['vegetarian', 'vegan', 'spicy', 'gluten-free', 'popular'])[1 + i % 5]], i % 17 <> 0, i % 23 = 0 "
+    "FROM restaurants r, generate_series(1, 150) i",
+    # Customers come from a shared pool of phone numbers, so repeat callers exist
+    "INSERT INTO reservations (restaurant_id, customer_name, customer_phone, datetime, party_size, status) "
+    "SELECT r.id, 'Guest ' || i, '+1555' || lpad(((r.id * 7919 + i * 104729) % 50000)::text, 7, '0'), "
+    "date_trunc('hour', now()) - interval '180 days' + (i * interval '11 hours') + (r.id % 4) * interval '15 minutes', "
+    "2 + i % 6, (ARRAY['confirmed', 'confirmed', 'seated', 'cancelled'])[1 + i % 4] "
+    "FROM restaurants r, generate_series(1, 400) i",
+    "INSERT INTO orders (restaurant_id, customer_name, customer_phone, customer_email, status, total_amount, created_at) "
+    "SELECT r.id, 'Guest ' || i, '+1555' || lpad(((r.id * 6151 + i * 7877) % 50000)::text, 7, '0'), "
+    "CASE WHEN i % 2 = 0 THEN 'guest' || ((r.id * 6151 + i * 7877) % 50000) || '@example.com' END, "
+    "'completed', 20 + i % 80, now() - i * interval '9 hours' "
+    "FROM restaurants r, generate_series(1, 400) i",
+    "INSERT INTO order_items (order_id, menu_item_id, quantity, price_at_order) "
+    "SELECT o.id, m.id, 1 + o.id % 3, m.price FROM orders o JOIN menu_items m ON m.restaurant_id = o.restaurant_id AND m.id % 150 = o.id % 150",
+    "INSERT INTO customer_optins (restaurant_id, phone_or_email, optin_type, optin_status, optin_timestamp, optout_timestamp) "
+    "SELECT DISTINCT ON (restaurant_id, customer_phone) restaurant_id, customer_phone, 'SMS', id % 10 <> 0, created_at, "
+    "CASE WHEN id % 10 = 0 THEN created_at + interval '1 day' END FROM orders",
+    "INSERT INTO retell_agents (restaurant_id, location_id, retell_agent_id, config, is_live) "
+    "SELECT restaurant_id, id, 'agent_plancheck_' || id, '{{}}', TRUE FROM locations",
+    "INSERT INTO phone_numbers (restaurant_id, retell_phone_number, retell_agent_id) "
+    "SELECT restaurant_id, '+1628' || lpad(id::text, 7, '0'), 'agent_plancheck_' || id FROM locations",
+    # Calls spread over the retention window; the newest have transcripts
+    "INSERT INTO call_logs (retell_call_id, restaurant_id, agent_id, start_time, end_time, status) "
+    "SELECT 'call_' || n, 1 + n % {restaurants}, 'agent_plancheck_' || (1 + n % {restaurants}), "
+    "now() - (n * interval '1 second') * ({retention_days} * 86400 / {calls}), "
+    "now() - (n * interval '1 second') * ({retention_days} * 86400 / {calls}) + interval '3 minutes', 'ended' "
+    "FROM generate_series(1, {calls}) n",
+    "INSERT INTO call_transcript_segments (retell_call_id, seq, raw_text, normalized_text, created_at) "
+    "SELECT 'call_' || n, s, 'words ', 'words', now() - (n * interval '1 second') * ({retention_days} * 86400 / {calls}) "
+    "FROM generate_series(1, {calls} / 10) n, generate_series(0, 19) s",
+    "INSERT INTO webhook_event_keys (event_key, retell_call_id, event_name, received_at) "
+    "SELECT 'call_' || n || ':call.ended', 'call_' || n, 'call.ended', now() - n * interval '1 second' "
+    "FROM generate_series(1, {calls}) n",
+    "INSERT INTO reminders (restaurant_id, assignee, due_at, payload, is_completed, attempts) "
+    "SELECT 1 + n % {restaurants}, 'Chef', now() - interval '60 days' + n * interval '1 minute', '{{}}', "
+    "n % 20 <> 0, CASE WHEN n % 20 <> 0 THEN 1 ELSE 0 END FROM generate_series(1, {reminders}) n",
+    "INSERT INTO campaigns (restaurant_id, type, body, scheduled_at, status) "
+    "SELECT r.id, 'SMS', 'Happy hour!', now() - k * interval '7 days', CASE WHEN k = 0 THEN 'scheduled' ELSE 'sent' END "
+    "FROM restaurants r, generate_series(0, 4) k",
+    "INSERT INTO campaign_deliveries (campaign_id, recipient, status) "
+    "SELECT c.id, o.phone_or_email, 'sent' FROM campaigns c JOIN customer_optins o ON o.restaurant_id = c.restaurant_id WHERE c.status = 'sent'",
+    # Shared call state for the newest calls; one in ten has expired and
+    # waits for the next prune
+    "INSERT INTO call_sessions (retell_call_id, version, state, expires_at) "
+    "SELECT 'call_' || n, 1 + n % 5, jsonb_build_object('restaurant_id', 1 + n % {restaurants}, 'caller', NULL), "
+    "now() + CASE WHEN n % 10 = 0 THEN interval '-1 hour' ELSE interval '1 hour' END "
+    "FROM generate_series(1, {calls} / 10) n",
+    # A year of day rollups and a month of hour rollups per restaurant
+    "INSERT INTO analytics_rollups (restaurant_id, granularity, bucket, calls, timed_calls, call_seconds, orders, order_revenue, reservations, covers) "
+    "SELECT r.id, g.granularity, date_trunc(g.granularity, now(), 'UTC') - i * g.step, 10, 10, 1800, 3, 90, 2, 6 "
+    "FROM restaurants r, (VALUES ('hour', interval '1 hour', 720), ('day', interval '1 day', 365)) AS g(granularity, step, buckets), "
+    "LATERAL generate_series(1, g.buckets) i",
+]
+
+
+def plan_checks():
+    # Imported here: main.py builds the app on import
+    from .main import ORDER_MENU_QUERY
+    from .menu_cache import MENU_QUERY, MENU_ITEM_QUERY
+    from .timeslots import DAY_CONFIG_QUERY, DAY_RESERVATIONS_QUERY
+    from .reservations import OVERLAPPING_QUERY
+    from .tenants import TENANTS_QUERY, AGENT_QUERY, NUMBER_QUERY
+    from .ingest import WRITE_QUERIES
+    from .transcripts import TRANSCRIPT_QUERY, RESTITCH_QUERY
+    from .idempotency import SEEN_KEYS_QUERY, CLAIM_KEYS_QUERY, PRUNE_QUERY
+    from .reminders import CLAIM_QUERY, UPCOMING_QUERY
+    from .campaigns import DUE_QUERY, AUDIENCE_QUERY
+    from .bootstrap import LOCATIONS_QUERY
+    from .analytics import ROLLUP_QUERY, DASHBOARD_QUERY
+    from .live import SEED_QUERY as LIVE_SEED_QUERY, LIVE_CALL_IDLE
+    from .sessions import SESSION_GET_QUERY, SESSION_INSERT_QUERY, SESSION_UPDATE_QUERY, SESSION_DELETE_QUERY, SESSION_PRUNE_QUERY, CALL_SESSION_TTL
+    from .callers import PROFILE_QUERY, CALLER_RECENT_ORDERS, CALLER_RECENT_RESERVATIONS, phone_variants
+
+    return [
+        PlanCheck("menu_snapshot", MENU_QUERY, lambda s: (s["restaurant_id"],)),
+        PlanCheck("menu_item", MENU_ITEM_QUERY, lambda s: (s["menu_item_id"],)),
+        PlanCheck("order_menu_lookup", ORDER_MENU_QUERY, lambda s: (s["restaurant_id"], s["menu_item_ids"])),
+        PlanCheck("timeslot_day_config", DAY_CONFIG_QUERY, lambda s: (s["restaurant_id"], 5)),
+        PlanCheck("timeslot_day_reservations", DAY_RESERVATIONS_QUERY,
+                  lambda s: (s["restaurant_id"], s["slot"] - timedelta(hours=8), s["slot"] + timedelta(hours=8))),
+        PlanCheck("reservations_overlapping", OVERLAPPING_QUERY,
+                  lambda s: (s["restaurant_id"], s["slot"] - timedelta(minutes=90), s["slot"] + timedelta(minutes=90))),
+        PlanCheck("tenants_load", TENANTS_QUERY, lambda s: (), budget_ms=100,
+                  allow_seq_scan=("retell_agents", "phone_numbers", "locations")),
+        PlanCheck("tenant_by_agent", AGENT_QUERY, lambda s: (s["agent_id"],)),
+        PlanCheck("tenant_by_number", NUMBER_QUERY, lambda s: (s["number"],)),
+        PlanCheck("call_started", WRITE_QUERIES["call.started"],
+                  lambda s: (s["call_id"], s["restaurant_id"], s["agent_id"], s["call_start_ms"], "started"), write=True),
+        PlanCheck("call_ended", WRITE_QUERIES["call.ended"],
+                  lambda s: (s["call_end_ms"], "ended", "transcript", b"", s["call_id"], s["call_start_ms"]), write=True),
+        PlanCheck("call_error", WRITE_QUERIES["error"], lambda s: (b"", s["call_id"], s["call_start_ms"]), write=True),
+        PlanCheck("caller_profile", PROFILE_QUERY,
+                  lambda s: (s["restaurant_id"], phone_variants(s["caller_phone"]), CALLER_RECENT_ORDERS, CALLER_RECENT_RESERVATIONS)),
+        PlanCheck("session_get", SESSION_GET_QUERY, lambda s: (s["session_call_id"],)),
+        PlanCheck("session_insert", SESSION_INSERT_QUERY, lambda s: ("plancheck", '{"restaurant_id": 1}', CALL_SESSION_TTL), write=True),
+        PlanCheck("session_update", SESSION_UPDATE_QUERY,
+                  lambda s: (s["session_call_id"], s["session_version"], '{"restaurant_id": 1}', CALL_SESSION_TTL), write=True),
+        PlanCheck("session_delete", SESSION_DELETE_QUERY, lambda s: (s["session_call_id"],), write=True),
+        PlanCheck("session_prune", SESSION_PRUNE_QUERY, lambda s: (), budget_ms=100, write=True),
+        PlanCheck("transcript_stitch", TRANSCRIPT_QUERY, lambda s: (s["call_id"],)),
+        PlanCheck("transcript_restitch", RESTITCH_QUERY, lambda s: (s["call_id"], s["call_start_ms"]), write=True),
+        PlanCheck("dedup_seen", SEEN_KEYS_QUERY, lambda s: ([f"{s['call_id']}:call.ended", "plancheck:new"],)),
+        PlanCheck("dedup_claim", CLAIM_KEYS_QUERY,
+                  lambda s: ([f"{s['call_id']}:call.ended", "plancheck:new"], [s["call_id"], "plancheck"], ["call.ended", "call.started"]), write=True),
+        PlanCheck("dedup_prune", PRUNE_QUERY, lambda s: (48 * 3600,), write=True),
+        PlanCheck("reminders_claim", CLAIM_QUERY, lambda s: (time.time(), 100, 5, 60.0), write=True),
+        PlanCheck("reminders_upcoming", UPCOMING_QUERY, lambda s: (5000, 5)),
+        PlanCheck("campaigns_due", DUE_QUERY, lambda s: ()),
+        PlanCheck("campaign_audience", AUDIENCE_QUERY, lambda s: (s["restaurant_id"], "SMS", "", s["campaign_id"]), budget_ms=50),
+        PlanCheck("fleet_locations", LOCATIONS_QUERY, lambda s: (None,), budget_ms=100,
+                  allow_seq_scan=("locations", "restaurants", "retell_agents")),
+        PlanCheck("analytics_rollup", ROLLUP_QUERY,
+                  lambda s: ([s["restaurant_id"]] * 2, ["day", "hour"], [s["slot"]] * 2, [1] * 2, [0] * 2, [0.0] * 2,
+                             [0] * 2, [0] * 2, [Decimal(0)] * 2, [0] * 2, [0] * 2), write=True),
+        PlanCheck("analytics_dashboard", DASHBOARD_QUERY,
+                  lambda s: (s["restaurant_id"], "day", s["slot"] - timedelta(days=90), s["slot"])),
+        # Once per worker start; reads the newest partition(s) in full
+        PlanCheck("live_seed", LIVE_SEED_QUERY, lambda s: (LIVE_CALL_IDLE,), budget_ms=100),
+    ]
+
+
+async def seed(conn, scale):
+    restaurants = max(10, int(500 * scale))
+    params = {
+        "restaurants": restaurants,
+        "calls": max(1000, int(200000 * scale)),
+        "reminders": max(1000, int(100000 * scale)),
+        "retention_days": CALL_RETENTION_DAYS,
+    }
+    for statement in SEED_STATEMENTS:
+        await conn.execute(statement.format(**params))
+    await conn.execute("ANALYZE")
+
+    restaurant_id = restaurants // 2
+    call = await conn.fetchrow("SELECT retell_call_id, start_time, end_time FROM call_logs WHERE retell_call_id = 'call_5'")
+    location = await conn.fetchrow("SELECT id FROM locations WHERE restaurant_id = $1 ORDER BY id LIMIT 1", restaurant_id)
+    # A repeat caller with orders, reservations and an opt-in row, if the
+    # seeded phone pools overlap for this restaurant
+    caller_phone = await conn.fetchval(
+        "SELECT o.customer_phone FROM orders o JOIN reservations r ON r.restaurant_id = o.restaurant_id AND r.customer_phone = o.customer_phone "
+        "WHERE o.restaurant_id = $1 ORDER BY o.id LIMIT 1", restaurant_id,
+    ) or await conn.fetchval("SELECT customer_phone FROM orders WHERE restaurant_id = $1 ORDER BY id LIMIT 1", restaurant_id)
+    return {
+        "restaurant_id": restaurant_id,
+        "menu_item_id": await conn.fetchval("SELECT max(id) FROM menu_items WHERE restaurant_id = $1", restaurant_id),
+        "menu_item_ids": [row["id"] for row in await conn.fetch("SELECT id FROM menu_items WHERE restaurant_id = $1 ORDER BY id LIMIT 5", restaurant_id)],
+        "slot": await conn.fetchval("SELECT max(datetime) FROM reservations WHERE restaurant_id = $1 AND datetime < now()", restaurant_id),
+        "agent_id": f"agent_plancheck_{location['id']}",
+        "number": await conn.fetchval("SELECT retell_phone_number FROM phone_numbers WHERE retell_agent_id = $1", f"agent_plancheck_{location['id']}"),
+        "call_id": call["retell_call_id"],
+        "call_start_ms": int(call["start_time"].timestamp() * 1000),
+        "call_end_ms": int(call["end_time"].timestamp() * 1000),
+        "caller_phone": caller_phone,
+        "session_call_id": "call_4",
+        "session_version": await conn.fetchval("SELECT version FROM call_sessions WHERE retell_call_id = 'call_4'"),
+        "campaign_id": await conn.fetchval("SELECT id FROM campaigns WHERE restaurant_id = $1 AND status = 'scheduled'", restaurant_id),
+    }
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def describe(plan):
+    # "Index Scan using x on t, Seq Scan on u, ..." for the scan nodes
+    parts = []
+    for node in plan_nodes(plan):
+        if "Relation Name" not in node:
+            continue
+        index = f" using {node['Index Name']}" if node.get("Index Name") else ""
+        parts.append(f"{node['Node Type']}{index} on {node['Relation Name']}")
+    return ", ".join(dict.fromkeys(parts)) or plan["Node Type"]
+
+
+async def explain(conn, check, args, runs):
+    # Best of `runs` executions, so the budget measures the plan rather than
+    # a cold cache
+    best = None
+    for _ in range(runs):
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            raw = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {check.query}", *args)
+        finally:
+            # Reads roll back too; it's free and keeps every run identical
+            await transaction.rollback()
+        result = (json.loads(raw) if isinstance(raw, str) else raw)[0]
+        if best is None or result["Execution Time"] < best["Execution Time"]:
+            best = result
+    return best
+
+
+async def run_checks(conn, sample, args):
+    sizes = {
+        row["relname"]: row["reltuples"]
+        for row in await conn.fetch(
+            "SELECT c.relname, c.reltuples FROM pg_class c WHERE c.relnamespace = current_schema()::regnamespace AND c.relkind = 'r'"
+        )
+    }
+    failures = 0
+    print(f"{'query':<28}{'exec ms':>9}{'plan ms':>9}  plan")
+    for check in plan_checks():
+        if args.only and check.name not in args.only:
+            continue
+        result = await explain(conn, check, check.args(sample), args.runs)
+        plan = result["Plan"]
+        problems = []
+        budget = check.budget_ms if check.budget_ms is not None else args.budget_ms
+        if result["Execution Time"] > budget:
+            problems.append(f"over {budget:g} ms budget")
+        for node in plan_nodes(plan):
+            relation = node.get("Relation Name")
+            if node["Node Type"] == "Seq Scan" and relation not in check.allow_seq_scan and sizes.get(relation, 0) >= args.seq_scan_rows:
+                problems.append(f"seq scan on {relation} ({int(sizes[relation])} rows)")
+        failures += bool(problems)
+        print(f"{check.name:<28}{result['Execution Time']:>9.2f}{result['Planning Time']:>9.2f}  {describe(plan)}")
+        for problem in problems:
+            print(f"{'':<28}FAIL: {problem}")
+        if args.show and check.name in args.show:
+            print(json.dumps(plan, indent=2))
+    return failures
+
+
+async def check_retention(conn):
+    # As if half the retention window had passed
+    cutoff = datetime.now(timezone.utc) - timedelta(days=CALL_RETENTION_DAYS / 2)
+    try:
+        dropped = await _drop_expired(conn, cutoff)
+    except Exception as e:
+        print(f"{'retention':<28}FAIL: {e}")
+        return 1
+    # Rows older than the oldest partition left can only be expired ones
+    # the DEFAULT partition failed to shed, or a dropped partition's
+    expired = 0
+    for table, key in PARTITION_KEYS.items():
+        expired += await conn.fetchval(
+            f"SELECT count(*) FROM {table} WHERE {key} < $1 AND {key} < ("
+            "SELECT min(substring(pg_get_expr(c.relpartbound, c.oid) FROM $$FROM \\('([^']+)'\\)$$)::timestamptz) "
+            f"FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = '{table}'::regclass)",
+            cutoff,
+        )
+    print(f"{'retention':<28}dropped {dropped} partition(s), {expired} expired row(s) left")
+    if not dropped or expired:
+        print(f"{'':<28}FAIL: expired partitions were not dropped")
+        return 1
+    return 0
+
+
+async def run(args):
+    if not database.DATABASE_URL:
+        raise SystemExit("DATABASE_URL is not set.")
+    schema = f"plancheck_{os.urandom(4).hex()}"
+    conn = await asyncpg.connect(database.DATABASE_URL)
+    try:
+        await conn.execute(f"CREATE SCHEMA {schema}")
+        # Only the scratch schema is on the path, so schema.sql can't see
+        # (let alone rename) the real tables
+        await conn.execute(f"SET search_path TO {schema}")
+        started = time.perf_counter()
+        await migrate(conn)
+        now = datetime.now(timezone.utc)
+        await ensure_partitions(conn, now - timedelta(days=CALL_RETENTION_DAYS), now.date())
+        sample = await seed(conn, args.scale)
+        print(f"Seeded schema {schema} at scale {args.scale:g} in {time.perf_counter() - started:.1f}s")
+        failures = await run_checks(conn, sample, args)
+        if not args.only:
+            failures += await check_retention(conn)
+    finally:
+        if args.keep:
+            print(f"Kept schema {schema}")
+        else:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.close()
+    print(f"{failures} plan regression(s)" if failures else "All query plans within budget.")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN ANALYZE the API's queries against seeded data")
+    parser.add_argument("--scale", type=float, default=1.0, help="1 = 500 restaurants, 200k calls")
+    parser.add_argument("--budget-ms", type=float, default=25.0, help="default execution-time budget per query")
+    parser.add_argument("--seq-scan-rows", type=int, default=10000, help="seq scans of tables at least this big fail")
+    parser.add_argument("--runs", type=int, default=3, help="executions per query; the fastest is judged")
+    parser.add_argument("--only", action="append", help="check only this query (repeatable)")
+    parser.add_argument("--show", action="append", default=[], help="print the full plan of this query (repeatable)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch schema")
+    args = parser.parse_args()
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,212 @@
-
+import logging
 import os
+import time
+import asyncio
 import asyncpg
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from .metrics import Gauge, DB_QUERY_LATENCY, DB_ACQUIRE_LATENCY, DB_ERRORS
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-async def get_connection():
+# Pool sizing. Each uvicorn worker owns one pool, so the total number of
+# Postgres connections is roughly workers * DB_POOL_MAX_SIZE.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+# Prepared statements cached per connection. Set to 0 behind pgbouncer in
+# transaction pooling mode, which cannot keep prepared statements.
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+# Seconds to wait for a free connection before giving up.
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", 5.0))
+# Seconds a single statement may run.
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 10.0))
+# Idle connections are recycled after this many seconds.
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", 300.0))
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+# Occupancy counters reported by pool_stats()
+_stats = {
+    "acquired": 0,
+    "acquire_timeouts": 0,
+    "acquire_wait_total": 0.0,
+    "acquire_wait_max": 0.0,
+}
+
+
+async def init_pool():
+    global _pool
     if not DATABASE_URL:
         raise ValueError("DATABASE_URL not found in environment variables.")
-    conn = await asyncpg.connect(DATABASE_URL)
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                DATABASE_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                command_timeout=DB_COMMAND_TIMEOUT,
+                max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+            )
+            logger.info("Database pool created (min=%s, max=%s)", DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+            logger.info("Database pool closed")
+
+
+async def get_pool():
+    # The app creates the pool in its lifespan hook; standalone scripts get
+    # one lazily on first use.
+    if _pool is None:
+        await init_pool()
+    return _pool
+
+
+@asynccontextmanager
+async def acquire():
+    pool = await get_pool()
+    started = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        _stats["acquire_timeouts"] += 1
+        logger.warning("Database pool acquire timed out after %ss", DB_ACQUIRE_TIMEOUT)
+        raise
+    waited = time.perf_counter() - started
+    DB_ACQUIRE_LATENCY.observe(waited)
+    _stats["acquired"] += 1
+    _stats["acquire_wait_total"] += waited
+    if waited > _stats["acquire_wait_max"]:
+        _stats["acquire_wait_max"] = waited
     try:
         yield conn
     finally:
-        await conn.close()
+        await pool.release(conn)
+
+
+@asynccontextmanager
+async def transaction():
+    # Usage:
+    #     async with transaction() as conn:
+    #         await conn.execute(...)
+    # Commits when the block exits cleanly and rolls back on any exception.
+    # Timed as a whole; errors raised inside belong to the caller.
+    started = time.perf_counter()
+    try:
+        async with acquire() as conn:
+            async with conn.transaction():
+                yield conn
+    finally:
+        DB_QUERY_LATENCY.since(started, "transaction")
+
+
+async def get_connection():
+    async with acquire() as conn:
+        yield conn
+
 
 async def execute_query(query: str, *args):
-    if not DATABASE_URL:
-        raise ValueError("DATABASE_URL not found in environment variables.")
-    conn = None
+    started = time.perf_counter()
+    try:
+        async with acquire() as conn:
+            return await conn.execute(query, *args)
+    except Exception as e:
+        DB_ERRORS.inc("execute_query")
+        logger.error("Database query error: %s", e)
+        raise
+    finally:
+        DB_QUERY_LATENCY.since(started, "execute_query")
+
+
+async def execute_many(query: str, args):
+    started = time.perf_counter()
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        result = await conn.execute(query, *args)
-        return result
+        async with acquire() as conn:
+            return await conn.executemany(query, args)
     except Exception as e:
-        print(f"Database query error: {e}")
+        DB_ERRORS.inc("execute_many")
+        logger.error("Database execute_many error: %s", e)
         raise
     finally:
-        if conn:
-            await conn.close()
+        DB_QUERY_LATENCY.since(started, "execute_many")
+
 
 async def fetch_one(query: str, *args):
-    if not DATABASE_URL:
-        raise ValueError("DATABASE_URL not found in environment variables.")
-    conn = None
+    started = time.perf_counter()
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        record = await conn.fetchrow(query, *args)
-        return record
+        async with acquire() as conn:
+            return await conn.fetchrow(query, *args)
     except Exception as e:
-        print(f"Database fetch_one error: {e}")
+        DB_ERRORS.inc("fetch_one")
+        logger.error("Database fetch_one error: %s", e)
         raise
     finally:
-        if conn:
-            await conn.close()
+        DB_QUERY_LATENCY.since(started, "fetch_one")
+
 
 async def fetch_all(query: str, *args):
-    if not DATABASE_URL:
-        raise ValueError("DATABASE_URL not found in environment variables.")
-    conn = None
+    started = time.perf_counter()
     try:
-        conn = await asyncpg.connect(DATABASE_URL)
-        records = await conn.fetch(query, *args)
-        return records
+        async with acquire() as conn:
+            return await conn.fetch(query, *args)
     except Exception as e:
-        print(f"Database fetch_all error: {e}")
+        DB_ERRORS.inc("fetch_all")
+        logger.error("Database fetch_all error: %s", e)
         raise
     finally:
-        if conn:
-            await conn.close()
+        DB_QUERY_LATENCY.since(started, "fetch_all")
+
+
+def pool_stats():
+    acquired = _stats["acquired"]
+    stats = {
+        "initialized": _pool is not None,
+        "min_size": DB_POOL_MIN_SIZE,
+        "max_size": DB_POOL_MAX_SIZE,
+        "size": 0,
+        "idle": 0,
+        "in_use": 0,
+        "acquired": acquired,
+        "acquire_timeouts": _stats["acquire_timeouts"],
+        "acquire_wait_avg_ms": round(_stats["acquire_wait_total"] / acquired * 1000, 3) if acquired else 0.0,
+        "acquire_wait_max_ms": round(_stats["acquire_wait_max"] * 1000, 3),
+    }
+    if _pool is not None:
+        stats["size"] = _pool.get_size()
+        stats["idle"] = _pool.get_idle_size()
+        stats["in_use"] = stats["size"] - stats["idle"]
+    return stats
+
 
+def _pool_gauges():
+    if _pool is None:
+        return {}
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {("size",): size, ("idle",): idle, ("in_use",): size - idle}
 
+
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "Connections in this worker's pool by state.", ("state",), callback=_pool_gauges)
+
+
+async def check_pool_health():
+    try:
+        async with acquire() as conn:
+            await conn.fetchval("SELECT 1")
+        healthy = True
+    except Exception as e:
+        logger.error("Database health check failed: %s", e)
+        healthy = False
+    return {"healthy": healthy, **pool_stats()}
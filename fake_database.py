@@ -0,0 +1,384 @@
+# In-memory stand-in for the asyncpg pool behind database.py, for load
+# tests and benchmarks that should exercise the full request path without
+# a Postgres server.
+#
+#     from . import fake_database
+#     fake_database.install(latency=0.001)   # before the app's lifespan runs
+#
+# Queries are matched on the table / statement they touch and answered from
+# small in-process tables. Every statement sleeps `latency` seconds to stand
+# in for a network round trip, the pool hands out at most `size`
+# connections, and pg_advisory_xact_lock is a real per-key lock held until
+# the surrounding transaction ends, so pool and lock contention behave like
+# the real thing. Inserting a reminder publishes reminders_changed the way
+# the schema.sql trigger does. Claimed reminders are leased: one not
+# completed is claimable again once the lease passes, until it runs out of
+# attempts. Each statement runs without yielding, so concurrent claimers
+# never get the same row, as with SKIP LOCKED; lock waits and lease clocks
+# on the database server are only exercised by bench_reminders --db
+# postgres.
+# Campaign audiences are one sorted contact list per channel (see
+# add_audience), already reduced to each contact's latest opt-in status.
+# Locations added with add_locations can be provisioned by bootstrap.py.
+
+import json
+import time
+import heapq
+import bisect
+import asyncio
+import itertools
+from datetime import timezone
+from decimal import Decimal
+from . import database, notifications
+
+LOAD_TEST_AGENT_ID = "agent_loadtest"
+LOAD_TEST_NUMBER = "+15550000000"
+LOAD_TEST_RESTAURANT_ID = 1
+
+MENU_TAGS = ("vegetarian", "vegan", "spicy", "gluten-free", "popular", "kids")
+MENU_CATEGORIES = ("starters", "mains", "desserts", "drinks")
+
+
+class MemoryStore:
+    def __init__(self, restaurant_id=LOAD_TEST_RESTAURANT_ID, menu_size=60):
+        self.restaurant_id = restaurant_id
+        self.menu = {
+            item_id: {
+                "id": item_id,
+                "restaurant_id": restaurant_id,
+                "name": f"Dish {item_id}",
+                "description": f"House dish number {item_id}",
+                "price": Decimal(8 + item_id % 20) + Decimal("0.50"),
+                "category": MENU_CATEGORIES[item_id % len(MENU_CATEGORIES)],
+                "tags": [MENU_TAGS[item_id % len(MENU_TAGS)], MENU_TAGS[(item_id * 7) % len(MENU_TAGS)]] + (["special"] if item_id == 1 else []),
+                "is_available": item_id % 17 != 0,
+                "is_86d": item_id % 23 == 0,
+            }
+            for item_id in range(1, menu_size + 1)
+        }
+        self.tenants = [
+            {"kind": "agent", "key": LOAD_TEST_AGENT_ID, "restaurant_id": restaurant_id, "location_id": None},
+            {"kind": "number", "key": LOAD_TEST_NUMBER, "restaurant_id": restaurant_id, "location_id": 1},
+        ]
+        self.reservations = []      # (restaurant_id, datetime, party_size)
+        self.call_logs = {}         # call_id -> row dict
+        self.segments = {}          # call_id -> [(seq, sent_at_ms, id, raw_text)]
+        self.event_keys = set()
+        self.relations = set()      # partitions created by retention.py
+        self.reminders = {}         # id -> row dict
+        self.reminder_queue = []    # heap of (claimable from epoch, id): due_at, or lease expiry once claimed
+        self.campaigns = {}         # id -> row dict
+        self.audience = {}          # channel -> sorted [(contact, opted_in)]
+        self.deliveries = {}        # (campaign_id, recipient) -> status
+        self.locations = {}         # id -> row dict
+        self.agents = {}            # retell_agent_id -> retell_agents row dict
+        self.numbers = {}           # retell_phone_number -> retell_agent_id
+        self.rollups = {}           # (restaurant_id, granularity, bucket) -> analytics_rollups row dict
+        self.sessions = {}          # retell_call_id -> (version, state JSON)
+        self.ids = itertools.count(1)
+        self.statements = 0
+        self.locks = {}
+
+    def add_campaign(self, channel, body="Bench campaign", status="scheduled"):
+        campaign_id = next(self.ids)
+        self.campaigns[campaign_id] = {
+            "id": campaign_id, "restaurant_id": self.restaurant_id, "type": channel, "subject": None,
+            "body": body, "status": status, "checkpoint": None,
+        }
+        return campaign_id
+
+    def add_audience(self, channel, contacts):
+        # contacts: iterable of (contact, opted_in)
+        self.audience[channel] = sorted(dict(contacts).items())
+
+    def add_locations(self, count):
+        for _ in range(count):
+            location_id = next(self.ids)
+            self.locations[location_id] = {
+                "id": location_id, "restaurant_id": self.restaurant_id, "name": f"Location {location_id}",
+                "phone": f"+1415{location_id:07d}",
+            }
+
+    def lock(self, key):
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        return lock
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        self.conn.in_transaction = True
+        return self
+
+    async def __aexit__(self, *exc):
+        self.conn.in_transaction = False
+        # Advisory xact locks are released at commit / rollback
+        for lock in reversed(self.conn.held_locks):
+            lock.release()
+        self.conn.held_locks.clear()
+        return False
+
+
+class MemoryConnection:
+    def __init__(self, store, latency):
+        self.store = store
+        self.latency = latency
+        self.in_transaction = False
+        self.held_locks = []
+
+    def transaction(self):
+        return _Transaction(self)
+
+    async def _roundtrip(self):
+        self.store.statements += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            await asyncio.sleep(0)
+
+    async def execute(self, query, *args):
+        await self._roundtrip()
+        store = self.store
+        if "pg_advisory_xact_lock" in query:
+            lock = store.lock(args)
+            await lock.acquire()
+            self.held_locks.append(lock)
+        elif query.startswith("CREATE TABLE"):
+            store.relations.add(query.split()[2])
+        elif query.startswith("UPDATE reminders SET is_completed"):
+            for reminder_id in args[0]:
+                store.reminders[reminder_id]["is_completed"] = True
+        elif query.startswith("INSERT INTO campaign_deliveries") and "'sending'" in query:
+            campaign_id, recipients = args
+            for recipient in recipients:
+                store.deliveries.setdefault((campaign_id, recipient), "sending")
+        elif query.startswith("INSERT INTO campaign_deliveries"):
+            campaign_id, recipients, statuses = args[:3]
+            for recipient, status in zip(recipients, statuses):
+                store.deliveries[(campaign_id, recipient)] = status
+        elif query.startswith("INSERT INTO retell_agents"):
+            restaurant_id, location_id, agent_id, config = args
+            store.agents[agent_id] = {"location_id": location_id, "version": 1, "config": config, "is_live": False}
+        elif query.startswith("UPDATE retell_agents SET config"):
+            agent = store.agents[args[0]]
+            agent.update(config=args[1], version=agent["version"] + 1, is_live=False)
+        elif query.startswith("UPDATE retell_agents SET is_live"):
+            store.agents[args[0]]["is_live"] = True
+        elif query.startswith("INSERT INTO phone_numbers"):
+            store.numbers[args[1]] = args[2]
+        elif query.startswith("UPDATE campaigns SET checkpoint"):
+            store.campaigns[args[0]]["checkpoint"] = args[1]
+        elif query.startswith("UPDATE campaigns SET status = 'sending'"):
+            store.campaigns[args[0]]["status"] = "sending"
+        elif query.startswith("UPDATE campaigns SET status"):
+            store.campaigns[args[0]]["status"] = args[1]
+        elif query.startswith("UPDATE call_logs SET transcript"):
+            segments = sorted(store.segments.get(args[0], ()))
+            if args[0] in store.call_logs and segments:
+                store.call_logs[args[0]]["transcript"] = "".join(text for *_, text in segments)
+        elif query.startswith("DELETE FROM call_sessions WHERE retell_call_id"):
+            store.sessions.pop(args[0], None)
+        elif "INSERT INTO analytics_rollups AS r" in query:
+            from .analytics import ROLLUP_FIELDS
+            for restaurant_id, granularity, bucket, *values in zip(*args):
+                row = store.rollups.setdefault((restaurant_id, granularity, bucket), {"bucket": bucket, **dict.fromkeys(ROLLUP_FIELDS, 0)})
+                for field, value in zip(ROLLUP_FIELDS, values):
+                    row[field] += value
+        return "OK"
+
+    async def cursor(self, query, *args, prefetch=None):
+        # Only the campaign audience query is streamed; one round trip per
+        # `prefetch` rows, like asyncpg's cursor
+        store = self.store
+        if "FROM customer_optins" not in query:
+            return
+        _, channel, after, campaign_id = args
+        audience = store.audience.get(channel, [])
+        position = bisect.bisect_right(audience, (after, True))
+        prefetch = prefetch or 50
+        while position < len(audience):
+            await self._roundtrip()
+            page, position = audience[position:position + prefetch], position + prefetch
+            for contact, opted_in in page:
+                if opted_in and (campaign_id, contact) not in store.deliveries:
+                    yield {"contact": contact}
+
+    async def executemany(self, query, rows):
+        await self._roundtrip()
+        store = self.store
+        if query.startswith("INSERT INTO call_transcript_segments"):
+            for call_id, seq, sent_at_ms, raw_text, _ in rows:
+                store.segments.setdefault(call_id, []).append((seq, sent_at_ms, next(store.ids), raw_text))
+        elif query.startswith("INSERT INTO call_logs"):
+            for call_id, restaurant_id, agent_id, start_ms, status in rows:
+                store.call_logs.setdefault(call_id, {"restaurant_id": restaurant_id, "agent_id": agent_id, "status": status})
+        elif query.startswith("UPDATE call_logs SET end_time"):
+            for _, status, transcript, raw, call_id, _ in rows:
+                store.call_logs.setdefault(call_id, {}).update(status=status, transcript=transcript, raw_event=raw)
+        elif query.startswith("UPDATE call_logs SET status = 'error'"):
+            for raw, call_id, _ in rows:
+                store.call_logs.setdefault(call_id, {}).update(status="error", raw_event=raw)
+
+    async def fetch(self, query, *args):
+        await self._roundtrip()
+        store = self.store
+        if query.startswith("SELECT event_key FROM webhook_event_keys"):
+            return [{"event_key": key} for key in args[0] if key in store.event_keys]
+        if "INSERT INTO webhook_event_keys" in query:
+            fresh = [key for key in args[0] if key not in store.event_keys]
+            store.event_keys.update(fresh)
+            return [{"event_key": key} for key in fresh]
+        if "LEFT JOIN retell_agents a ON a.location_id" in query:
+            agents = {agent["location_id"]: (agent_id, agent) for agent_id, agent in store.agents.items()}
+            numbers = {agent_id: number for number, agent_id in store.numbers.items()}
+            rows = []
+            for location_id, location in sorted(store.locations.items()):
+                if args[0] is not None and location_id not in args[0]:
+                    continue
+                agent_id, agent = agents.get(location_id, (None, {}))
+                rows.append({
+                    "location_id": location_id, "restaurant_id": location["restaurant_id"], "name": location["name"],
+                    "phone": location["phone"], "restaurant_name": "Load Test Bistro", "retell_agent_id": agent_id,
+                    "version": agent.get("version"), "config": agent.get("config"), "is_live": agent.get("is_live"),
+                    "phone_number": numbers.get(agent_id),
+                })
+            return rows
+        if "FROM retell_agents" in query and "UNION ALL" in query:
+            return list(store.tenants)
+        if "FROM menu_items" in query:
+            if "ANY(" in query:
+                wanted = set(args[1])
+                return [item for item_id, item in store.menu.items() if item_id in wanted and args[0] == store.restaurant_id]
+            return [item for item in store.menu.values() if args[0] == store.restaurant_id]
+        if "FROM reminders" in query and "SKIP LOCKED" in query:
+            cutoff, limit, max_attempts, lease = args
+            claimed = []
+            now = time.time()
+            while store.reminder_queue and store.reminder_queue[0][0] <= min(cutoff, now) and len(claimed) < limit:
+                _, reminder_id = heapq.heappop(store.reminder_queue)
+                row = store.reminders[reminder_id]
+                if row["is_completed"] or row["attempts"] >= max_attempts:
+                    continue
+                row["attempts"] += 1
+                claimed.append(dict(row))
+                if row["attempts"] < max_attempts:
+                    # Claimable again if not completed before the lease ends
+                    heapq.heappush(store.reminder_queue, (now + lease, reminder_id))
+            return claimed
+        if "FROM reminders" in query:
+            limit, max_attempts = args
+            pending = (
+                (due, reminder_id) for due, reminder_id in store.reminder_queue
+                if not store.reminders[reminder_id]["is_completed"] and store.reminders[reminder_id]["attempts"] < max_attempts
+            )
+            return [{"id": reminder_id, "due": due} for due, reminder_id in heapq.nsmallest(limit, pending)]
+        if "FROM analytics_rollups" in query:
+            restaurant_id, granularity, since, until = args
+            return [
+                row for (rid, kind, bucket), row in sorted(store.rollups.items())
+                if rid == restaurant_id and kind == granularity and since <= bucket < until
+            ]
+        if "FROM campaigns" in query:
+            return [dict(row) for row in store.campaigns.values() if row["status"] in ("scheduled", "sending")][:10]
+        if "FROM reservations" in query:
+            restaurant_id, start, end = args
+            inclusive = "datetime >= $2" in query
+            return [
+                {"datetime": when, "party_size": party_size}
+                for rid, when, party_size in store.reservations
+                if rid == restaurant_id and (start <= when if inclusive else start < when) and when < end
+            ]
+        return []
+
+    async def fetchrow(self, query, *args):
+        await self._roundtrip()
+        store = self.store
+        if "call_sessions" in query:
+            # sessions.py: rows never expire here, they're deleted at call.ended
+            stored = store.sessions.get(args[0])
+            if query.startswith("SELECT"):
+                return {"version": stored[0], "state": stored[1]} if stored else None
+            if query.startswith("INSERT"):
+                if stored:
+                    return None
+                store.sessions[args[0]] = (1, args[1])
+                return {"version": 1}
+            if stored is None or stored[0] != args[1]:
+                return None
+            store.sessions[args[0]] = (stored[0] + 1, args[2])
+            return {"version": stored[0] + 1}
+        if "FROM customer_optins" in query:
+            # Caller profile (callers.py): every load-test caller is new
+            return {"orders": None, "reservations": None, "sms_opt_in": None}
+        if "FROM call_transcript_segments" in query:
+            segments = sorted(store.segments.get(args[0], ()))
+            return {"transcript": "".join(text for *_, text in segments) if segments else None}
+        if "LEFT JOIN reservation_settings" in query:
+            return {"timezone": "UTC", "max_covers": None, "slot_minutes": None, "dining_minutes": None, "hours_configured": 0, "hours": None}
+        if "FROM restaurants" in query:
+            return {"name": "Load Test Bistro"}
+        if "FROM menu_items WHERE id" in query:
+            return store.menu.get(args[0])
+        if query.startswith("INSERT INTO reminders"):
+            restaurant_id, assignee, due_at, payload = args
+            reminder_id = next(store.ids)
+            due = (due_at if due_at.tzinfo else due_at.replace(tzinfo=timezone.utc)).timestamp()
+            store.reminders[reminder_id] = {
+                "id": reminder_id, "restaurant_id": restaurant_id, "assignee": assignee, "due_at": due_at,
+                "payload": payload, "attempts": 0, "is_completed": False,
+            }
+            heapq.heappush(store.reminder_queue, (due, reminder_id))
+            notifications._dispatch(None, 0, "reminders_changed", json.dumps({"id": reminder_id, "due": due}))
+            return {"id": reminder_id}
+        return None
+
+    async def fetchval(self, query, *args):
+        await self._roundtrip()
+        store = self.store
+        if "pg_try_advisory_lock" in query:
+            return True
+        if "to_regclass" in query:
+            return args[0] in store.relations
+        if query.startswith("INSERT INTO reservations"):
+            restaurant_id, _, _, when, party_size, _ = args
+            store.reservations.append((restaurant_id, when, party_size))
+        return next(store.ids)
+
+
+class MemoryPool:
+    def __init__(self, store, size, latency):
+        self.store = store
+        self.size = size
+        self._idle = [MemoryConnection(store, latency) for _ in range(size)]
+        self._available = asyncio.Semaphore(size)
+
+    async def acquire(self, timeout=None):
+        await asyncio.wait_for(self._available.acquire(), timeout)
+        return self._idle.pop()
+
+    async def release(self, conn):
+        self._idle.append(conn)
+        self._available.release()
+
+    async def close(self):
+        pass
+
+    def get_size(self):
+        return self.size
+
+    def get_idle_size(self):
+        return len(self._idle)
+
+
+def install(latency=0.0, size=None, store=None):
+    # Point database.py at a fresh in-memory pool and keep the notification
+    # listener from dialing a real server. Returns the store for inspection.
+    store = store or MemoryStore()
+    database._pool = MemoryPool(store, size or database.DB_POOL_MAX_SIZE, latency)
+    database.DATABASE_URL = database.DATABASE_URL or "memory://"
+    notifications.DATABASE_URL = None
+    return store
@@ -0,0 +1,67 @@
+# In-process stand-in for the Retell REST endpoints bootstrap.py uses, for
+# trying fleet provisioning (python -m api.bootstrap --fake-retell) and
+# bench_fleet.py without an account or a bill.
+#
+#     from .fake_retell import FakeRetell
+#     fake = FakeRetell(latency=0.15, rate_limit=0.05)
+#     client = fake.client()     # bootstrap.RetellClient on an httpx MockTransport
+#
+# Every request takes `latency` seconds; `rate_limit` of them are answered
+# 429 with a short Retry-After, the way Retell throttles bursts.
+
+import json
+import random
+import asyncio
+import itertools
+import httpx
+from .bootstrap import RetellClient
+
+
+class FakeRetell:
+    def __init__(self, latency=0.0, rate_limit=0.0, seed=None):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.agents = {}   # agent_id -> {"config": ..., "version": ..., "published_version": ...}
+        self.numbers = {}  # phone number -> {"phone_number", "inbound_agent_id", ...}
+        self.requests = {}  # endpoint -> count, including throttled ones
+        self._ids = itertools.count(1)
+
+    def client(self, retries=None):
+        kwargs = {} if retries is None else {"retries": retries}
+        return RetellClient(api_key="fake", base_url="https://retell.fake", transport=httpx.MockTransport(self.handle), **kwargs)
+
+    async def handle(self, request):
+        endpoint = request.url.path.strip("/").split("/")[0]
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rng.random() < self.rate_limit:
+            return httpx.Response(429, headers={"Retry-After": "0.05"}, json={"error": "rate limited"})
+        body = json.loads(request.content) if request.content else {}
+        path = request.url.path.strip("/").split("/")
+        if endpoint == "create-agent":
+            agent_id = f"agent_fake{next(self._ids):06d}"
+            self.agents[agent_id] = {"config": body, "version": 0, "published_version": None}
+            return httpx.Response(201, json={"agent_id": agent_id, "version": 0, **body})
+        if endpoint in ("update-agent", "publish-agent"):
+            agent = self.agents.get(path[1])
+            if agent is None:
+                return httpx.Response(404, json={"error": "agent not found"})
+            if endpoint == "update-agent":
+                agent["config"].update(body)
+                agent["version"] += 1
+                return httpx.Response(200, json={"agent_id": path[1], "version": agent["version"], **agent["config"]})
+            agent["published_version"] = agent["version"]
+            return httpx.Response(200)
+        if endpoint == "list-agents":
+            return httpx.Response(200, json=[{"agent_id": agent_id, **agent["config"]} for agent_id, agent in self.agents.items()])
+        if endpoint == "list-phone-numbers":
+            return httpx.Response(200, json=list(self.numbers.values()))
+        if endpoint == "create-phone-number":
+            if body.get("inbound_agent_id") not in self.agents:
+                return httpx.Response(400, json={"error": "unknown inbound_agent_id"})
+            number = f"+1{body.get('area_code') or 415}{next(self._ids):07d}"
+            self.numbers[number] = {"phone_number": number, **body}
+            return httpx.Response(201, json=self.numbers[number])
+        return httpx.Response(404, json={"error": f"no route {request.url.path}"})
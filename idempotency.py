@@ -0,0 +1,148 @@
+import logging
+import os
+import time
+import hashlib
+from collections import OrderedDict
+from .database import fetch_all, execute_query
+
+logger = logging.getLogger(__name__)
+
+# Recently seen event keys kept in memory per worker process.
+DEDUP_LRU_SIZE = int(os.getenv("DEDUP_LRU_SIZE", 50000))
+# Rows in webhook_event_keys older than this are pruned. Retell stops
+# redelivering long before this.
+DEDUP_RETENTION_HOURS = float(os.getenv("DEDUP_RETENTION_HOURS", 48))
+DEDUP_PRUNE_INTERVAL = 600.0
+
+# Fields that identify one event within a call, most specific first
+_IDENTITY_FIELDS = ("event_id", "sequence", "timestamp")
+# Events that happen at most once per call
+_ONCE_PER_CALL = ("call.started", "call.ended")
+
+SEEN_KEYS_QUERY = "SELECT event_key FROM webhook_event_keys WHERE event_key = ANY($1::text[])"
+CLAIM_KEYS_QUERY = (
+    "INSERT INTO webhook_event_keys (event_key, retell_call_id, event_name) "
+    "SELECT * FROM unnest($1::text[], $2::text[], $3::text[]) "
+    "ON CONFLICT (event_key) DO NOTHING RETURNING event_key"
+)
+PRUNE_QUERY = "DELETE FROM webhook_event_keys WHERE received_at < CURRENT_TIMESTAMP - make_interval(secs => $1)"
+
+
+def event_key(event, body: bytes = None) -> str:
+    call_id = event.get("call_id")
+    event_name = event.get("event_name")
+    if event_name in _ONCE_PER_CALL and call_id:
+        return f"{call_id}:{event_name}"
+    for field in _IDENTITY_FIELDS:
+        value = event.get(field)
+        if value is not None:
+            return f"{call_id}:{event_name}:{field}={value}"
+    # No identity field: Retell redelivers the exact same body, so its digest is stable
+    if body is None:
+        body = repr(sorted(event.items())).encode("utf-8")
+    return f"{call_id}:{event_name}:sha256={hashlib.sha256(body).hexdigest()}"
+
+
+class SeenKeys:
+    # Bounded LRU set of event keys.
+
+    def __init__(self, max_size=DEDUP_LRU_SIZE):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+
+    def add(self, key) -> bool:
+        # Returns False if the key was already present.
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+        return True
+
+    def discard(self, key):
+        self._keys.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+
+_seen = SeenKeys()
+_last_prune = 0.0
+
+_stats = {
+    "memory_duplicates": 0,
+    "durable_duplicates": 0,
+    "claimed": 0,
+}
+
+
+def remember_event(key) -> bool:
+    # Fast in-process check made before an event is queued. Returns False
+    # for a redelivery this worker has already accepted.
+    if _seen.add(key):
+        return True
+    _stats["memory_duplicates"] += 1
+    return False
+
+
+def forget_event(key):
+    _seen.discard(key)
+
+
+async def unclaimed_events(keyed_events):
+    # keyed_events: list of (key, event). Drops events whose key is already
+    # in webhook_event_keys (committed by this or another worker or replica)
+    # and keys repeated inside the batch. Only reads: the keys are claimed
+    # by claim_events, in the transaction that writes the events.
+    if not keyed_events:
+        return []
+    await _maybe_prune()
+    rows = await fetch_all(SEEN_KEYS_QUERY, list({key for key, _ in keyed_events}))
+    seen = {row["event_key"] for row in rows}
+    fresh = []
+    for key, event in keyed_events:
+        if key in seen:
+            _stats["durable_duplicates"] += 1
+        else:
+            seen.add(key)
+            fresh.append((key, event))
+    return fresh
+
+
+async def claim_events(conn, keyed_events):
+    # Records every key in webhook_event_keys on conn, which must be inside
+    # the transaction writing the events: a claim commits or rolls back with
+    # its event, so a failed or interrupted write leaves Retell's redelivery
+    # free to be processed. Returns the keys claimed; a key missing from it
+    # was committed by a concurrent writer first, and its event is a
+    # duplicate.
+    if not keyed_events:
+        return set()
+    keys = [key for key, _ in keyed_events]
+    call_ids = [event.get("call_id") for _, event in keyed_events]
+    event_names = [event.get("event_name") for _, event in keyed_events]
+    rows = await conn.fetch(CLAIM_KEYS_QUERY, keys, call_ids, event_names)
+    claimed = {row["event_key"] for row in rows}
+    _stats["claimed"] += len(claimed)
+    _stats["durable_duplicates"] += len(set(keys) - claimed)
+    return claimed
+
+
+async def _maybe_prune():
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < DEDUP_PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    try:
+        await execute_query(PRUNE_QUERY, DEDUP_RETENTION_HOURS * 3600)
+    except Exception as e:
+        logger.warning("Pruning webhook_event_keys failed: %s", e)
+
+
+def dedup_stats():
+    return {**_stats, "memory_keys": len(_seen)}
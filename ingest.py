@@ -0,0 +1,470 @@
+import logging
+import os
+import time
+import zlib
+import random
+import asyncio
+from datetime import datetime, timezone
+from .database import transaction
+from .analytics import Delta, restaurant_zones, rollup_rows, write_rollups
+from .sessions import open_session, close_session, update_session
+from .transcripts import append_transcript_delta, finish_transcript, restitch_later
+from .tenants import resolve_tenant, UnknownTenantError
+from .idempotency import event_key, remember_event, forget_event, unclaimed_events, claim_events
+from .metrics import Gauge, INGEST_EVENT_LATENCY, INGEST_WRITE_LATENCY, WEBHOOK_ERRORS
+from .tools import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Total events held in memory across all shards before the webhook starts
+# pushing back on Retell with 503s.
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 5000))
+# Writer tasks. Events are sharded by call_id so each call is handled by
+# exactly one worker and its events stay in order.
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
+# A worker writes once it has this many events or has waited this long.
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 200))
+WEBHOOK_BATCH_WAIT = float(os.getenv("WEBHOOK_BATCH_WAIT", 0.05))
+# How long the webhook waits for room in a full queue before answering 503.
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", 1.0))
+WEBHOOK_MAX_RETRIES = int(os.getenv("WEBHOOK_MAX_RETRIES", 5))
+WEBHOOK_RETRY_BASE_DELAY = float(os.getenv("WEBHOOK_RETRY_BASE_DELAY", 0.1))
+# Seconds to spend writing out queued events on shutdown.
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 20.0))
+# zlib level for the raw event kept on call_logs (1 = fastest, 9 = smallest).
+RAW_EVENT_COMPRESSION_LEVEL = int(os.getenv("RAW_EVENT_COMPRESSION_LEVEL", 6))
+
+# Event names Retell sends; anything else is labelled "other" in metrics
+KNOWN_EVENTS = frozenset({"call.started", "transcript.delta", "call.ended", "handover.requested", "error", "tool.invocation"})
+
+# call_logs is partitioned by start_time (see retention.py). Updates carry a
+# lower bound on start_time so Postgres only looks in the newest partitions;
+# no call runs for two days.
+WRITE_QUERIES = {
+    # A redelivered call.started is a no-op and never moves a finished call
+    # back to 'started'. The call is looked up by id first: without Retell's
+    # start_timestamp the partition key is the time of receipt, which
+    # differs on every delivery, so the unique key alone wouldn't match.
+    # Parameters are cast: $1 appears in both the SELECT list and the WHERE,
+    # and Postgres won't guess one type for both.
+    "call.started": "INSERT INTO call_logs (retell_call_id, restaurant_id, agent_id, start_time, status) "
+                    "SELECT $1::varchar, $2::int, $3::varchar, COALESCE(to_timestamp($4::numeric / 1000.0), CURRENT_TIMESTAMP), $5::varchar "
+                    "WHERE NOT EXISTS (SELECT 1 FROM call_logs WHERE retell_call_id = $1::varchar "
+                    "AND start_time > COALESCE(to_timestamp($4::numeric / 1000.0), CURRENT_TIMESTAMP) - interval '2 days') "
+                    "ON CONFLICT (retell_call_id, start_time) DO UPDATE SET agent_id = COALESCE(call_logs.agent_id, EXCLUDED.agent_id), "
+                    "status = COALESCE(call_logs.status, EXCLUDED.status), updated_at = CURRENT_TIMESTAMP",
+    "call.ended": "UPDATE call_logs SET end_time = to_timestamp($1 / 1000.0), status = $2, transcript = $3, raw_event = $4, updated_at = CURRENT_TIMESTAMP "
+                  "WHERE retell_call_id = $5 AND start_time > to_timestamp($6 / 1000.0) - interval '2 days'",
+    "error": "UPDATE call_logs SET status = 'error', raw_event = $1, updated_at = CURRENT_TIMESTAMP "
+             "WHERE retell_call_id = $2 AND start_time > to_timestamp($3 / 1000.0) - interval '2 days'",
+}
+
+
+def pack_event(event) -> bytes:
+    # Only the last event per call is kept, compressed. call.ended carries
+    # the whole transcript (and word timings), which zlib shrinks well.
+    return zlib.compress(dumps(event), RAW_EVENT_COMPRESSION_LEVEL)
+
+
+def unpack_event(blob):
+    if not blob:
+        return None
+    # Rows copied from before partitioning hold plain JSON (see schema.sql)
+    return loads(blob) if blob[:1] == b"{" else loads(zlib.decompress(blob))
+
+
+def _event_time_ms(event, *fields):
+    for field in fields:
+        if event.get(field) is not None:
+            return event[field]
+    return time.time() * 1000
+
+
+def _call_delta(restaurant_id, event):
+    # call.ended -> the call's duration, counted in the bucket it started in
+    start, end = event.get("start_timestamp"), event.get("end_timestamp")
+    if start is not None and end is not None:
+        duration_ms = end - start
+    else:
+        duration_ms = event.get("duration_ms")
+    if start is None:
+        start = _event_time_ms(event, "end_timestamp") - (duration_ms or 0)
+    at = datetime.fromtimestamp(start / 1000, timezone.utc)
+    if duration_ms is None:
+        return Delta(restaurant_id, at)
+    return Delta(restaurant_id, at, timed_calls=1, call_seconds=max(0, duration_ms) / 1000)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+_queues = []
+_workers = []
+_accepting = False
+
+_stats = {
+    "enqueued": 0,
+    "rejected": 0,
+    "processed": 0,
+    "failed": 0,
+    "duplicates": 0,
+    "batches": 0,
+    "retries": 0,
+    "flush_latency_last_ms": 0.0,
+    "flush_latency_max_ms": 0.0,
+    "flush_latency_total_ms": 0.0,
+}
+
+
+async def _with_retries(label, make_call):
+    attempt = 0
+    while True:
+        try:
+            return await make_call()
+        except Exception as e:
+            attempt += 1
+            if attempt > WEBHOOK_MAX_RETRIES:
+                raise
+            _stats["retries"] += 1
+            # Exponential backoff with full jitter so workers don't retry in lockstep
+            delay = random.uniform(0, WEBHOOK_RETRY_BASE_DELAY * 2 ** attempt)
+            logger.warning("%s failed (attempt %s/%s), retrying in %.2fs: %s", label, attempt, WEBHOOK_MAX_RETRIES, delay, e)
+            await asyncio.sleep(delay)
+
+
+async def _prepare_event(event):
+    # One event -> ([(event_name, row)], [Delta], [(call_id, coroutine
+    # factory)]). Safe to retry: nothing here is written twice.
+    rows, rollups, session_ops = [], [], []
+    event_type = event.get("event_name")
+    call_id = event.get("call_id")
+    if event_type == "call.started":
+        try:
+            tenant = await resolve_tenant(event.get("agent_id"), event.get("to_number"))
+        except UnknownTenantError as e:
+            logger.warning("Skipping call: %s", e, extra={"call_id": call_id})
+        else:
+            rows.append((event_type, (call_id, tenant.restaurant_id, event.get("agent_id"), event.get("start_timestamp"), "started")))
+            started_at = datetime.fromtimestamp(_event_time_ms(event, "start_timestamp") / 1000, timezone.utc)
+            rollups.append(Delta(tenant.restaurant_id, started_at, calls=1))
+            session_ops.append((call_id, lambda: open_session(call_id, tenant)))
+            logger.info("Call started", extra={"call_id": call_id, "restaurant_id": tenant.restaurant_id, "event": event_type})
+    elif event_type == "transcript.delta":
+        # Buffered and appended to call_transcript_segments in batches; the
+        # call_logs row is only written once, at call.ended.
+        await append_transcript_delta(call_id, event.get("transcript"), event.get("sequence"), event.get("timestamp"))
+    elif event_type == "call.ended":
+        status = event.get("call_status")
+        transcript = await finish_transcript(call_id, event.get("transcript"))
+        since = _event_time_ms(event, "start_timestamp", "end_timestamp")
+        rows.append((event_type, (event.get("end_timestamp"), status, transcript, pack_event(event), call_id, since)))
+        try:
+            tenant = await resolve_tenant(event.get("agent_id"), event.get("to_number"))
+        except UnknownTenantError:
+            pass  # Already skipped at call.started
+        else:
+            rollups.append(_call_delta(tenant.restaurant_id, event))
+        session_ops.append((call_id, lambda: close_session(call_id)))
+        logger.info("Call ended with status %s", status, extra={"call_id": call_id, "event": event_type})
+    elif event_type == "handover.requested":
+        reason = event.get("reason")
+        logger.warning("Handover requested", extra={"call_id": call_id, "event": event_type, "reason": reason})
+        try:
+            tenant = await resolve_tenant(event.get("agent_id"), event.get("to_number"))
+        except UnknownTenantError as e:
+            logger.warning("Not counting handover: %s", e, extra={"call_id": call_id})
+        else:
+            at = datetime.fromtimestamp(_event_time_ms(event, "timestamp") / 1000, timezone.utc)
+            rollups.append(Delta(tenant.restaurant_id, at, handovers=1))
+        session_ops.append((call_id, lambda: update_session(call_id, _handover(reason))))
+    elif event_type == "error":
+        rows.append((event_type, (pack_event(event), call_id, _event_time_ms(event, "start_timestamp", "timestamp"))))
+        logger.error("Call error: %s", event.get("error_message"), extra={"call_id": call_id, "event": event_type})
+    else:
+        logger.info("Unhandled event type %s", event_type, extra={"call_id": call_id, "event": event_type})
+    return rows, rollups, session_ops
+
+
+async def _prepare(keyed_events):
+    # Turn a batch of (key, event) pairs into (event_name, rows, keys) write
+    # groups, keeping arrival order and coalescing adjacent events of the
+    # same kind. keys[i] is the event key behind rows[i]. Dashboard rollups
+    # (analytics.py) go last as one "rollup" group of Deltas, written in the
+    # same transaction as the events they count. Returns the groups and the
+    # events prepared: one that still fails after retries (e.g. its tenant
+    # or transcript can't be read) is dropped on its own and its key
+    # forgotten, so Retell's redelivery of it gets through.
+    writes = []
+    rollups, rollup_keys = [], []
+    session_ops = {}  # call_id -> [coroutine factory], run in order per call
+    prepared = []
+
+    def add(event_name, row, key):
+        if writes and writes[-1][0] == event_name:
+            writes[-1][1].append(row)
+            writes[-1][2].append(key)
+        else:
+            writes.append((event_name, [row], [key]))
+
+    for key, event in keyed_events:
+        started = time.perf_counter()
+        event_type = event.get("event_name")
+        call_id = event.get("call_id")
+        try:
+            event_rows, event_rollups, event_session_ops = await _with_retries(
+                f"Preparing {event_type} for call {call_id}", lambda: _prepare_event(event)
+            )
+        except Exception as e:
+            _stats["failed"] += 1
+            WEBHOOK_ERRORS.inc("prepare_failed")
+            logger.error("Dropping %s event after retries: %s", event_type, e, extra={"call_id": call_id, "event": event_type})
+            forget_event(key)
+            continue
+        prepared.append((key, event))
+        for event_name, row in event_rows:
+            if event_name == "error" and writes and writes[-1][0] == event_name:
+                # Only the latest error per call survives, so repeated errors collapse into one row
+                _, rows, keys = writes[-1]
+                keep = [i for i, other in enumerate(rows) if other[1] != call_id]
+                writes[-1] = (event_name, [rows[i] for i in keep], [keys[i] for i in keep])
+            add(event_name, row, key)
+        rollups.extend(event_rollups)
+        rollup_keys.extend([key] * len(event_rollups))
+        for op_call_id, op in event_session_ops:
+            if op_call_id:
+                session_ops.setdefault(op_call_id, []).append(op)
+        INGEST_EVENT_LATENCY.since(started, event_type if event_type in KNOWN_EVENTS else "other")
+    if rollups:
+        writes.append(("rollup", rollups, rollup_keys))
+    if session_ops:
+        await asyncio.gather(*(_run_session_ops(call_id, ops) for call_id, ops in session_ops.items()))
+    return writes, prepared
+
+
+def _handover(reason):
+    def mark(state):
+        state.setdefault("handover", {"reason": reason, "at": time.time()})
+    return mark
+
+
+async def _run_session_ops(call_id, ops):
+    # Shared call sessions (sessions.py) are bookkeeping next to call_logs:
+    # a failure is logged and the events are still written.
+    for op in ops:
+        try:
+            await op()
+        except Exception as e:
+            logger.warning("Call session update failed: %s", e, extra={"call_id": call_id})
+
+
+async def _commit(writes, claims):
+    # One transaction for the events' rows and their dedup keys (claims,
+    # [(key, event)]). Rows whose key a concurrent writer claimed first are
+    # skipped; returns how many events that was.
+    deltas = [delta for event_name, rows, _ in writes if event_name == "rollup" for delta in rows]
+    zones = await restaurant_zones({delta.restaurant_id for delta in deltas}) if deltas else {}
+    async with transaction() as conn:
+        claimed = await claim_events(conn, claims)
+        for event_name, rows, keys in writes:
+            if len(claimed) < len(claims):
+                rows = [row for row, key in zip(rows, keys) if key in claimed]
+                if not rows:
+                    continue
+            started = time.perf_counter()
+            if event_name == "rollup":
+                await write_rollups(conn, rollup_rows(rows, zones))
+            else:
+                await conn.executemany(WRITE_QUERIES[event_name], rows)
+            INGEST_WRITE_LATENCY.since(started, event_name)
+    for key, event in claims:
+        if key in claimed and event.get("event_name") == "call.ended" and not event.get("transcript"):
+            restitch_later(event.get("call_id"), _event_time_ms(event, "start_timestamp", "end_timestamp"))
+    return len(claims) - len(claimed)
+
+
+async def _claim_now(keyed_events):
+    async with transaction() as conn:
+        return await claim_events(conn, keyed_events)
+
+
+async def _claim_deltas(keyed_events):
+    # Transcript deltas go to the transcript buffer, not into _commit's
+    # transaction, so their keys are claimed first: only a delta this
+    # worker now owns is buffered, and one whose claim fails is forgotten
+    # before any of its text is, leaving Retell's redelivery to add it once.
+    deltas = [(key, event) for key, event in keyed_events if event.get("event_name") == "transcript.delta"]
+    if not deltas:
+        return keyed_events
+    try:
+        claimed = await _with_retries(f"Claiming {len(deltas)} transcript deltas", lambda: _claim_now(deltas))
+    except Exception as e:
+        _stats["failed"] += len(deltas)
+        WEBHOOK_ERRORS.inc("write_failed", amount=len(deltas))
+        logger.error("Dropping %s transcript delta(s) after retries: %s", len(deltas), e)
+        for key, _ in deltas:
+            forget_event(key)
+        claimed = set()
+    else:
+        _stats["duplicates"] += len(deltas) - len(claimed)
+    return [(key, event) for key, event in keyed_events if event.get("event_name") != "transcript.delta" or key in claimed]
+
+
+async def write_batch(keyed_events):
+    started = time.perf_counter()
+    # Drop redeliveries another worker or replica already committed. The
+    # keys are claimed with the writes below (transcript deltas' just before
+    # they are buffered), so an event is only ever marked as seen once its
+    # rows are in.
+    fresh = await _with_retries(
+        f"Checking {len(keyed_events)} webhook events",
+        lambda: unclaimed_events(keyed_events)
+    )
+    _stats["duplicates"] += len(keyed_events) - len(fresh)
+    fresh = await _claim_deltas(fresh)
+    writes, prepared = await _prepare(fresh)
+    fresh = [(key, event) for key, event in prepared if event.get("event_name") != "transcript.delta"]
+    if fresh:
+        try:
+            raced = await _with_retries(f"Webhook batch of {len(fresh)} events", lambda: _commit(writes, fresh))
+            _stats["duplicates"] += raced
+        except Exception as e:
+            # Isolate the bad events instead of losing the whole batch. An
+            # event's rows (its call_logs write and its rollup) commit together
+            # with its key; events with no rows of their own share one commit.
+            logger.error("Webhook batch failed after retries, writing events one at a time: %s", e)
+            by_key = {key: [] for key, _ in fresh}
+            for event_name, rows, keys in writes:
+                for row, key in zip(rows, keys):
+                    by_key[key].append((event_name, [row], [key]))
+            events = dict(fresh)
+            rowless = [(key, events[key]) for key, event_writes in by_key.items() if not event_writes]
+            groups = [(event_writes, [(key, events[key])]) for key, event_writes in by_key.items() if event_writes]
+            if rowless:
+                groups.append(([], rowless))
+            for event_writes, claims in groups:
+                try:
+                    _stats["duplicates"] += await _commit(event_writes, claims)
+                except Exception as row_error:
+                    _stats["failed"] += len(claims)
+                    WEBHOOK_ERRORS.inc("write_failed", amount=len(claims))
+                    logger.error("Dropping %s event(s) after retries: %s", len(claims), row_error)
+                    # Nothing was claimed, so Retell's next redelivery gets through
+                    for key, _ in claims:
+                        forget_event(key)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    _stats["batches"] += 1
+    _stats["processed"] += len(keyed_events)
+    _stats["flush_latency_last_ms"] = elapsed_ms
+    _stats["flush_latency_total_ms"] += elapsed_ms
+    if elapsed_ms > _stats["flush_latency_max_ms"]:
+        _stats["flush_latency_max_ms"] = elapsed_ms
+
+
+async def _next_batch(queue):
+    events = [await queue.get()]
+    deadline = time.monotonic() + WEBHOOK_BATCH_WAIT
+    while len(events) < WEBHOOK_BATCH_SIZE:
+        try:
+            events.append(queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            events.append(await asyncio.wait_for(queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return events
+
+
+async def _worker(queue):
+    while True:
+        events = await _next_batch(queue)
+        try:
+            await write_batch(events)
+        except Exception as e:
+            _stats["failed"] += len(events)
+            WEBHOOK_ERRORS.inc("dropped", amount=len(events))
+            logger.error("Webhook worker dropped %s events: %s", len(events), e)
+            for key, _ in events:
+                forget_event(key)
+        finally:
+            for _ in events:
+                queue.task_done()
+
+
+def _shard(call_id):
+    return _queues[hash(call_id) % len(_queues)]
+
+
+async def enqueue_event(event, body: bytes = None):
+    # Returns False when the event is a redelivery this process already
+    # accepted; nothing is queued in that case.
+    if not _accepting:
+        raise QueueFullError("Webhook ingestion is not running.")
+    key = event_key(event, body)
+    if not remember_event(key):
+        _stats["duplicates"] += 1
+        return False
+    queue = _shard(event.get("call_id"))
+    try:
+        queue.put_nowait((key, event))
+    except asyncio.QueueFull:
+        try:
+            await asyncio.wait_for(queue.put((key, event)), WEBHOOK_ENQUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            _stats["rejected"] += 1
+            forget_event(key)
+            raise QueueFullError("Webhook queue is full.")
+    _stats["enqueued"] += 1
+    return True
+
+
+async def start_ingest():
+    global _accepting
+    if _workers:
+        return
+    shard_size = max(1, WEBHOOK_QUEUE_SIZE // WEBHOOK_WORKERS)
+    for _ in range(WEBHOOK_WORKERS):
+        queue = asyncio.Queue(maxsize=shard_size)
+        _queues.append(queue)
+        _workers.append(asyncio.create_task(_worker(queue)))
+    _accepting = True
+
+
+async def stop_ingest():
+    global _accepting
+    _accepting = False
+    if _queues:
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in _queues)), WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("Webhook drain timed out with %s events still queued", queue_depth())
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queues.clear()
+
+
+def queue_depth():
+    return sum(q.qsize() for q in _queues)
+
+
+INGEST_QUEUE_DEPTH = Gauge("ingest_queue_depth", "Webhook events queued for the ingest workers.", callback=lambda: {(): queue_depth()})
+
+
+def ingest_stats():
+    batches = _stats["batches"]
+    return {
+        **_stats,
+        "accepting": _accepting,
+        "queue_depth": queue_depth(),
+        "queue_capacity": sum(q.maxsize for q in _queues),
+        "shard_depths": [q.qsize() for q in _queues],
+        "flush_latency_avg_ms": round(_stats["flush_latency_total_ms"] / batches, 3) if batches else 0.0,
+    }
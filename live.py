@@ -0,0 +1,432 @@
+import logging
+import os
+import sys
+import time
+import hmac
+import hashlib
+import asyncio
+from collections import deque
+from .database import fetch_all
+from .notifications import subscribe, notify, is_listening
+from .tenants import resolve_tenant, UnknownTenantError
+from .tools import dumps, loads
+from .metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Live call board for staff: calls in progress per restaurant with the tail
+# of their transcript, handover requests and bookings made on the call,
+# pushed to subscribers as they happen instead of polled from call_logs.
+#
+# Every worker keeps the whole board. What a worker sees itself (webhooks,
+# tool calls) is applied and fanned out at once, then batched onto
+# LIVE_NOTIFY_CHANNEL so the other workers and replicas apply it too. A
+# worker that starts mid-call seeds the board from call_logs; transcripts
+# and bookings from before its start are not on it (see board_since in the
+# snapshot).
+#
+# Boards are opened with a token scoped to one restaurant (see
+# live_board_token), signed with LIVE_BOARD_SECRET by whatever signs staff
+# in. Without the secret the endpoint refuses every connection.
+
+LIVE_NOTIFY_CHANNEL = "live_calls"
+# Events a subscriber may have waiting; one that falls this far behind is
+# disconnected (it reconnects and starts again from a snapshot) rather than
+# holding up everyone else or growing without bound.
+LIVE_BUFFER = int(os.getenv("LIVE_BUFFER", 256))
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", 10000))
+# Transcript fragments kept per call, and characters kept per fragment.
+LIVE_TRANSCRIPT_TAIL = int(os.getenv("LIVE_TRANSCRIPT_TAIL", 20))
+LIVE_TEXT_MAX = int(os.getenv("LIVE_TEXT_MAX", 500))
+# Seconds between NOTIFYs carrying this worker's events to the others.
+LIVE_NOTIFY_INTERVAL = float(os.getenv("LIVE_NOTIFY_INTERVAL", 0.05))
+# Seconds between keep-alives to every subscriber; also how quickly a
+# vanished client is noticed.
+LIVE_HEARTBEAT = float(os.getenv("LIVE_HEARTBEAT", 15.0))
+# Calls with no activity for this long are taken off the board (their
+# call.ended was missed).
+LIVE_CALL_IDLE = float(os.getenv("LIVE_CALL_IDLE", 2 * 3600))
+LIVE_BOARD_SECRET = os.getenv("LIVE_BOARD_SECRET")
+# Seconds a token minted by live_board_token stays valid.
+LIVE_TOKEN_TTL = int(os.getenv("LIVE_TOKEN_TTL", 12 * 3600))
+# Postgres rejects NOTIFY payloads over 8000 bytes
+NOTIFY_PAYLOAD_MAX = 7900
+
+HEARTBEAT = b": keep-alive\n\n"
+
+# Calls in progress when this worker starts; call.started is written
+# asynchronously (ingest.py), so one started moments ago may be missed.
+SEED_QUERY = (
+    "SELECT retell_call_id, restaurant_id, start_time FROM call_logs "
+    "WHERE start_time > CURRENT_TIMESTAMP - make_interval(secs => $1) "
+    "AND end_time IS NULL AND status = 'started' AND restaurant_id IS NOT NULL"
+)
+
+LIVE_DROPPED = Counter("live_subscribers_dropped_total", "Live board subscribers disconnected for falling behind.")
+
+_origin = f"{os.getpid()}-{os.urandom(4).hex()}"  # this worker, to skip our own NOTIFYs
+
+
+def sse(event_type, data) -> bytes:
+    return b"event: " + event_type.encode("utf-8") + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+class Subscriber:
+    # One connected board: a bounded buffer of encoded frames and the
+    # future its reader sleeps on. Idle, it is a deque and nothing else.
+    __slots__ = ("restaurant_id", "buffer", "size", "waiter", "dropped")
+
+    def __init__(self, restaurant_id, size=LIVE_BUFFER):
+        self.restaurant_id = restaurant_id
+        self.buffer = deque()
+        self.size = size
+        self.waiter = None
+        self.dropped = False
+
+    def push(self, frame):
+        if self.dropped:
+            return
+        if len(self.buffer) >= self.size:
+            self.dropped = True
+            self.buffer.clear()
+            LIVE_DROPPED.inc()
+        else:
+            self.buffer.append(frame)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def next(self):
+        # Every frame waiting, or None once dropped
+        while not self.buffer and not self.dropped:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        if self.dropped:
+            return None
+        frames = list(self.buffer)
+        self.buffer.clear()
+        return frames
+
+
+class LiveBoard:
+    # Board state plus per-restaurant fan-out. apply() takes events as
+    # published: {"type", "call_id", "restaurant_id", "at", ...}.
+
+    def __init__(self):
+        self.calls = {}        # restaurant_id -> {call_id: call}
+        self.restaurants = {}  # call_id -> restaurant_id
+        self.subscribers = {}  # restaurant_id -> set of Subscriber
+        self.since = time.time()  # events before this were never seen here
+        self.stats = {"events": 0, "unknown_calls": 0, "delivered": 0, "dropped": 0}
+
+    def subscribe(self, restaurant_id, size=LIVE_BUFFER):
+        subscriber = Subscriber(restaurant_id, size)
+        self.subscribers.setdefault(restaurant_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscribers = self.subscribers.get(subscriber.restaurant_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[subscriber.restaurant_id]
+
+    def subscriber_count(self):
+        return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+    def snapshot(self, restaurant_id):
+        return {
+            "restaurant_id": restaurant_id,
+            "board_since": self.since,
+            "calls": [{**call, "transcript": list(call["transcript"])} for call in self.calls.get(restaurant_id, {}).values()],
+        }
+
+    def apply(self, event):
+        call_id = event.get("call_id")
+        restaurant_id = event.get("restaurant_id") or self.restaurants.get(call_id)
+        if restaurant_id is None:
+            # Transcript deltas carry no tenant; this call's start wasn't seen
+            self.stats["unknown_calls"] += 1
+            return
+        self.stats["events"] += 1
+        event_type = event["type"]
+        if call_id is None:
+            # A tool call without a call id: alert, but nothing to track
+            self.fan_out(restaurant_id, event_type, event)
+            return
+        calls = self.calls.setdefault(restaurant_id, {})
+        call = calls.get(call_id)
+        if event_type == "call.ended":
+            calls.pop(call_id, None)
+            self.restaurants.pop(call_id, None)
+            if not calls:
+                del self.calls[restaurant_id]
+        else:
+            if call is None:
+                # Whichever event arrives first puts the call on the board
+                call = calls[call_id] = {
+                    "call_id": call_id, "from_number": None, "started_at": event["at"], "updated_at": event["at"],
+                    "transcript": deque(maxlen=LIVE_TRANSCRIPT_TAIL), "handover": None, "orders": [], "reservations": [],
+                }
+                self.restaurants[call_id] = restaurant_id
+            call["updated_at"] = event["at"]
+            if event_type == "call.started":
+                call["from_number"] = event.get("from_number")
+                call["started_at"] = event["at"]
+            elif event_type == "transcript":
+                call["transcript"].append(event["text"])
+            elif event_type == "handover":
+                if call["handover"] is not None:
+                    return  # staff were already alerted for this call
+                call["handover"] = {"reason": event.get("reason"), "at": event["at"]}
+            elif event_type == "order":
+                call["orders"].append({key: event.get(key) for key in ("order_id", "total_amount", "items")})
+            elif event_type == "reservation":
+                call["reservations"].append({key: event.get(key) for key in ("reservation_id", "datetime", "party_size")})
+        self.fan_out(restaurant_id, event_type, {**event, "restaurant_id": restaurant_id})
+
+    def fan_out(self, restaurant_id, event_type, data):
+        subscribers = self.subscribers.get(restaurant_id)
+        if not subscribers:
+            return
+        # Encoded once, however many boards are open
+        frame = sse(event_type, data)
+        dropped = []
+        for subscriber in subscribers:
+            subscriber.push(frame)
+            if subscriber.dropped:
+                dropped.append(subscriber)
+        self.stats["delivered"] += len(subscribers) - len(dropped)
+        self.stats["dropped"] += len(dropped)
+        for subscriber in dropped:
+            self.unsubscribe(subscriber)
+
+    def heartbeat(self, now):
+        for subscribers in list(self.subscribers.values()):
+            for subscriber in list(subscribers):
+                subscriber.push(HEARTBEAT)
+                if subscriber.dropped:
+                    self.stats["dropped"] += 1
+                    self.unsubscribe(subscriber)
+        for restaurant_id, calls in list(self.calls.items()):
+            for call_id in [call_id for call_id, call in calls.items() if now - call["updated_at"] > LIVE_CALL_IDLE]:
+                del calls[call_id]
+                self.restaurants.pop(call_id, None)
+            if not calls:
+                del self.calls[restaurant_id]
+
+
+_board = LiveBoard()
+_outbox = []
+_task = None
+
+_stats = {
+    "published": 0,
+    "notifies": 0,
+    "notify_failures": 0,
+    "received": 0,
+    "resets": 0,
+    "seeded": 0,
+}
+
+
+def publish_live(event_type, call_id, restaurant_id=None, **data):
+    # Applies the event here now and queues it for the other workers.
+    # Never raises into the webhook or tool that reports it.
+    event = {"type": event_type, "call_id": call_id, "restaurant_id": restaurant_id, "at": time.time(), **data}
+    if isinstance(event.get("text"), str):
+        event["text"] = event["text"][:LIVE_TEXT_MAX]
+    _stats["published"] += 1
+    try:
+        _board.apply(event)
+    except Exception as e:
+        logger.warning("Live board update failed: %s", e, extra={"call_id": call_id})
+    if _task is not None:
+        _outbox.append(dumps(event))
+
+
+async def publish_webhook_event(event):
+    # Retell webhook -> board event. Tenants come from the cache.
+    event_type = event.get("event_name")
+    call_id = event.get("call_id")
+    if event_type == "transcript.delta":
+        if event.get("transcript"):
+            publish_live("transcript", call_id, text=event["transcript"])
+        return
+    if event_type not in ("call.started", "call.ended", "handover.requested"):
+        return
+    try:
+        tenant = await resolve_tenant(event.get("agent_id"), event.get("to_number"))
+        restaurant_id = tenant.restaurant_id
+    except UnknownTenantError:
+        restaurant_id = None  # the board knows the call from its start, if anywhere
+    except Exception as e:
+        logger.warning("Live board could not resolve tenant: %s", e, extra={"call_id": call_id})
+        restaurant_id = None
+    if event_type == "call.started":
+        publish_live("call.started", call_id, restaurant_id, from_number=event.get("from_number"))
+    elif event_type == "call.ended":
+        publish_live("call.ended", call_id, restaurant_id, status=event.get("call_status"))
+    else:
+        publish_live("handover", call_id, restaurant_id, reason=event.get("reason"))
+
+
+def _token_signature(restaurant_id, expires):
+    message = f"live:{restaurant_id}:{expires}".encode("utf-8")
+    return hmac.new(LIVE_BOARD_SECRET.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def live_board_token(restaurant_id, ttl=LIVE_TOKEN_TTL):
+    # "<expiry epoch>.<HMAC of restaurant id and expiry>": opens that one
+    # restaurant's board until it expires
+    expires = int(time.time() + ttl)
+    return f"{expires}.{_token_signature(restaurant_id, expires)}"
+
+
+def check_live_board_token(restaurant_id, token):
+    expires, _, signature = (token or "").partition(".")
+    if not LIVE_BOARD_SECRET or not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _token_signature(restaurant_id, int(expires)))
+
+
+def subscribe_live(restaurant_id):
+    # -> (snapshot frame, Subscriber), or None when this worker is full
+    if _board.subscriber_count() >= LIVE_MAX_SUBSCRIBERS:
+        return None
+    return sse("snapshot", _board.snapshot(restaurant_id)), _board.subscribe(restaurant_id)
+
+
+def unsubscribe_live(subscriber):
+    _board.unsubscribe(subscriber)
+
+
+def _on_notify(payload):
+    _stats["received"] += 1
+    try:
+        message = loads(payload)
+    except ValueError as e:
+        logger.warning("Ignoring malformed live board notification: %s", e)
+        return
+    if message.get("origin") == _origin:
+        return
+    for event in message.get("events", ()):
+        try:
+            _board.apply(event)
+        except Exception as e:
+            logger.warning("Live board update failed: %s", e, extra={"call_id": event.get("call_id")})
+
+
+def _on_reset():
+    # Events from other workers published while disconnected are gone;
+    # calls whose end was missed age out after LIVE_CALL_IDLE
+    _stats["resets"] += 1
+
+
+def _batches(encoded):
+    # Pre-encoded events -> NOTIFY payloads under Postgres's limit
+    head = b'{"origin":' + dumps(_origin) + b',"events":['
+    batch, size = [], len(head) + 2
+    for event in encoded:
+        if len(event) + size + 1 > NOTIFY_PAYLOAD_MAX:
+            if batch:
+                yield head + b",".join(batch) + b"]}"
+                batch, size = [], len(head) + 2
+            if len(event) + size > NOTIFY_PAYLOAD_MAX:
+                logger.warning("Live board event too large to share, kept on this worker")
+                continue
+        batch.append(event)
+        size += len(event) + 1
+    if batch:
+        yield head + b",".join(batch) + b"]}"
+
+
+async def _flush():
+    global _outbox
+    if not _outbox:
+        return
+    encoded, _outbox = _outbox, []
+    if not is_listening():
+        # Without a listener connection this worker is cut off either way
+        return
+    for payload in _batches(encoded):
+        try:
+            await notify(LIVE_NOTIFY_CHANNEL, payload.decode("utf-8"))
+            _stats["notifies"] += 1
+        except Exception as e:
+            # The board is best-effort: the other workers miss these
+            _stats["notify_failures"] += 1
+            logger.warning("Live board notify failed: %s", e)
+
+
+async def _run():
+    next_heartbeat = time.monotonic() + LIVE_HEARTBEAT
+    while True:
+        await asyncio.sleep(LIVE_NOTIFY_INTERVAL)
+        await _flush()
+        if time.monotonic() >= next_heartbeat:
+            next_heartbeat = time.monotonic() + LIVE_HEARTBEAT
+            _board.heartbeat(time.time())
+
+
+async def _seed():
+    # After subscribing, so nothing published meanwhile is missed
+    try:
+        rows = await fetch_all(SEED_QUERY, LIVE_CALL_IDLE)
+    except Exception as e:
+        logger.warning("Live board could not load calls in progress: %s", e)
+        return
+    for row in rows:
+        if row["retell_call_id"] not in _board.restaurants:
+            _board.apply({"type": "call.started", "call_id": row["retell_call_id"], "restaurant_id": row["restaurant_id"],
+                          "at": row["start_time"].timestamp(), "from_number": None})
+    _stats["seeded"] = len(rows)
+
+
+async def start_live():
+    global _task
+    if _task is None:
+        _board.since = time.time()
+        await subscribe(LIVE_NOTIFY_CHANNEL, _on_notify, on_reset=_on_reset)
+        await _seed()
+        _task = asyncio.create_task(_run())
+
+
+async def stop_live():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        await _flush()
+
+
+def live_stats():
+    return {
+        **_stats,
+        **_board.stats,
+        "subscribers": _board.subscriber_count(),
+        "active_calls": len(_board.restaurants),
+        "listening": is_listening(),
+    }
+
+
+LIVE_SUBSCRIBERS = Gauge("live_subscribers", "Live board subscribers connected to this worker.", callback=lambda: {(): _board.subscriber_count()})
+
+
+def main():
+    # python -m api.live <restaurant_id> [ttl seconds]: mint a board token
+    if not LIVE_BOARD_SECRET:
+        raise SystemExit("LIVE_BOARD_SECRET is not set.")
+    if len(sys.argv) not in (2, 3):
+        raise SystemExit("usage: python -m api.live <restaurant_id> [ttl seconds]")
+    print(live_board_token(int(sys.argv[1]), int(sys.argv[2]) if len(sys.argv) == 3 else LIVE_TOKEN_TTL))
+
+
+if __name__ == "__main__":
+    main()
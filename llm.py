@@ -0,0 +1,145 @@
+import logging
+import os
+import re
+import json
+import asyncio
+from datetime import date, timedelta
+
+try:
+    import httpx
+except ImportError:  # Only needed for the OpenAI-compatible client
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# "openai" streams from any OpenAI-compatible /chat/completions endpoint;
+# "stub" is a deterministic local model for development and load tests.
+LLM_API_KEY = os.getenv("LLM_API_KEY") or os.getenv("OPENAI_API_KEY")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai" if LLM_API_KEY else "stub")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", 0.3))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30.0))
+# Stub pacing, roughly what a hosted model streams at
+STUB_LLM_FIRST_TOKEN_DELAY = float(os.getenv("STUB_LLM_FIRST_TOKEN_DELAY", 0.15))
+STUB_LLM_TOKEN_DELAY = float(os.getenv("STUB_LLM_TOKEN_DELAY", 0.02))
+
+# Every client's stream(messages, tools) is an async generator of
+#     ("text", delta)
+#     ("tool_call", tool_call_id, name, arguments_dict)
+# Text is forwarded to Retell as it arrives; tool calls are yielded once
+# their arguments are complete.
+
+
+class StubLLM:
+    # Keyword-driven stand-in that exercises the same paths as a real model:
+    # streamed text, tool calls, and a spoken answer after tool results.
+
+    async def _speak(self, text, first_token_delay=STUB_LLM_FIRST_TOKEN_DELAY):
+        await asyncio.sleep(first_token_delay)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(STUB_LLM_TOKEN_DELAY)
+            yield ("text", word if i == len(words) - 1 else word + " ")
+
+    async def stream(self, messages, tools):
+        last = messages[-1]
+        if last["role"] == "tool":
+            result = json.loads(last["content"])
+            if result.get("status") != "success":
+                reply = result.get("message") or "Sorry, something went wrong on my end."
+            elif "data" in result:
+                reply = f"I found {len(result['data'])} options for you. Which would you like?"
+            else:
+                reply = "All done. Is there anything else I can help you with?"
+            async for event in self._speak(reply):
+                yield event
+            return
+
+        heard = last.get("content", "").lower()
+        await asyncio.sleep(STUB_LLM_FIRST_TOKEN_DELAY)
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        if re.search(r"\b(menu|vegetarian|vegan|spicy)\b", heard):
+            yield ("tool_call", "stub-menu", "get_menu", {"tags": [t for t in ("vegetarian", "vegan", "spicy") if t in heard] or None})
+        elif re.search(r"\b(book|table|reservation|reserve)\b", heard):
+            yield ("tool_call", "stub-slots", "get_timeslots", {"date": tomorrow, "party_size": 4})
+        elif re.search(r"\b(manager|human|person|staff)\b", heard):
+            yield ("tool_call", "stub-handover", "handover_human", {"reason": "Caller asked for staff"})
+        else:
+            reply = "Happy to help. Would you like a reservation, a takeout order, or have a question about events?"
+            async for event in self._speak(reply, first_token_delay=0):
+                yield event
+
+
+class OpenAIChatLLM:
+    def __init__(self):
+        if httpx is None:
+            raise RuntimeError("LLM_PROVIDER=openai requires the httpx package.")
+        if not LLM_API_KEY:
+            raise RuntimeError("LLM_API_KEY (or OPENAI_API_KEY) is not set.")
+        # One client per process so every turn reuses a warm TLS connection
+        self.client = httpx.AsyncClient(
+            base_url=LLM_BASE_URL,
+            headers={"Authorization": f"Bearer {LLM_API_KEY}"},
+            timeout=LLM_TIMEOUT,
+        )
+
+    async def stream(self, messages, tools):
+        request = {
+            "model": LLM_MODEL,
+            "messages": messages,
+            "temperature": LLM_TEMPERATURE,
+            "stream": True,
+        }
+        if tools:
+            request["tools"] = [{"type": "function", "function": tool} for tool in tools]
+        calls = {}  # index -> [id, name, argument fragments]
+        async with self.client.stream("POST", "/chat/completions", json=request) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[6:]
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or ()
+                if not choices:
+                    continue
+                delta = choices[0].get("delta") or {}
+                if delta.get("content"):
+                    yield ("text", delta["content"])
+                for fragment in delta.get("tool_calls") or ():
+                    call = calls.setdefault(fragment["index"], [None, None, []])
+                    function = fragment.get("function") or {}
+                    call[0] = fragment.get("id") or call[0]
+                    call[1] = function.get("name") or call[1]
+                    call[2].append(function.get("arguments") or "")
+        for tool_call_id, name, fragments in calls.values():
+            try:
+                arguments = json.loads("".join(fragments) or "{}")
+            except ValueError:
+                logger.warning("Discarding malformed arguments for tool %s", name, extra={"tool": name})
+                arguments = {}
+            yield ("tool_call", tool_call_id, name, arguments)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_llm = None
+
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        _llm = OpenAIChatLLM() if LLM_PROVIDER == "openai" else StubLLM()
+        logger.info("Using %s LLM client", LLM_PROVIDER)
+    return _llm
+
+
+async def close_llm():
+    global _llm
+    if _llm is not None and hasattr(_llm, "close"):
+        await _llm.close()
+    _llm = None
@@ -0,0 +1,296 @@
+import logging
+import os
+import time
+import asyncio
+from datetime import date
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from .database import fetch_one
+from .llm import get_llm
+from .logs import bind_call, unbind_call
+from .menu_cache import get_menu_snapshot
+from .metrics import LLM_FIRST_CHUNK_LATENCY, LLM_RESPONSE_LATENCY, LLM_BARGE_INS
+from .prompts import SYSTEM_PROMPT, TOOL_SCHEMA
+from .tenants import resolve_tenant, set_current_tenant, reset_current_tenant, UnknownTenantError
+from .callers import prefetch_caller, caller_profile, set_current_call, reset_current_call
+from .tools import dispatch_tool, dumps, loads, UnknownToolError, ToolValidationError
+
+logger = logging.getLogger(__name__)
+
+# Tool rounds per response before the model has to answer in words.
+LLM_MAX_TOOL_ROUNDS = int(os.getenv("LLM_MAX_TOOL_ROUNDS", 3))
+# Spoken while a tool runs if the model hasn't said anything yet this turn.
+LLM_TOOL_FILLER = os.getenv("LLM_TOOL_FILLER", "One moment while I check that.")
+# Prewarmed contexts held for calls in progress; the oldest is dropped past this.
+CALL_CONTEXT_MAX = int(os.getenv("CALL_CONTEXT_MAX", 2000))
+# Where Retell transfers the caller after handover_human. Unset keeps the
+# caller with the agent while staff are alerted.
+HANDOVER_TRANSFER_NUMBER = os.getenv("HANDOVER_TRANSFER_NUMBER")
+
+
+class CallContext:
+    # Restaurant facts for one call, resolved at call.started so the first
+    # response never waits on Postgres.
+
+    def __init__(self, tenant, restaurant_name, snapshot):
+        self.tenant = tenant
+        self.restaurant_name = restaurant_name
+        self.snapshot = snapshot
+        self.tool_notes = []   # what tools already did on this call
+        self.greeted = False   # survives Retell's auto-reconnects
+        self._prompt = None
+        self._prompt_key = None
+
+    async def refresh(self):
+        # Snapshots are patched in place on NOTIFY; this only picks up a
+        # replacement after a full reload.
+        self.snapshot = await get_menu_snapshot(self.tenant.restaurant_id)
+
+    def specials(self):
+        return [item["name"] for item in self.snapshot.items.values() if "special" in (item["tags"] or ())]
+
+    def eighty_sixed(self):
+        return [item["name"] for item in self.snapshot.items.values() if item["is_86d"]]
+
+    def system_prompt(self, profile=None):
+        today = date.today()
+        key = (id(self.snapshot), self.snapshot.version, today, len(self.tool_notes), id(profile), profile and profile.version)
+        if key != self._prompt_key:
+            parts = [
+                SYSTEM_PROMPT.replace("{{RestaurantName}}", self.restaurant_name).strip(),
+                f"Today is {today:%A %B %d, %Y} ({today.isoformat()}).",
+            ]
+            specials = self.specials()
+            if specials:
+                parts.append("Today's special: " + ", ".join(specials) + ".")
+            eighty_sixed = self.eighty_sixed()
+            if eighty_sixed:
+                parts.append("86'd today, not available: " + ", ".join(eighty_sixed) + ".")
+            if profile is not None:
+                parts.append(profile.prompt_notes())
+            if self.tool_notes:
+                parts.append("Already done on this call:\n" + "\n".join(self.tool_notes))
+            self._prompt = "\n\n".join(parts)
+            self._prompt_key = key
+        return self._prompt
+
+    def greeting(self, profile=None):
+        specials = self.specials()
+        special = f" Today's special is {', '.join(specials)}." if specials else ""
+        name = profile.name.split()[0] if profile is not None and profile.name else None
+        welcome = f"Thanks for calling {self.restaurant_name}, {name}, welcome back!" if name else f"Thanks for calling {self.restaurant_name}!"
+        return f"{welcome}{special} Would you like a reservation, a takeout order, or have a question about events?"
+
+    def note_tool(self, name, arguments, task):
+        if task.cancelled():
+            outcome = "cancelled"
+        elif task.exception() is not None:
+            outcome = f"failed: {task.exception()}"
+        else:
+            outcome = dumps(task.result()).decode("utf-8")[:300]
+        self.tool_notes.append(f"{name}({dumps(arguments).decode('utf-8')}) -> {outcome}")
+
+
+_contexts = {}  # call_id -> Task resolving to a CallContext
+
+
+async def _build_context(agent_id, to_number):
+    tenant = await resolve_tenant(agent_id, to_number)
+    snapshot, row = await asyncio.gather(
+        get_menu_snapshot(tenant.restaurant_id),
+        fetch_one("SELECT name FROM restaurants WHERE id = $1", tenant.restaurant_id),
+    )
+    return CallContext(tenant, row["name"] if row else "our restaurant", snapshot)
+
+
+def _log_prewarm_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Could not prepare call context: %s", task.exception())
+
+
+def prewarm_call(call_id, agent_id=None, to_number=None):
+    # Starts loading the call's context in the background. Safe to call
+    # from both the call.started webhook and the websocket; a failed load is
+    # retried on the next call.
+    task = _contexts.get(call_id)
+    if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+        if len(_contexts) >= CALL_CONTEXT_MAX:
+            _contexts.pop(next(iter(_contexts)))
+        task = asyncio.ensure_future(_build_context(agent_id, to_number))
+        task.add_done_callback(_log_prewarm_failure)
+        _contexts[call_id] = task
+    return task
+
+
+async def get_call_context(call_id, agent_id=None, to_number=None):
+    return await asyncio.shield(prewarm_call(call_id, agent_id, to_number))
+
+
+def release_call_context(call_id):
+    _contexts.pop(call_id, None)
+
+
+def _chat_messages(transcript):
+    roles = {"agent": "assistant", "user": "user"}
+    return [
+        {"role": roles.get(turn.get("role"), "user"), "content": turn.get("content") or ""}
+        for turn in transcript
+    ]
+
+
+class LLMSession:
+    # One Retell custom-LLM websocket. Retell sends the live transcript and
+    # asks for a response by response_id; a newer response_id (or the caller
+    # taking the turn) means the previous answer is stale, so its task is
+    # cancelled mid-stream.
+
+    def __init__(self, websocket: WebSocket, call_id):
+        self.websocket = websocket
+        self.call_id = call_id
+        self.greeted = False
+        self.current = None
+
+    async def send(self, message):
+        await self.websocket.send_text(dumps(message).decode("utf-8"))
+
+    def start_response(self, response_id, transcript, interaction):
+        self.cancel_response()
+        self.current = asyncio.create_task(self._respond(response_id, transcript, interaction))
+
+    def cancel_response(self, barge_in=True):
+        if self.current is not None and not self.current.done():
+            self.current.cancel()
+            if barge_in:
+                LLM_BARGE_INS.inc()
+        self.current = None
+
+    async def run(self):
+        await self.websocket.accept()
+        await self.send({"response_type": "config", "config": {"auto_reconnect": True, "call_details": True}})
+        if self.call_id in _contexts:
+            # call.started reached the webhook first; greet without waiting for call_details
+            self.greet()
+        try:
+            while True:
+                message = loads(await self.websocket.receive_text())
+                interaction = message.get("interaction_type")
+                if interaction == "ping_pong":
+                    await self.send({"response_type": "ping_pong", "timestamp": message.get("timestamp")})
+                elif interaction == "call_details":
+                    call = message.get("call") or {}
+                    prewarm_call(self.call_id, call.get("agent_id"), call.get("to_number"))
+                    prefetch_caller(self.call_id, call.get("agent_id"), call.get("to_number"), call.get("from_number"))
+                    self.greet()
+                elif interaction == "update_only":
+                    if message.get("turntaking") == "user_turn":
+                        self.cancel_response()
+                elif interaction in ("response_required", "reminder_required"):
+                    self.start_response(message.get("response_id"), message.get("transcript") or [], interaction)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.cancel_response(barge_in=False)
+
+    def greet(self):
+        if not self.greeted:
+            self.greeted = True
+            self.start_response(0, [], "greeting")
+
+    async def _respond(self, response_id, transcript, interaction):
+        started = time.perf_counter()
+        streamed = False
+
+        async def say(content, complete=False, **extra):
+            nonlocal streamed
+            if content and not streamed:
+                streamed = True
+                LLM_FIRST_CHUNK_LATENCY.since(started, interaction)
+            await self.send({"response_type": "response", "response_id": response_id, "content": content, "content_complete": complete, **extra})
+
+        token = log_context = None
+        call_token = set_current_call(self.call_id)
+        try:
+            try:
+                context = await get_call_context(self.call_id)
+            except UnknownTenantError as e:
+                logger.warning("LLM websocket for unknown tenant: %s", e, extra={"call_id": self.call_id})
+                await say("Sorry, this line isn't set up yet. Please call back later.", True, end_call=True)
+                return
+            token = set_current_tenant(context.tenant)
+            log_context = bind_call(self.call_id, context.tenant.restaurant_id)
+            # Whatever of the caller's profile has loaded by now; never waited on
+            profile = caller_profile(self.call_id)
+            if interaction == "greeting":
+                if not context.greeted:
+                    context.greeted = True
+                    await say(context.greeting(profile), True)
+                return
+            await context.refresh()
+            messages = [{"role": "system", "content": context.system_prompt(profile)}] + _chat_messages(transcript)
+            if interaction == "reminder_required":
+                messages.append({"role": "system", "content": "The caller has gone quiet. Briefly check whether they are still there."})
+
+            extra = {}
+            llm = get_llm()
+            for round_number in range(LLM_MAX_TOOL_ROUNDS + 1):
+                # The last round offers no tools so the model has to speak
+                tools = TOOL_SCHEMA if round_number < LLM_MAX_TOOL_ROUNDS else []
+                spoken, calls = [], []
+                async for event in llm.stream(messages, tools):
+                    if event[0] == "text":
+                        spoken.append(event[1])
+                        await say(event[1])
+                    elif tools:
+                        calls.append(event[1:])
+                if not calls:
+                    break
+                if not streamed and LLM_TOOL_FILLER:
+                    await say(LLM_TOOL_FILLER + " ")
+                messages.append({
+                    "role": "assistant",
+                    "content": "".join(spoken) or None,
+                    "tool_calls": [
+                        {"id": tool_call_id, "type": "function", "function": {"name": name, "arguments": dumps(arguments).decode("utf-8")}}
+                        for tool_call_id, name, arguments in calls
+                    ],
+                })
+                for tool_call_id, name, arguments in calls:
+                    result = await self._run_tool(context, tool_call_id, name, arguments)
+                    messages.append({"role": "tool", "tool_call_id": tool_call_id, "content": dumps(result).decode("utf-8")})
+                    if name == "handover_human" and HANDOVER_TRANSFER_NUMBER and result.get("status") == "success":
+                        extra["transfer_number"] = HANDOVER_TRANSFER_NUMBER
+            await say("", True, **extra)
+            LLM_RESPONSE_LATENCY.since(started, interaction)
+        except asyncio.CancelledError:
+            raise
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.exception("LLM response %s failed: %s", response_id, e, extra={"call_id": self.call_id})
+            try:
+                await say("Sorry, I didn't catch that. Could you say it again?", True)
+            except Exception:
+                pass
+        finally:
+            if log_context is not None:
+                unbind_call(log_context)
+            if token is not None:
+                reset_current_tenant(token)
+            reset_current_call(call_token)
+
+    async def _run_tool(self, context, tool_call_id, name, arguments):
+        # Runs the registered handler in-process, same as retell_action.
+        await self.send({"response_type": "tool_call_invocation", "tool_call_id": tool_call_id, "name": name, "arguments": dumps(arguments).decode("utf-8")})
+        task = asyncio.ensure_future(dispatch_tool(name, arguments))
+        task.add_done_callback(lambda done: context.note_tool(name, arguments, done))
+        try:
+            # Shielded: barge-in stops the spoken answer, not a booking that
+            # is already being written.
+            result = await asyncio.shield(task)
+        except (UnknownToolError, ToolValidationError) as e:
+            result = {"status": "error", "message": str(e)}
+        await self.send({"response_type": "tool_call_result", "tool_call_id": tool_call_id, "content": dumps(result).decode("utf-8")})
+        return result
+
+
+async def handle_llm_websocket(websocket: WebSocket, call_id: str):
+    await LLMSession(websocket, call_id).run()
@@ -0,0 +1,313 @@
+# Load generator for the Retell webhook and action endpoints.
+#
+# simulate: synthetic call lifecycles. Each call sends a signed call.started,
+#   then several turns of transcript.delta bursts each followed by a
+#   retell_action tool call, then call.ended. --concurrency calls run at once.
+# replay: re-sends calls recorded in call_logs / call_transcript_segments,
+#   keeping their original spacing divided by --speed. Call ids get a run
+#   suffix so idempotency doesn't swallow them. Tool calls aren't recorded,
+#   so replay only covers webhook traffic.
+#
+# By default the app runs in this process (httpx ASGI transport, lifespan
+# included) against the in-memory fake in fake_database.py; --db postgres
+# uses DATABASE_URL instead, and --url targets a running server. In-process
+# numbers include the client's own overhead since both share one event loop.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.loadtest --concurrency 100 simulate --calls 500
+#     python -m api.loadtest --url http://localhost:8000 --agent-id agent_123 simulate
+#     python -m api.loadtest replay --source-url postgresql://... --since 2024-06-01 --speed 20
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+import httpx
+
+WEBHOOK_PATH = "/api/voice/retell/webhook"
+ACTION_PATH = "/api/voice/retell/action"
+
+# Relative frequency of each tool in simulated calls
+TOOL_MIX = {
+    "get_menu": 30,
+    "check_item_availability": 25,
+    "get_timeslots": 20,
+    "create_reservation": 10,
+    "create_order": 10,
+    "create_reminder": 3,
+    "handover_human": 2,
+}
+MENU_TAGS = ("vegetarian", "vegan", "spicy", "gluten-free", "popular", "kids")
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}   # "webhook call.started" / "action get_menu" -> [seconds]
+        self.errors = {}    # same keys -> non-2xx or transport failures
+        self.started = time.perf_counter()
+
+    def record(self, name, seconds, ok):
+        self.samples.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        total = sum(len(values) for values in self.samples.values())
+        print(f"\n{total} requests in {elapsed:.1f}s ({total / elapsed:,.0f} req/s)\n")
+        print(f"{'endpoint':<36}{'count':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+        for name in sorted(self.samples):
+            ordered = sorted(self.samples[name])
+            print(
+                f"{name:<36}{len(ordered):>8}{self.errors.get(name, 0):>8}{len(ordered) / elapsed:>9.1f}"
+                f"{percentile(ordered, 0.50) * 1000:>9.1f}{percentile(ordered, 0.95) * 1000:>9.1f}"
+                f"{percentile(ordered, 0.99) * 1000:>9.1f}{ordered[-1] * 1000:>9.1f}"
+            )
+
+
+class Target:
+    def __init__(self, client, secret, recorder):
+        self.client = client
+        self.secret = secret.encode("utf-8")
+        self.recorder = recorder
+
+    async def _post(self, name, path, body, headers):
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(path, content=body, headers=headers)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        self.recorder.record(name, time.perf_counter() - started, ok)
+
+    async def event(self, event):
+        body = json.dumps(event).encode("utf-8")
+        signature = hmac.new(self.secret, body, hashlib.sha256).hexdigest()
+        headers = {"Content-Type": "application/json", "X-Retell-Signature": signature}
+        await self._post(f"webhook {event['event_name']}", WEBHOOK_PATH, body, headers)
+
+    async def action(self, call_id, agent_id, tool_name, parameters):
+        body = json.dumps({"call_id": call_id, "agent_id": agent_id, "tool_name": tool_name, "parameters": parameters}).encode("utf-8")
+        await self._post(f"action {tool_name}", ACTION_PATH, body, {"Content-Type": "application/json"})
+
+
+def tool_parameters(tool_name, rng, menu_size):
+    day = datetime.now(timezone.utc).date() + timedelta(days=rng.randint(1, 30))
+    when = datetime(day.year, day.month, day.day, rng.randint(17, 20), rng.choice((0, 15, 30, 45)))
+    if tool_name == "get_menu":
+        return {"tags": rng.sample(MENU_TAGS, rng.randint(0, 2)) or None}
+    if tool_name == "check_item_availability":
+        return {"item_id": str(rng.randint(1, menu_size)), "qty": rng.randint(1, 3)}
+    if tool_name == "get_timeslots":
+        return {"date": day.isoformat(), "party_size": rng.randint(2, 6)}
+    if tool_name == "create_reservation":
+        return {"datetime": when.isoformat(), "party_size": rng.randint(2, 6), "name": "Load Test", "phone": "+15555550100"}
+    if tool_name == "create_order":
+        items = [{"item_id": str(rng.randint(1, menu_size)), "qty": rng.randint(1, 2)} for _ in range(rng.randint(1, 4))]
+        return {"items": items, "customer": {"name": "Load Test", "phone": "+15555550100"}}
+    if tool_name == "create_reminder":
+        return {"assignee": "chef", "due_at": when.isoformat(), "payload": {"note": "load test"}}
+    return {"reason": "Caller asked for a manager"}
+
+
+async def simulate_call(target, call_id, args, rng):
+    tools = list(TOOL_MIX)
+    weights = list(TOOL_MIX.values())
+    now_ms = int(time.time() * 1000)
+    await target.event({"event_name": "call.started", "call_id": call_id, "agent_id": args.agent_id, "start_timestamp": now_ms})
+    sequence = 0
+    for _ in range(args.turns):
+        for _ in range(args.deltas):
+            sequence += 1
+            await target.event({"event_name": "transcript.delta", "call_id": call_id, "sequence": sequence, "transcript": f"caller words {sequence} "})
+            if args.delta_interval:
+                await asyncio.sleep(rng.expovariate(1 / args.delta_interval))
+        tool_name = rng.choices(tools, weights)[0]
+        await target.action(call_id, args.agent_id, tool_name, tool_parameters(tool_name, rng, args.menu_size))
+    await target.event({"event_name": "call.ended", "call_id": call_id, "agent_id": args.agent_id, "call_status": "ended", "start_timestamp": now_ms, "end_timestamp": int(time.time() * 1000)})
+
+
+async def simulate(target, args):
+    run_id = uuid.uuid4().hex[:8]
+    rng = random.Random(args.seed)
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one(n):
+        async with slots:
+            await simulate_call(target, f"load-{run_id}-{n}", args, random.Random(rng.random()))
+
+    await asyncio.gather(*(one(n) for n in range(args.calls)))
+
+
+async def load_recording(args):
+    # Returns {call_id: [(offset_seconds, event), ...]} rebuilt from
+    # call_logs and call_transcript_segments.
+    import asyncpg
+    from .ingest import unpack_event
+    since = datetime.fromisoformat(args.since).replace(tzinfo=timezone.utc)
+    conn = await asyncpg.connect(args.source_url)
+    try:
+        calls = await conn.fetch(
+            "SELECT retell_call_id, agent_id, start_time, end_time, updated_at, raw_event FROM call_logs "
+            "WHERE start_time >= $1 ORDER BY start_time LIMIT $2",
+            since, args.limit
+        )
+        segments = await conn.fetch(
+            "SELECT retell_call_id, seq, sent_at_ms, raw_text, created_at FROM call_transcript_segments "
+            "WHERE retell_call_id = ANY($1::text[]) AND created_at >= $2 ORDER BY retell_call_id, seq, sent_at_ms, id",
+            [row["retell_call_id"] for row in calls], since
+        )
+    finally:
+        await conn.close()
+    if not calls:
+        return {}
+
+    suffix = f"-replay-{uuid.uuid4().hex[:8]}"
+    origin = calls[0]["start_time"]
+    timelines = {}
+    for row in calls:
+        call_id = row["retell_call_id"] + suffix
+        timelines[call_id] = [((row["start_time"] - origin).total_seconds(), {
+            "event_name": "call.started", "call_id": call_id, "agent_id": args.agent_id or row["agent_id"],
+            "start_timestamp": int(row["start_time"].timestamp() * 1000),
+        })]
+    for row in segments:
+        call_id = row["retell_call_id"] + suffix
+        # created_at is when a batch was flushed, so every delta in it would
+        # go out at once; sent_at_ms is when Retell sent each one
+        if row["sent_at_ms"] is not None:
+            offset = row["sent_at_ms"] / 1000 - origin.timestamp()
+        else:
+            offset = (row["created_at"] - origin).total_seconds()
+        timelines[call_id].append((offset, {
+            "event_name": "transcript.delta", "call_id": call_id, "sequence": row["seq"], "timestamp": row["sent_at_ms"],
+            "transcript": row["raw_text"],
+        }))
+    for row in calls:
+        # raw_event holds the last event Retell sent for the call
+        final = unpack_event(row["raw_event"])
+        if final and final.get("event_name") not in (None, "call.started"):
+            call_id = row["retell_call_id"] + suffix
+            at = row["end_time"] or row["updated_at"] or row["start_time"]
+            timelines[call_id].append(((at - origin).total_seconds(), {**final, "call_id": call_id}))
+    for events in timelines.values():
+        events.sort(key=lambda item: item[0])
+    return timelines
+
+
+async def replay(target, args):
+    timelines = await load_recording(args)
+    events = sum(len(t) for t in timelines.values())
+    print(f"Replaying {len(timelines)} calls / {events} events at {args.speed}x")
+    started = time.monotonic()
+
+    async def play(timeline):
+        # Events of one call go out in order; calls overlap as recorded
+        for offset, event in timeline:
+            delay = started + offset / args.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await target.event(event)
+
+    await asyncio.gather(*(play(timeline) for timeline in timelines.values()))
+
+
+async def run(args):
+    recorder = Recorder()
+    workload = simulate if args.command == "simulate" else replay
+    if args.url:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30.0) as client:
+            recorder.started = time.perf_counter()
+            await workload(Target(client, args.secret, recorder), args)
+        recorder.report()
+        return
+
+    # In-process: configure before main.py reads its environment
+    os.environ["RETELL_WEBHOOK_SECRET"] = args.secret
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    store = None
+    if args.db == "memory":
+        from . import fake_database
+        store = fake_database.install(latency=args.db_latency_ms / 1000)
+        args.agent_id = args.agent_id or fake_database.LOAD_TEST_AGENT_ID
+    from .main import app, lifespan
+    from .ingest import ingest_stats
+    from .live import subscribe_live, unsubscribe_live
+
+    async with lifespan(app):
+        # One staff board watching, read the way the SSE endpoint reads it
+        kinds = {}
+        board = subscribe_live(fake_database.LOAD_TEST_RESTAURANT_ID)[1] if store is not None else None
+        watcher = asyncio.ensure_future(watch(board, kinds)) if board is not None else None
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=30.0) as client:
+            recorder.started = time.perf_counter()
+            await workload(Target(client, args.secret, recorder), args)
+        recorder.report()
+        if watcher is not None:
+            await asyncio.sleep(0)
+            watcher.cancel()
+            unsubscribe_live(board)
+        drain_started = time.perf_counter()
+    # Leaving the lifespan drains the ingest queues
+    stats = ingest_stats()
+    print(f"\ningest: processed={stats['processed']} failed={stats['failed']} duplicates={stats['duplicates']} "
+          f"batches={stats['batches']} avg_flush={stats['flush_latency_avg_ms']}ms drain={time.perf_counter() - drain_started:.2f}s")
+    if store is not None:
+        print(f"memory db: {store.statements} statements, {len(store.call_logs)} calls, {len(store.reservations)} reservations, {len(store.sessions)} open call sessions")
+        days = [row for (_, granularity, _), row in store.rollups.items() if granularity == "day"]
+        print(f"rollups: {sum(row['calls'] for row in days)} calls, {sum(row['timed_calls'] for row in days)} timed, "
+              f"{sum(row['orders'] for row in days)} orders, {sum(row['reservations'] for row in days)} reservations, "
+              f"{sum(row['handovers'] for row in days)} handovers")
+        print("live board: " + ("dropped (fell behind)" if board.dropped else ", ".join(f"{count} {kind}" for kind, count in sorted(kinds.items()))))
+
+
+async def watch(board, kinds):
+    # Counts live board events by type
+    while (frames := await board.next()) is not None:
+        for frame in frames:
+            kind = frame.split(b"\n", 1)[0].removeprefix(b"event: ").decode()
+            kinds[kind] = kinds.get(kind, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Retell webhook and action endpoints")
+    parser.add_argument("--url", help="Base URL of a running server; omit to run main.app in-process")
+    parser.add_argument("--db", choices=("memory", "postgres"), default="memory", help="In-process database backend")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="Simulated round trip per statement for --db memory")
+    parser.add_argument("--secret", default=os.getenv("RETELL_WEBHOOK_SECRET", "loadtest-secret"))
+    parser.add_argument("--agent-id", default=None, help="agent_id sent with every call; selects the restaurant")
+    parser.add_argument("--concurrency", type=int, default=50)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sim = commands.add_parser("simulate", help="Synthetic call lifecycles")
+    sim.add_argument("--calls", type=int, default=200)
+    sim.add_argument("--turns", type=int, default=4, help="Tool calls per call")
+    sim.add_argument("--deltas", type=int, default=10, help="transcript.delta events per turn")
+    sim.add_argument("--delta-interval", type=float, default=0.05, help="Mean seconds between deltas")
+    sim.add_argument("--menu-size", type=int, default=60)
+    sim.add_argument("--seed", type=int, default=None)
+
+    rep = commands.add_parser("replay", help="Replay calls recorded in call_logs")
+    rep.add_argument("--source-url", default=os.getenv("DATABASE_URL"), help="Postgres to read the recording from")
+    rep.add_argument("--since", required=True, help="ISO date/time; calls that started at or after it")
+    rep.add_argument("--limit", type=int, default=1000)
+    rep.add_argument("--speed", type=float, default=10.0, help="Replay at N times the recorded pace")
+
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
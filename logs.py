@@ -0,0 +1,166 @@
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import logging
+import itertools
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one structured record per line, "text" for local development.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Records waiting for the writer thread. When full, new records are dropped
+# rather than blocking the event loop.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Keep 1 in N records for high-volume events, e.g. LOG_SAMPLE_TRANSCRIPT_DELTA=100.
+LOG_SAMPLE_RATES = {
+    "transcript.delta": int(os.getenv("LOG_SAMPLE_TRANSCRIPT_DELTA", 100)),
+}
+LOG_MASK_PII = os.getenv("LOG_MASK_PII", "true").lower() != "false"
+
+# Structured fields that always hold PII and are masked wholesale
+PII_FIELDS = frozenset({"customer_name", "phone", "customer_phone", "from_number", "email", "customer_email", "transcript", "reason"})
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_PHONE = re.compile(r"\+?\d[\d\s().-]{6,}\d")
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+call_id_var = ContextVar("call_id", default=None)
+restaurant_id_var = ContextVar("restaurant_id", default=None)
+
+_listener = None
+_stats = {"dropped": 0}
+
+
+def mask_text(text: str) -> str:
+    text = _EMAIL.sub("[email]", text)
+    return _PHONE.sub(lambda m: "[phone:" + re.sub(r"\D", "", m.group())[-2:] + "]", text)
+
+
+def mask_value(key, value):
+    if key in PII_FIELDS and value:
+        value = str(value)
+        if key in ("phone", "customer_phone", "from_number"):
+            return "***" + re.sub(r"\D", "", value)[-2:]
+        if key in ("transcript", "reason"):
+            return f"[{len(value)} chars]"
+        return value[0] + "***"
+    return value
+
+
+class ContextFilter(logging.Filter):
+    # Runs on the calling task: stamps call/restaurant context onto the
+    # record and applies per-event sampling before anything is queued.
+
+    def __init__(self):
+        super().__init__()
+        self._counters = {event: itertools.count() for event in LOG_SAMPLE_RATES}
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        rate = LOG_SAMPLE_RATES.get(event)
+        if rate and rate > 1 and next(self._counters[event]) % rate:
+            return False
+        if not hasattr(record, "call_id"):
+            record.call_id = call_id_var.get()
+        if not hasattr(record, "restaurant_id"):
+            record.restaurant_id = restaurant_id_var.get()
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    # The stock QueueHandler formats the message on the calling thread. Here
+    # the record is queued as-is and all formatting and masking happen on the
+    # listener thread.
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _stats["dropped"] += 1
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        message = record.getMessage()
+        fields = {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+        if LOG_MASK_PII:
+            message = mask_text(message)
+            fields = {key: mask_value(key, value) for key, value in fields.items()}
+        if LOG_FORMAT == "text":
+            context = " ".join(f"{key}={value}" for key, value in fields.items() if value is not None)
+            line = f"{self.formatTime(record)} {record.levelname} {record.name}: {message}" + (f" [{context}]" if context else "")
+        else:
+            entry = {
+                "ts": record.created,
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": message,
+            }
+            entry.update((key, value) for key, value in fields.items() if value is not None)
+            line = json.dumps(entry, default=str)
+        if record.exc_info:
+            exc = self.formatException(record.exc_info)
+            line += "\n" + (mask_text(exc) if LOG_MASK_PII else exc)
+        return line
+
+
+def setup_logging(stream=None):
+    # Idempotent. Attaches the queue handler to this package's logger so
+    # uvicorn's own loggers are left alone.
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(StructuredFormatter())
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+
+    logger = logging.getLogger(__package__ or None)
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    # Flushes everything still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def bind_call(call_id=None, restaurant_id=None):
+    # Sets log context for the current task; returns tokens for unbind_call.
+    return (
+        call_id_var.set(call_id) if call_id is not None else None,
+        restaurant_id_var.set(restaurant_id) if restaurant_id is not None else None,
+    )
+
+
+def unbind_call(tokens):
+    call_token, restaurant_token = tokens
+    if call_token is not None:
+        call_id_var.reset(call_token)
+    if restaurant_token is not None:
+        restaurant_id_var.reset(restaurant_token)
+
+
+def logging_stats():
+    return {
+        "running": _listener is not None,
+        "queued": _listener.queue.qsize() if _listener is not None else 0,
+        "dropped": _stats["dropped"],
+    }
@@ -1,14 +1,43 @@
 
-from fastapi import FastAPI, Request, HTTPException
-from .database import fetch_all, execute_query
+from fastapi import FastAPI, Request, Response, HTTPException, WebSocket
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from .database import fetch_one, transaction, init_pool, close_pool, check_pool_health
+from .logs import setup_logging, shutdown_logging, bind_call, unbind_call
+from .notifications import start_listener, stop_listener
+from .menu_cache import get_menu_snapshot, subscribe_menu_changes, menu_cache_stats
+from .tenants import Tenant, resolve_tenant, peek_tenant, set_current_tenant, reset_current_tenant, current_restaurant_id, subscribe_tenant_changes, tenant_cache_stats, UnknownTenantError
+from .transcripts import start_transcript_flusher, stop_transcript_flusher
+from .retention import start_retention, stop_retention, retention_stats
+from .reminders import start_reminders, stop_reminders, reminder_stats
+from .campaigns import start_campaigns, stop_campaigns, campaign_stats
+from .ratelimit import check_rate_limit, start_rate_limiter, stop_rate_limiter, rate_limit_stats
+from .timeslots import find_open_slots
+from .reservations import book_reservation, SlotUnavailableError
+from .tools import register_tool, dispatch_tool, tool_stats, dumps, loads, UnknownToolError, ToolValidationError
+from .ingest import enqueue_event, start_ingest, stop_ingest, ingest_stats, QueueFullError, KNOWN_EVENTS
+from .llm import close_llm
+from .llm_socket import handle_llm_websocket, prewarm_call, release_call_context
+from .analytics import Delta, dashboard, record_deltas, restaurant_zones, rollup_rows, write_rollups
+from .callers import prefetch_caller, release_caller, caller_profile, current_call_id, set_current_call, reset_current_call, caller_profile_stats
+from .sessions import get_session, note_session, start_sessions, stop_sessions, session_stats
+from .live import publish_live, publish_webhook_event, subscribe_live, unsubscribe_live, start_live, stop_live, live_stats, LIVE_BOARD_SECRET, check_live_board_token
+from .metrics import render_metrics, REQUESTS_IN_FLIGHT, WEBHOOK_LATENCY, WEBHOOK_ERRORS
+from .idempotency import dedup_stats
 from dotenv import load_dotenv
 import os
 import hmac
+import math
+import logging
+import time
 import hashlib
 import json
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 from .models import (
     GetMenuPayload,
     CheckItemAvailabilityPayload,
+    ResolveMenuItemPayload,
     CreateOrderPayload,
     GetTimeslotsPayload,
     CreateReservationPayload,
@@ -16,25 +45,129 @@ from .models import (
     HandoverHumanPayload
 )
 
+logger = logging.getLogger(__name__)
+
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    # Open the connection pool once per worker so handlers reuse warm connections
+    await init_pool()
+    await subscribe_menu_changes()
+    await subscribe_tenant_changes()
+    await start_live()
+    await start_listener()
+    await start_transcript_flusher()
+    await start_rate_limiter()
+    await start_sessions()
+    await start_retention()
+    await start_reminders()
+    await start_campaigns()
+    await start_ingest()
+    try:
+        yield
+    finally:
+        # Drain queued webhook events before the transcript buffer and pool go away
+        await stop_ingest()
+        await stop_transcript_flusher()
+        await stop_rate_limiter()
+        await stop_sessions()
+        await stop_retention()
+        await stop_reminders()
+        await stop_campaigns()
+        await stop_live()
+        await stop_listener()
+        await close_llm()
+        await close_pool()
+        shutdown_logging()
+
+
+app = FastAPI(lifespan=lifespan)
 
 RETELL_WEBHOOK_SECRET = os.getenv("RETELL_WEBHOOK_SECRET")
+# When set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# menu_items.id and order_items.quantity are int4; larger values would make
+# create_order's queries fail, so they're turned away before them.
+INT4_MAX = 2**31 - 1
+ORDER_MENU_QUERY = "SELECT id, name, price, is_available, is_86d FROM menu_items WHERE restaurant_id = $1 AND id = ANY($2::int[])"
 
 @app.get("/")
 async def read_root():
     return {"message": "VoiceFlow AI Backend API"}
 
+@app.get("/health/db")
+async def db_health():
+    return await check_pool_health()
+
+@app.get("/health/menu-cache")
+async def menu_cache_health():
+    return menu_cache_stats()
+
+@app.get("/health/tenants")
+async def tenants_health():
+    return tenant_cache_stats()
+
+@app.get("/health/tools")
+async def tools_health():
+    return tool_stats()
+
+@app.get("/health/ingest")
+async def ingest_health():
+    return {**ingest_stats(), "dedup": dedup_stats()}
+
+@app.get("/health/retention")
+async def retention_health():
+    return retention_stats()
+
+@app.get("/health/reminders")
+async def reminders_health():
+    return reminder_stats()
+
+@app.get("/health/campaigns")
+async def campaigns_health():
+    return campaign_stats()
+
+@app.get("/health/sessions")
+async def sessions_health():
+    return session_stats()
+
+@app.get("/health/callers")
+async def callers_health():
+    return caller_profile_stats()
+
+@app.get("/health/live")
+async def live_health():
+    return live_stats()
+
+@app.get("/health/ratelimit")
+async def ratelimit_health():
+    return rate_limit_stats()
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token.")
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/api/voice/retell/webhook")
 async def retell_webhook(request: Request):
+    with REQUESTS_IN_FLIGHT.track("retell_webhook"):
+        return await _handle_webhook(request)
+
+async def _handle_webhook(request: Request):
+    started = time.perf_counter()
     if not RETELL_WEBHOOK_SECRET:
         raise HTTPException(status_code=500, detail="RETELL_WEBHOOK_SECRET not configured.")
 
     # Verify Retell signature
     signature = request.headers.get("X-Retell-Signature")
     if not signature:
+        WEBHOOK_ERRORS.inc("missing_signature")
         raise HTTPException(status_code=400, detail="X-Retell-Signature header missing.")
 
     body = await request.body()
@@ -45,212 +178,357 @@ async def retell_webhook(request: Request):
     ).hexdigest()
 
     if not hmac.compare_digest(expected_signature, signature):
+        WEBHOOK_ERRORS.inc("bad_signature")
         raise HTTPException(status_code=403, detail="Invalid Retell webhook signature.")
 
     event = json.loads(body.decode("utf-8"))
     event_type = event.get("event_name")
+    _admit("retell_webhook", event)
 
-    print(f"Received Retell webhook event: {event_type}")
+    logger.info("Received Retell webhook event %s", event_type, extra={"event": event_type, "call_id": event.get("call_id")})
     # Handle events: call.started, transcript.delta, tool.invocation, call.ended, handover.requested, error.
     # Upsert calls row; append transcript segments (store raw + normalized).
-    # Rate-limit, queue heavy work, and retry idempotently.
-    # Mask PII in logs; keep audio/transcripts 30 days (configurable).
-
-    RESTAURANT_ID = os.getenv("RESTAURANT_ID", 1)
-
+    # Rate-limited above (ratelimit.py); heavy work is queued and retried idempotently.
+    # Mask PII in logs; keep audio/transcripts CALL_RETENTION_DAYS (see retention.py).
+
+    # Writes happen on the ingest workers so Retell gets its 200 without
+    # waiting on Postgres. A full queue answers 503 and Retell redelivers.
+    # Redeliveries are acknowledged without being queued again.
+    try:
+        accepted = await enqueue_event(event, body)
+    except QueueFullError as e:
+        WEBHOOK_ERRORS.inc("queue_full")
+        raise HTTPException(status_code=503, detail=str(e))
+    finally:
+        WEBHOOK_LATENCY.since(started, event_type if event_type in KNOWN_EVENTS else "other")
+
+    # Warm the LLM websocket's per-call context and the caller's profile
+    # before Retell connects it or the first tool runs
     if event_type == "call.started":
-        call_id = event.get("call_id")
-        agent_id = event.get("agent_id")
-        start_time = event.get("start_timestamp")
-        await execute_query(
-            "INSERT INTO call_logs (retell_call_id, restaurant_id, agent_id, start_time, status, raw_event_data) VALUES ($1, $2, $3, to_timestamp($4 / 1000.0), $5, $6)",
-            call_id, RESTAURANT_ID, agent_id, start_time, "started", json.dumps(event)
-        )
-        print(f"Call started: {call_id}")
-    elif event_type == "transcript.delta":
-        call_id = event.get("call_id")
-        transcript_segment = event.get("transcript")
-        await execute_query(
-            "UPDATE call_logs SET transcript = COALESCE(transcript, '') || $1, updated_at = CURRENT_TIMESTAMP WHERE retell_call_id = $2",
-            transcript_segment, call_id
-        )
-        print(f"Transcript delta for call {call_id}: {transcript_segment}")
+        prewarm_call(event.get("call_id"), event.get("agent_id"), event.get("to_number"))
+        prefetch_caller(event.get("call_id"), event.get("agent_id"), event.get("to_number"), event.get("from_number"))
     elif event_type == "call.ended":
-        call_id = event.get("call_id")
-        end_time = event.get("end_timestamp")
-        status = event.get("call_status")
-        transcript = event.get("transcript")
-        await execute_query(
-            "UPDATE call_logs SET end_time = to_timestamp($1 / 1000.0), status = $2, transcript = $3, raw_event_data = $4, updated_at = CURRENT_TIMESTAMP WHERE retell_call_id = $5",
-            end_time, status, transcript, json.dumps(event), call_id
-        )
-        print(f"Call ended: {call_id} with status {status}")
-    elif event_type == "handover.requested":
-        call_id = event.get("call_id")
-        reason = event.get("reason")
-        # Log handover request in call_logs or a separate table
-        print(f"Handover requested for call {call_id} with reason: {reason}")
-    elif event_type == "error":
-        call_id = event.get("call_id")
-        error_message = event.get("error_message")
-        await execute_query(
-            "UPDATE call_logs SET status = 'error', raw_event_data = $1, updated_at = CURRENT_TIMESTAMP WHERE retell_call_id = $2",
-            json.dumps(event), call_id
-        )
-        print(f"Error in call {call_id}: {error_message}")
-    else:
-        print(f"Unhandled event type: {event_type}")
-
-
-    return {"status": "success", "event_received": event_type}
+        release_call_context(event.get("call_id"))
+        release_caller(event.get("call_id"))
+    # Staff boards hear about it now, not when the ingest worker writes it
+    if accepted:
+        await publish_webhook_event(event)
+
+    return {"status": "success", "event_received": event_type, "duplicate": not accepted}
+
+def _admit(endpoint, payload):
+    # Shed load before any database work: the restaurant comes from the
+    # tenant cache only, and agent / caller buckets need no lookup at all.
+    # Retell redelivers webhooks answered 429.
+    call = payload.get("call") or {}
+    agent_id = payload.get("agent_id") or call.get("agent_id")
+    to_number = payload.get("to_number") or call.get("to_number")
+    tenant = peek_tenant(agent_id, to_number)
+    retry_after = check_rate_limit(
+        endpoint, tenant.restaurant_id if tenant else None, agent_id, payload.get("from_number") or call.get("from_number")
+    )
+    if retry_after is not None:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded.", headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+@app.get("/api/analytics/{restaurant_id}")
+async def analytics_dashboard(restaurant_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None, granularity: str = "day"):
+    # Dashboard figures from the rollups in analytics.py; defaults to the last 7 days
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=7)
+    try:
+        return await dashboard(restaurant_id, since, until, granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.get("/api/live/{restaurant_id}")
+async def live_board(restaurant_id: int, request: Request, token: Optional[str] = None):
+    # Server-Sent Events: a "snapshot" of the calls in progress, then
+    # call.started / transcript / handover / order / reservation / call.ended
+    # as they happen (see live.py). A board that falls behind gets "dropped"
+    # and the stream ends; EventSource reconnects to a fresh snapshot.
+    # Needs a token for this restaurant (live.live_board_token) as a bearer
+    # token, or ?token= for browsers' EventSource, which can't send headers.
+    if not LIVE_BOARD_SECRET:
+        raise HTTPException(status_code=500, detail="LIVE_BOARD_SECRET not configured.")
+    offered = token or request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not check_live_board_token(restaurant_id, offered):
+        raise HTTPException(status_code=401, detail="Invalid or expired live board token.")
+    subscription = subscribe_live(restaurant_id)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many live board connections on this worker.", headers={"Retry-After": "5"})
+    snapshot, subscriber = subscription
+
+    async def stream():
+        try:
+            yield b"retry: 3000\n" + snapshot
+            while True:
+                frames = await subscriber.next()
+                if frames is None:
+                    yield b"event: dropped\ndata: {}\n\n"
+                    return
+                yield b"".join(frames)
+        finally:
+            unsubscribe_live(subscriber)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/api/voice/retell/llm-websocket/{call_id}")
+async def retell_llm_websocket(websocket: WebSocket, call_id: str):
+    # Retell's custom-LLM protocol; create_agent.py points llm_websocket_url here
+    await handle_llm_websocket(websocket, call_id)
 
 @app.post("/api/voice/retell/action")
 async def retell_action(request: Request):
+    with REQUESTS_IN_FLIGHT.track("retell_action"):
+        return await _handle_action(request)
+
+async def _handle_action(request: Request):
     # This endpoint will handle tool invocations from Retell.
-    # It will route by tool.name to appropriate functions.
+    # It will route by tool.name to the handlers registered in tools.py.
 
-    body = await request.json()
+    body = loads(await request.body())
     tool_name = body.get("tool_name")
     parameters = body.get("parameters", {})
-
-    if tool_name == "get_menu":
-        payload = GetMenuPayload(**parameters)
-        return await get_menu(payload)
-    elif tool_name == "check_item_availability":
-        payload = CheckItemAvailabilityPayload(**parameters)
-        return await check_item_availability(payload)
-    elif tool_name == "create_order":
-        payload = CreateOrderPayload(**parameters)
-        return await create_order(payload)
-    elif tool_name == "get_timeslots":
-        payload = GetTimeslotsPayload(**parameters)
-        return await get_timeslots(payload)
-    elif tool_name == "create_reservation":
-        payload = CreateReservationPayload(**parameters)
-        return await create_reservation(payload)
-    elif tool_name == "create_reminder":
-        payload = CreateReminderPayload(**parameters)
-        return await create_reminder(payload)
-    elif tool_name == "handover_human":
-        payload = HandoverHumanPayload(**parameters)
-        return await handover_human(payload)
-    else:
-        raise HTTPException(status_code=400, detail=f"Unknown tool: {tool_name}")
-
-# Placeholder functions for each tool
+    _admit("retell_action", body)
+
+    # Which restaurant this call belongs to comes from the agent / called
+    # number, answered from the in-process tenant cache.
+    call = body.get("call") or {}
+    call_id = body.get("call_id") or call.get("call_id")
+    agent_id = body.get("agent_id") or call.get("agent_id")
+    to_number = body.get("to_number") or call.get("to_number")
+    try:
+        tenant = await resolve_tenant(agent_id, to_number)
+    except UnknownTenantError as e:
+        # Without agent / number, the call's session knows its restaurant
+        session = await get_session(call_id) if call_id else None
+        if session is None or session.state.get("restaurant_id") is None:
+            raise HTTPException(status_code=404, detail=str(e))
+        tenant = Tenant(session.state["restaurant_id"], session.state.get("location_id"))
+    # Normally loaded since call.started; starts the load if that was missed
+    prefetch_caller(call_id, agent_id, to_number, body.get("from_number") or call.get("from_number"))
+    token = set_current_tenant(tenant)
+    call_token = set_current_call(call_id)
+    log_context = bind_call(call_id, tenant.restaurant_id)
+    try:
+        result = await dispatch_tool(tool_name, parameters)
+    except UnknownToolError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ToolValidationError as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "errors": e.errors})
+    finally:
+        unbind_call(log_context)
+        reset_current_call(call_token)
+        reset_current_tenant(token)
+    # Handlers return plain JSON types, so skip FastAPI's generic encoder
+    return Response(content=dumps(result), media_type="application/json")
+
+# Tool handlers, registered by name for retell_action
+@register_tool("get_menu", GetMenuPayload)
 async def get_menu(payload: GetMenuPayload):
-    print(f"Executing get_menu with tags: {payload.tags}")
-    # For multi-tenancy, you would get the restaurant_id from the request context
-    # For now, we'll use a placeholder or environment variable
-    RESTAURANT_ID = os.getenv("RESTAURANT_ID", 1) # Default to 1 for now
-
-    query = "SELECT id, name, description, price, category, tags, is_available, is_86d FROM menu_items WHERE restaurant_id = $1"
-    params = [RESTAURANT_ID]
-
-    if payload.tags:
-        query += " AND $2::text[] <@ tags"
-        params.append(payload.tags)
-
-    menu_items = await fetch_all(query, *params)
-    
-    # Convert asyncpg.Record objects to dictionaries for JSON serialization
-    formatted_menu = []
-    for item in menu_items:
-        formatted_menu.append({
-            "id": item["id"],
-            "name": item["name"],
-            "description": item["description"],
-            "price": float(item["price"]),
-            "category": item["category"],
-            "tags": item["tags"],
-            "is_available": item["is_available"],
-            "is_86d": item["is_86d"],
-        })
+    logger.info("Executing get_menu", extra={"tool": "get_menu", "tags": payload.tags})
+    RESTAURANT_ID = current_restaurant_id()
+
+    # Served from the in-memory snapshot; tag filtering is a set intersection
+    # over the snapshot's tag index rather than a `<@ tags` scan.
+    snapshot = await get_menu_snapshot(RESTAURANT_ID)
+    formatted_menu = snapshot.filter_by_tags(payload.tags)
 
     return {"status": "success", "data": formatted_menu}
 
+@register_tool("check_item_availability", CheckItemAvailabilityPayload)
 async def check_item_availability(payload: CheckItemAvailabilityPayload):
-    print(f"Executing check_item_availability for {payload.qty} of {payload.item_id}")
-    RESTAURANT_ID = os.getenv("RESTAURANT_ID", 1)
+    logger.info("Executing check_item_availability for %s of %s", payload.qty, payload.item_id, extra={"tool": "check_item_availability"})
+    RESTAURANT_ID = current_restaurant_id()
 
-    query = "SELECT is_available, is_86d FROM menu_items WHERE id = $1 AND restaurant_id = $2"
-    item = await fetch_one(query, payload.item_id, RESTAURANT_ID)
+    snapshot = await get_menu_snapshot(RESTAURANT_ID)
+    item = snapshot.get_item(payload.item_id)
 
     if item:
         available = item["is_available"] and not item["is_86d"]
+        if available:
+            # What the caller wants so far, for whichever worker handles the next tool call
+            def collect(state):
+                state.setdefault("items", {})[str(item["id"])] = {"name": item["name"], "qty": payload.qty}
+            await note_session(current_call_id(), collect)
         return {"status": "success", "available": available}
     else:
         return {"status": "success", "available": False, "message": "Item not found."}
 
-
+@register_tool("resolve_menu_item", ResolveMenuItemPayload)
+async def resolve_menu_item(payload: ResolveMenuItemPayload):
+    logger.info("Executing resolve_menu_item for %r", payload.query, extra={"tool": "resolve_menu_item"})
+    RESTAURANT_ID = current_restaurant_id()
+
+    # Fuzzy lookup over the cached snapshot so the model gets item ids
+    # without pulling the whole menu into its context.
+    snapshot = await get_menu_snapshot(RESTAURANT_ID)
+    matches = [
+        {
+            "item_id": str(item["id"]),
+            "name": item["name"],
+            "price": item["price"],
+            "available": item["is_available"] and not item["is_86d"],
+            "score": score,
+        }
+        for item, score in snapshot.resolve(payload.query, payload.limit)
+    ]
+    return {"status": "success", "data": matches}
+
+@register_tool("create_order", CreateOrderPayload, timeout=10.0, max_concurrency=20, writes=True)
 async def create_order(payload: CreateOrderPayload):
-    print(f"Executing create_order for customer {payload.customer.name}")
-    RESTAURANT_ID = os.getenv("RESTAURANT_ID", 1)
-
-    # Calculate total amount (placeholder for now, should fetch actual prices from DB)
-    total_amount = 0.0
+    logger.info("Executing create_order with %s items", len(payload.items), extra={"tool": "create_order", "customer_name": payload.customer.name, "customer_phone": payload.customer.phone})
+    RESTAURANT_ID = current_restaurant_id()
+
+    # A returning caller's details come from the profile loaded at call.started
+    profile = caller_profile()
+    customer_name = payload.customer.name or (profile.name if profile else None)
+    customer_phone = payload.customer.phone or (profile.phone if profile else None)
+    customer_email = payload.customer.email or (profile.email if profile else None)
+    if not customer_name or not customer_phone:
+        return {"status": "error", "message": "Please ask for the caller's name and phone number."}
+
+    item_ids = []
     for item in payload.items:
-        # In a real scenario, fetch item price from menu_items table
-        # For now, assume a dummy price or pass it in payload if available
-        total_amount += 10.0 * item.qty # Dummy price
+        if item.qty <= 0:
+            return {"status": "error", "message": f"Quantity for item {item.item_id} must be at least 1."}
+        if item.qty > INT4_MAX:
+            return {"status": "error", "message": f"Quantity for item {item.item_id} is too large."}
+        try:
+            item_id = int(item.item_id)
+        except ValueError:
+            item_id = None
+        if item_id is None or not 0 < item_id <= INT4_MAX:
+            return {"status": "error", "message": f"Item {item.item_id} not found."}
+        item_ids.append(item_id)
 
-    # Create order
-    order_query = "INSERT INTO orders (restaurant_id, customer_name, customer_phone, customer_email, status, total_amount, pay_link) VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id"
     pay_link = f"https://stripe.com/pay/{os.urandom(16).hex()}" # Placeholder Stripe link
-    order_id = await fetch_one(order_query, RESTAURANT_ID, payload.customer.name, payload.customer.phone, payload.customer.email, "pending", total_amount, pay_link)
-    order_id = order_id["id"]
-
-    # Add order items
-    for item in payload.items:
-        # In a real scenario, fetch menu_item_id and price_at_order from menu_items table
-        item_query = "INSERT INTO order_items (order_id, menu_item_id, quantity, notes, price_at_order) VALUES ($1, $2, $3, $4, $5)"
-        await execute_query(item_query, order_id, item.item_id, item.qty, item.notes, 10.0) # Dummy price
-
-    return {"status": "success", "order_id": str(order_id), "pay_link": pay_link}
 
+    # Four round trips regardless of order size, all in one transaction so a
+    # failure never leaves an order without its items or the dashboard
+    # rollup out of step. The rollup goes last to hold its row lock briefly.
+    zones = await restaurant_zones([RESTAURANT_ID])
+    async with transaction() as conn:
+        # Prices and availability for every line item in one query, read
+        # inside the transaction so the total matches what gets stored.
+        menu_rows = await conn.fetch(ORDER_MENU_QUERY, RESTAURANT_ID, item_ids)
+        menu = {row["id"]: row for row in menu_rows}
+
+        missing = [str(item_id) for item_id in item_ids if item_id not in menu]
+        if missing:
+            return {"status": "error", "message": f"Items not found: {', '.join(missing)}."}
+        unavailable = [menu[item_id]["name"] for item_id in item_ids if not menu[item_id]["is_available"] or menu[item_id]["is_86d"]]
+        if unavailable:
+            return {"status": "error", "message": f"Currently unavailable: {', '.join(unavailable)}.", "unavailable_items": unavailable}
+
+        prices = [menu[item_id]["price"] for item_id in item_ids]
+        total_amount = sum(price * item.qty for price, item in zip(prices, payload.items))
+
+        order_query = "INSERT INTO orders (restaurant_id, customer_name, customer_phone, customer_email, status, total_amount, pay_link) VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id"
+        order_id = await conn.fetchval(order_query, RESTAURANT_ID, customer_name, customer_phone, customer_email, "pending", total_amount, pay_link)
+
+        # All line items in a single statement
+        await conn.execute(
+            "INSERT INTO order_items (order_id, menu_item_id, quantity, notes, price_at_order) "
+            "SELECT $1, * FROM unnest($2::int[], $3::int[], $4::text[], $5::numeric[])",
+            order_id, item_ids, [item.qty for item in payload.items], [item.notes for item in payload.items], prices
+        )
+        rollup = Delta(RESTAURANT_ID, datetime.now(timezone.utc), orders=1, order_revenue=total_amount)
+        await write_rollups(conn, rollup_rows([rollup], zones))
+
+    if profile is not None:
+        names = [menu[item_id]["name"] for item_id in item_ids]
+        profile.record_order(order_id, customer_name, customer_email, float(total_amount),
+                             [{"name": name, "quantity": item.qty} for name, item in zip(names, payload.items)])
+
+    def ordered(state):
+        state.setdefault("orders", [])
+        if order_id not in state["orders"]:
+            state["orders"].append(order_id)
+        for item_id in item_ids:
+            state.get("items", {}).pop(str(item_id), None)
+    await note_session(current_call_id(), ordered)
+    publish_live("order", current_call_id(), RESTAURANT_ID, order_id=order_id, total_amount=float(total_amount),
+                 items=[{"name": menu[item_id]["name"], "quantity": item.qty} for item_id, item in zip(item_ids, payload.items)])
+    return {"status": "success", "order_id": str(order_id), "pay_link": pay_link, "total_amount": float(total_amount)}
+
+@register_tool("get_timeslots", GetTimeslotsPayload)
 async def get_timeslots(payload: GetTimeslotsPayload):
-    print(f"Executing get_timeslots for {payload.party_size} on {payload.date}")
-    RESTAURANT_ID = os.getenv("RESTAURANT_ID", 1)
-
-    # This is a simplified placeholder. Real implementation would involve:
-    # 1. Checking restaurant operating hours for the given date.
-    # 2. Checking existing reservations to find available slots.
-    # 3. Considering party size and table availability.
-    
-    # For now, return some dummy available timeslots
-    available_times = ["18:00", "19:00", "20:00"]
+    logger.info("Executing get_timeslots for %s on %s", payload.party_size, payload.date, extra={"tool": "get_timeslots"})
+    RESTAURANT_ID = current_restaurant_id()
+
+    # Computed from opening hours, covers capacity and the day's bookings,
+    # cached per (restaurant, date) so follow-up questions skip the database.
+    available_times = await find_open_slots(RESTAURANT_ID, payload.date, payload.party_size)
     return {"status": "success", "data": available_times}
 
+@register_tool("create_reservation", CreateReservationPayload, timeout=10.0, max_concurrency=20, writes=True)
 async def create_reservation(payload: CreateReservationPayload):
-    print(f"Executing create_reservation for {payload.name} on {payload.datetime}")
-    RESTAURANT_ID = os.getenv("RESTAURANT_ID", 1)
-
-    query = "INSERT INTO reservations (restaurant_id, customer_name, customer_phone, datetime, party_size, status) VALUES ($1, $2, $3, $4, $5, $6) RETURNING id"
-    reservation_id = await fetch_one(query, RESTAURANT_ID, payload.name, payload.phone, payload.datetime, payload.party_size, "pending")
-    reservation_id = reservation_id["id"]
-
+    logger.info("Executing create_reservation for %s on %s", payload.party_size, payload.datetime, extra={"tool": "create_reservation", "customer_name": payload.name, "customer_phone": payload.phone})
+    RESTAURANT_ID = current_restaurant_id()
+
+    profile = caller_profile()
+    name = payload.name or (profile.name if profile else None)
+    phone = payload.phone or (profile.phone if profile else None)
+    if not name or not phone:
+        return {"status": "error", "message": "Please ask for the caller's name and phone number."}
+
+    # Capacity is re-checked against committed bookings under a lock, so two
+    # callers racing for the last table can't both get it.
+    try:
+        reservation_id = await book_reservation(RESTAURANT_ID, payload.datetime, payload.party_size, name, phone)
+    except SlotUnavailableError as e:
+        return {"status": "error", "message": str(e), "available_times": e.alternatives}
+
+    if profile is not None:
+        profile.record_reservation(reservation_id, name, payload.datetime, payload.party_size)
+
+    def booked(state):
+        state.setdefault("reservations", [])
+        if reservation_id not in state["reservations"]:
+            state["reservations"].append(reservation_id)
+    await note_session(current_call_id(), booked)
+    publish_live("reservation", current_call_id(), RESTAURANT_ID, reservation_id=reservation_id,
+                 datetime=payload.datetime.isoformat(), party_size=payload.party_size)
     return {"status": "success", "reservation_id": str(reservation_id)}
 
+@register_tool("create_reminder", CreateReminderPayload, writes=True)
 async def create_reminder(payload: CreateReminderPayload):
-    print(f"Executing create_reminder for {payload.assignee} due at {payload.due_at}")
-    RESTAURANT_ID = os.getenv("RESTAURANT_ID", 1)
+    logger.info("Executing create_reminder for %s due at %s", payload.assignee, payload.due_at, extra={"tool": "create_reminder"})
+    RESTAURANT_ID = current_restaurant_id()
 
+    # reminders.py is woken by the insert trigger and delivers it at due_at
     query = "INSERT INTO reminders (restaurant_id, assignee, due_at, payload, is_completed) VALUES ($1, $2, $3, $4, FALSE) RETURNING id"
-    reminder_id = await fetch_one(query, RESTAURANT_ID, payload.assignee, payload.due_at, payload.payload)
+    reminder_id = await fetch_one(query, RESTAURANT_ID, payload.assignee, payload.due_at, dumps(payload.payload).decode("utf-8"))
     reminder_id = reminder_id["id"]
 
     return {"status": "success", "reminder_id": str(reminder_id)}
 
+@register_tool("handover_human", HandoverHumanPayload)
 async def handover_human(payload: HandoverHumanPayload):
-    print(f"Executing handover_human due to: {payload.reason}")
-    # In a real scenario, this would trigger an alert to staff, log the event,
-    # and potentially update the call status in the database.
-    # For now, we'll just log it and return success.
-    RESTAURANT_ID = os.getenv("RESTAURANT_ID", 1)
-    # Assuming a call_id would be available in the context for logging purposes
-    # For simplicity, we'll just log the reason here.
-    print(f"Handover requested for restaurant {RESTAURANT_ID} with reason: {payload.reason}")
-    return {"status": "success", "message": "Handover request logged."}"}
+    logger.info("Executing handover_human", extra={"tool": "handover_human"})
+    RESTAURANT_ID = current_restaurant_id()
+    # The reason is the caller's own words, so it only goes in a masked field
+    logger.warning("Handover requested", extra={"restaurant_id": RESTAURANT_ID, "reason": payload.reason})
+
+    # Once per call, whichever worker the retries land on
+    earlier = None
+    def hand_over(state):
+        nonlocal earlier
+        earlier = state.get("handover")
+        state.setdefault("handover", {"reason": payload.reason, "at": time.time()})
+    await note_session(current_call_id(), hand_over)
+    if earlier is not None:
+        return {"status": "success", "message": "Handover was already requested on this call."}
+    # Alerts every staff board open for the restaurant
+    publish_live("handover", current_call_id(), RESTAURANT_ID, reason=payload.reason)
+
+    try:
+        await record_deltas([Delta(RESTAURANT_ID, datetime.now(timezone.utc), handovers=1)])
+    except Exception as e:
+        # The dashboard missing one handover beats failing the caller's
+        logger.warning("Could not count handover: %s", e, extra={"restaurant_id": RESTAURANT_ID})
+    return {"status": "success", "message": "Handover request logged."}
 
 
 
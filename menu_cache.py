@@ -0,0 +1,249 @@
+import logging
+import os
+import time
+import json
+import asyncio
+from .database import fetch_all, fetch_one
+from .notifications import subscribe, is_listening
+from .menu_search import MenuSearchIndex
+
+logger = logging.getLogger(__name__)
+
+# Snapshots are refreshed from Postgres after this many seconds even if no
+# NOTIFY arrived (e.g. the listener connection dropped).
+MENU_CACHE_TTL = float(os.getenv("MENU_CACHE_TTL", 300.0))
+# Loads retried when a change lands while the menu is being read; past
+# this a snapshot is still served, but reloaded on the next read.
+MENU_LOAD_RETRIES = int(os.getenv("MENU_LOAD_RETRIES", 3))
+# Channel the menu_items trigger in schema.sql publishes on.
+MENU_NOTIFY_CHANNEL = "menu_items_changed"
+
+MENU_COLUMNS = "id, restaurant_id, name, description, price, category, tags, is_available, is_86d"
+MENU_QUERY = f"SELECT {MENU_COLUMNS} FROM menu_items WHERE restaurant_id = $1 ORDER BY id"
+MENU_ITEM_QUERY = f"SELECT {MENU_COLUMNS} FROM menu_items WHERE id = $1"
+
+
+def format_menu_item(row):
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "description": row["description"],
+        "price": float(row["price"]),
+        "category": row["category"],
+        "tags": row["tags"],
+        "is_available": row["is_available"],
+        "is_86d": row["is_86d"],
+    }
+
+
+class MenuSnapshot:
+    # Everything a voice tool needs about one restaurant's menu, preformatted
+    # so handlers never touch asyncpg records or convert Decimals per call.
+
+    def __init__(self, restaurant_id, rows):
+        self.restaurant_id = restaurant_id
+        self.loaded_at = time.monotonic()
+        self.version = 0
+        self.items = {}       # id -> formatted item dict
+        self.tag_index = {}   # tag -> set of ids
+        for row in rows:
+            self._add(format_menu_item(row))
+        self._search = MenuSearchIndex(self.items.values())
+
+    def _add(self, item):
+        self.items[item["id"]] = item
+        for tag in item["tags"] or ():
+            self.tag_index.setdefault(tag, set()).add(item["id"])
+
+    def _remove(self, item_id):
+        item = self.items.pop(item_id, None)
+        if item is None:
+            return
+        for tag in item["tags"] or ():
+            ids = self.tag_index.get(tag)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self.tag_index[tag]
+
+    def upsert(self, row):
+        self._remove(row["id"])
+        item = format_menu_item(row)
+        self._add(item)
+        self._search.add(item)
+        self.version += 1
+
+    def delete(self, item_id):
+        self._remove(item_id)
+        self._search.remove(item_id)
+        self.version += 1
+
+    def is_expired(self):
+        return time.monotonic() - self.loaded_at > MENU_CACHE_TTL
+
+    def get_item(self, item_id):
+        try:
+            return self.items.get(int(item_id))
+        except (TypeError, ValueError):
+            return None
+
+    def resolve(self, query, limit=5):
+        # Ranked [(item, score)] for a spoken item name
+        return [(self.items[item_id], score) for item_id, score in self._search.search(query, limit)]
+
+    def filter_by_tags(self, tags=None):
+        # Same semantics as `$2::text[] <@ tags`: the item must carry every tag.
+        if not tags:
+            return list(self.items.values())
+        id_sets = []
+        for tag in set(tags):
+            ids = self.tag_index.get(tag)
+            if not ids:
+                return []
+            id_sets.append(ids)
+        id_sets.sort(key=len)
+        matched = id_sets[0].intersection(*id_sets[1:])
+        # Keep the menu's natural (id) order
+        return [self.items[item_id] for item_id in sorted(matched)]
+
+
+_snapshots = {}
+_loading = {}
+# restaurant_id -> changes notified or invalidated so far; None counts
+# invalidations of every restaurant. A load that sees its count move may
+# have read rows from before the change.
+_changes = {}
+# (restaurant_id, item_id) -> the latest _apply_change task for that item.
+# Each waits for the one before it, so an older read can't finish last and
+# put a stale row back.
+_applying = {}
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "expired": 0,
+    "reloads": 0,
+    "notifications": 0,
+    "invalidations": 0,
+    "stale_loads": 0,
+}
+
+
+def _changed(restaurant_id):
+    _changes[restaurant_id] = _changes.get(restaurant_id, 0) + 1
+
+
+def _change_mark(restaurant_id):
+    return _changes.get(None, 0), _changes.get(restaurant_id, 0)
+
+
+async def _load_snapshot(restaurant_id):
+    for attempt in range(MENU_LOAD_RETRIES + 1):
+        mark = _change_mark(restaurant_id)
+        rows = await fetch_all(MENU_QUERY, restaurant_id)
+        # Indexing a large menu for search takes a few hundred ms; off the
+        # event loop it doesn't stall every other call meanwhile
+        snapshot = await asyncio.to_thread(MenuSnapshot, restaurant_id, rows)
+        _stats["reloads"] += 1
+        if _change_mark(restaurant_id) == mark:
+            break
+        # A change was notified mid-read; _apply_change had no snapshot
+        # to patch, so these rows may predate it
+        _stats["stale_loads"] += 1
+    else:
+        snapshot.loaded_at = float("-inf")
+    _snapshots[restaurant_id] = snapshot
+    return snapshot
+
+
+async def get_menu_snapshot(restaurant_id):
+    restaurant_id = int(restaurant_id)
+    snapshot = _snapshots.get(restaurant_id)
+    if snapshot is not None and not snapshot.is_expired():
+        _stats["hits"] += 1
+        return snapshot
+
+    if snapshot is None:
+        _stats["misses"] += 1
+    else:
+        _stats["expired"] += 1
+
+    # Concurrent callers for the same restaurant share one load
+    pending = _loading.get(restaurant_id)
+    if pending is None:
+        pending = asyncio.ensure_future(_load_snapshot(restaurant_id))
+        _loading[restaurant_id] = pending
+        pending.add_done_callback(lambda _: _loading.pop(restaurant_id, None))
+    return await asyncio.shield(pending)
+
+
+def invalidate_menu(restaurant_id=None):
+    _stats["invalidations"] += 1
+    _changed(None if restaurant_id is None else int(restaurant_id))
+    if restaurant_id is None:
+        _snapshots.clear()
+    else:
+        _snapshots.pop(int(restaurant_id), None)
+
+
+async def _apply_change(restaurant_id, item_id, op, previous=None):
+    if previous is not None:
+        await asyncio.wait([previous])
+    snapshot = _snapshots.get(restaurant_id)
+    if snapshot is None:
+        # Nothing cached for this restaurant; next read loads it fresh
+        return
+    if op == "DELETE":
+        snapshot.delete(item_id)
+        return
+    row = await fetch_one(MENU_ITEM_QUERY, item_id)
+    if row is None or row["restaurant_id"] != restaurant_id:
+        snapshot.delete(item_id)
+        if row is not None:
+            # Item moved to another restaurant
+            invalidate_menu(row["restaurant_id"])
+    else:
+        snapshot.upsert(row)
+
+
+def _on_notify(payload):
+    _stats["notifications"] += 1
+    try:
+        change = json.loads(payload)
+        restaurant_id = int(change["restaurant_id"])
+        item_id = int(change["id"])
+        op = change["op"]
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning("Ignoring malformed menu notification %r: %s", payload, e)
+        invalidate_menu()
+        return
+
+    _changed(restaurant_id)
+    key = (restaurant_id, item_id)
+    task = asyncio.ensure_future(_apply_change(restaurant_id, item_id, op, _applying.get(key)))
+    _applying[key] = task
+
+    def _done(t):
+        if _applying.get(key) is t:
+            del _applying[key]
+        if not t.cancelled() and t.exception() is not None:
+            logger.warning("Menu cache update failed, dropping snapshot: %s", t.exception(), extra={"restaurant_id": restaurant_id})
+            invalidate_menu(restaurant_id)
+    task.add_done_callback(_done)
+
+
+async def subscribe_menu_changes():
+    # Changes may be missed while the listener is disconnected, so every
+    # snapshot is dropped whenever it (re)connects.
+    await subscribe(MENU_NOTIFY_CHANNEL, _on_notify, on_reset=invalidate_menu)
+
+
+def menu_cache_stats():
+    lookups = _stats["hits"] + _stats["misses"] + _stats["expired"]
+    return {
+        **_stats,
+        "hit_ratio": round(_stats["hits"] / lookups, 4) if lookups else 0.0,
+        "restaurants_cached": len(_snapshots),
+        "items_cached": sum(len(s.items) for s in _snapshots.values()),
+        "listening": is_listening(),
+    }
@@ -0,0 +1,187 @@
+import math
+import re
+import unicodedata
+
+# Resolves what a caller says ("the large margherita", "chicken tika") to
+# menu item ids. Each item is indexed by character trigrams of its name,
+# tags and description, and by a phonetic key per name word so spellings
+# the speech-to-text invents still land on the right item. Lookups only
+# score items that share a rare trigram or a phonetic key with the query.
+
+# Field weights for trigram matches
+NAME_WEIGHT = 1.0
+TAG_WEIGHT = 0.5
+DESCRIPTION_WEIGHT = 0.2
+# Share of the final score that comes from phonetic word matches
+PHONETIC_SHARE = 0.35
+# Postings walked to nominate candidates, rarest grams / keys first
+CANDIDATE_BUDGET = 1500
+# Candidates fully scored per lookup
+MAX_CANDIDATES = 40
+# Cached idf values are recomputed once the item count moves this much
+IDF_DRIFT = 0.1
+# Matches scoring below this aren't worth reading back to the caller
+MIN_SCORE = 0.25
+
+STOPWORDS = frozenset({
+    "a", "an", "the", "of", "and", "with", "please", "some", "one", "two", "i", "id", "like",
+    "can", "could", "get", "have", "want", "order", "me", "us", "for", "my", "to", "do", "you",
+})
+
+_NON_WORD = re.compile(r"[^a-z0-9 ]+")
+_PHONETIC_RULES = [(re.compile(pattern), replacement) for pattern, replacement in (
+    (r"^kn|^gn|^pn|^wr", lambda m: m.group()[1]),
+    (r"ph", "f"), (r"ck", "k"), (r"q", "k"), (r"x", "ks"), (r"wh", "w"),
+    (r"sch", "sk"), (r"tch", "ch"), (r"ch", "x"), (r"sh", "x"), (r"tio", "x"), (r"th", "0"),
+    (r"dg(?=[eiy])", "j"), (r"gh", "g"), (r"g(?=[eiy])", "j"), (r"c(?=[eiy])", "s"), (r"c", "k"),
+    (r"z", "s"), (r"v", "f"), (r"y(?![aeiou])", ""),
+)]
+_REPEATS = re.compile(r"(.)\1+")
+_VOWELS_AFTER_FIRST = re.compile(r"(?<=.)[aeiouwh]")
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii")
+    return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+
+def words(text: str):
+    return [word for word in normalize(text).split() if word not in STOPWORDS]
+
+
+def phonetic_key(word: str) -> str:
+    # A small Metaphone-style key: common spellings of the same sound map
+    # together ("tikka"/"tika", "margherita"/"margarita"), vowels after the
+    # first letter are dropped and repeated letters collapse.
+    key = word
+    for pattern, replacement in _PHONETIC_RULES:
+        key = pattern.sub(replacement, key)
+    key = _REPEATS.sub(r"\1", key)
+    return _VOWELS_AFTER_FIRST.sub("", key)[:6] or word[:1]
+
+
+def trigrams(text: str):
+    grams = set()
+    for word in normalize(text).split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class MenuSearchIndex:
+    # Per-restaurant index over formatted menu item dicts. add/remove keep it
+    # in step with MenuSnapshot.upsert/delete. idf values are cached and only
+    # recomputed once the menu size drifts by more than IDF_DRIFT, so a
+    # single edit never makes the next lookup pay for a rebuild.
+
+    def __init__(self, items=()):
+        self.postings = {}   # trigram -> {item_id: field weight}
+        self.phonetic = {}   # phonetic key -> set of item ids
+        self.features = {}   # item_id -> ({trigram: weight}, set of phonetic keys)
+        self._idf = {}       # trigram -> idf, valid for _idf_total items
+        self._idf_total = 0
+        self._name_mass = {} # item_id -> sum of idf over its name trigrams
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        item_id = item["id"]
+        self.remove(item_id)
+        weights = {}
+        for text, weight in (
+            (item.get("description") or "", DESCRIPTION_WEIGHT),
+            (" ".join(item.get("tags") or ()), TAG_WEIGHT),
+            (item["name"], NAME_WEIGHT),
+        ):
+            for gram in trigrams(text):
+                weights[gram] = max(weights.get(gram, 0.0), weight)
+        keys = {phonetic_key(word) for word in words(item["name"])}
+        for gram, weight in weights.items():
+            self.postings.setdefault(gram, {})[item_id] = weight
+        for key in keys:
+            self.phonetic.setdefault(key, set()).add(item_id)
+        self.features[item_id] = (weights, keys)
+
+    def remove(self, item_id):
+        features = self.features.pop(item_id, None)
+        if features is None:
+            return
+        self._name_mass.pop(item_id, None)
+        weights, keys = features
+        for gram in weights:
+            posting = self.postings[gram]
+            del posting[item_id]
+            if not posting:
+                del self.postings[gram]
+        for key in keys:
+            ids = self.phonetic[key]
+            ids.discard(item_id)
+            if not ids:
+                del self.phonetic[key]
+
+    def idf(self, gram):
+        value = self._idf.get(gram)
+        if value is None:
+            value = self._idf[gram] = math.log(1 + self._idf_total / len(self.postings.get(gram) or (None,)))
+        return value
+
+    def _check_drift(self):
+        total = len(self.features)
+        if abs(total - self._idf_total) > IDF_DRIFT * max(total, 1):
+            self._idf.clear()
+            self._name_mass.clear()
+            self._idf_total = total
+
+    def name_mass(self, item_id):
+        mass = self._name_mass.get(item_id)
+        if mass is None:
+            weights = self.features[item_id][0]
+            mass = self._name_mass[item_id] = sum(self.idf(gram) for gram, weight in weights.items() if weight == NAME_WEIGHT)
+        return mass
+
+    def search(self, query: str, limit=5):
+        # Returns [(item_id, score)] best first, score in 0..1
+        query_words = words(query)
+        if not self.features or not query_words:
+            return []
+        self._check_drift()
+        all_grams = trigrams(" ".join(query_words))
+        query_grams = [gram for gram in all_grams if gram in self.postings]
+        query_keys = [phonetic_key(word) for word in query_words]
+        idf = {gram: self.idf(gram) for gram in query_grams}
+
+        # Candidates come from the rarest grams and phonetic keys first,
+        # until CANDIDATE_BUDGET postings have been visited
+        sources = [(len(self.phonetic[key]), key, None) for key in query_keys if key in self.phonetic]
+        sources += [(len(self.postings[gram]), None, gram) for gram in query_grams]
+        sources.sort(key=lambda source: source[0])
+        rough = {}
+        visited = 0
+        for size, key, gram in sources:
+            if visited and visited + size > CANDIDATE_BUDGET:
+                break
+            visited += size
+            if key is not None:
+                for item_id in self.phonetic[key]:
+                    rough[item_id] = rough.get(item_id, 0.0) + 2.0
+            else:
+                gram_idf = idf[gram]
+                for item_id, weight in self.postings[gram].items():
+                    rough[item_id] = rough.get(item_id, 0.0) + gram_idf * weight
+        if not rough:
+            return []
+        candidates = sorted(rough, key=rough.get, reverse=True)[:MAX_CANDIDATES]
+
+        # Unknown query grams still count against the match, at the highest idf
+        query_mass = sum(idf.values()) + (len(all_grams) - len(query_grams)) * math.log(1 + self._idf_total)
+        results = []
+        for item_id in candidates:
+            weights, keys = self.features[item_id]
+            shared = sum(idf[gram] * weights[gram] for gram in query_grams if gram in weights)
+            gram_score = 2 * shared / (query_mass + self.name_mass(item_id))
+            phonetic_score = sum(1 for key in query_keys if key in keys) / len(query_keys)
+            score = (1 - PHONETIC_SHARE) * min(gram_score, 1.0) + PHONETIC_SHARE * phonetic_score
+            if score >= MIN_SCORE:
+                results.append((item_id, round(score, 4)))
+        results.sort(key=lambda pair: (-pair[1], pair[0]))
+        return results[:limit]
@@ -0,0 +1,155 @@
+import os
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds. Tool calls that take more than ~1s are heard by
+# the caller as dead air, so the buckets are densest below that.
+METRICS_LATENCY_BUCKETS = tuple(
+    float(b) for b in os.getenv("METRICS_LATENCY_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(",")
+)
+
+# Every metric is only updated from the event loop thread, so plain ints
+# and lists are enough: no locks on the request path. Rendering walks the
+# same structures when /metrics is scraped.
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_string(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_label_string(self.labelnames, labels)} {value}"
+
+
+class _InFlight:
+    # Reusable context manager for one gauge series
+    __slots__ = ("gauge", "labels")
+
+    def __init__(self, gauge, labels):
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        values = self.gauge._values
+        values[self.labels] = values.get(self.labels, 0) + 1
+
+    def __exit__(self, *exc):
+        self.gauge._values[self.labels] -= 1
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        # callback() -> {labels tuple: value}, evaluated only at scrape time
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.callback = callback
+        self._values = {}
+        self._trackers = {}
+        _metrics.append(self)
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def track(self, *labels):
+        # with REQUESTS_IN_FLIGHT.track("retell_action"): ...
+        tracker = self._trackers.get(labels)
+        if tracker is None:
+            tracker = self._trackers[labels] = _InFlight(self, labels)
+        return tracker
+
+    def render(self):
+        values = self.callback() if self.callback is not None else self._values
+        for labels, value in values.items():
+            yield f"{self.name}{_label_string(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last slot is +Inf), sum]
+        self._series = {}
+        _metrics.append(self)
+
+    def observe(self, seconds, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, seconds)] += 1
+        series[1] += seconds
+
+    def since(self, started, *labels):
+        # Observe the time elapsed since a time.perf_counter() reading
+        self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_label_string(self.labelnames, labels, le)} {cumulative}"
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_label_string(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_label_string(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_label_string(self.labelnames, labels)} {cumulative}"
+
+
+def render_metrics() -> str:
+    # Prometheus text exposition format 0.0.4
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    lines.append("")
+    return "\n".join(lines)
+
+
+# Shared metrics. Label values are bounded: tool names come from the
+# registry and event names from ingest.KNOWN_EVENTS, anything else is
+# reported as "unknown" / "other".
+TOOL_LATENCY = Histogram("tool_latency_seconds", "retell_action tool run time, including waiting for a concurrency slot.", ("tool",))
+TOOL_ERRORS = Counter("tool_errors_total", "retell_action tool failures by reason.", ("tool", "reason"))
+WEBHOOK_LATENCY = Histogram("webhook_request_seconds", "retell_webhook handling time until Retell gets its response.", ("event_name",))
+WEBHOOK_ERRORS = Counter("webhook_errors_total", "retell_webhook requests rejected or events lost, by reason.", ("reason",))
+INGEST_EVENT_LATENCY = Histogram("ingest_event_seconds", "Per-event processing time on the ingest workers, before the batch write.", ("event_name",))
+INGEST_WRITE_LATENCY = Histogram("ingest_write_seconds", "Batched write time per event type on the ingest workers.", ("event_name",))
+DB_QUERY_LATENCY = Histogram("db_query_seconds", "Time spent in database.py helpers, including pool acquire.", ("helper",))
+DB_ACQUIRE_LATENCY = Histogram("db_acquire_wait_seconds", "Time spent waiting for a pooled connection.")
+DB_ERRORS = Counter("db_errors_total", "Exceptions raised from database.py helpers.", ("helper",))
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled.", ("handler",))
+LLM_FIRST_CHUNK_LATENCY = Histogram("llm_first_chunk_seconds", "Time from Retell asking for a response to the first streamed chunk.", ("interaction",))
+LLM_RESPONSE_LATENCY = Histogram("llm_response_seconds", "Time from Retell asking for a response to content_complete.", ("interaction",))
+LLM_BARGE_INS = Counter("llm_barge_ins_total", "Responses abandoned because the caller spoke over them.")
+REMINDER_DISPATCH_LAG = Histogram("reminder_dispatch_lag_seconds", "Time from a reminder's due_at until it was delivered.")
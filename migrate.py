@@ -0,0 +1,135 @@
+# Applies schema.sql (idempotent; creates anything missing) and then every
+# migrations/NNNN_*.sql not yet recorded in schema_migrations, in order.
+#
+# A migration runs in one transaction together with its schema_migrations
+# row, unless its first line is "-- migrate: no-transaction": those run
+# statement by statement in autocommit, as CREATE INDEX CONCURRENTLY
+# requires. An index left INVALID by an interrupted concurrent build is
+# dropped and rebuilt when the migration is retried.
+#
+# Run from the directory above this package, e.g.
+#     python -m api.migrate
+#     python -m api.migrate --list
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+from .database import init_pool, close_pool, acquire
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_PATH = os.path.join(PACKAGE_DIR, "schema.sql")
+MIGRATIONS_DIR = os.path.join(PACKAGE_DIR, "migrations")
+
+NO_TRANSACTION = "-- migrate: no-transaction"
+_MIGRATION_FILE = re.compile(r"^(\d{4})_[\w-]+\.sql$")
+_CONCURRENT_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+MIGRATIONS_TABLE_QUERY = (
+    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+    "version VARCHAR(255) PRIMARY KEY, applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP)"
+)
+INVALID_INDEXES_QUERY = (
+    "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+    "WHERE NOT i.indisvalid AND c.relname = ANY($1::text[]) AND pg_table_is_visible(c.oid)"
+)
+
+
+def migration_files(directory=MIGRATIONS_DIR):
+    # [(version, path)] in apply order
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        (name[:-len(".sql")], os.path.join(directory, name))
+        for name in os.listdir(directory) if _MIGRATION_FILE.match(name)
+    )
+
+
+def split_statements(sql):
+    # Good enough for index/DDL migrations: statements end with ";" at the
+    # end of a line, and comment lines are dropped. Anything with a function
+    # body belongs in a transactional migration, which runs unsplit.
+    statements, current = [], []
+    for line in sql.splitlines():
+        if line.strip().startswith("--") or not line.strip():
+            continue
+        current.append(line)
+        if line.rstrip().endswith(";"):
+            statements.append("\n".join(current))
+            current = []
+    if current:
+        statements.append("\n".join(current))
+    return statements
+
+
+async def apply_schema(conn, path=SCHEMA_PATH):
+    with open(path) as f:
+        await conn.execute(f.read())
+
+
+async def applied_versions(conn):
+    await conn.execute(MIGRATIONS_TABLE_QUERY)
+    return {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+
+
+async def apply_migration(conn, version, path):
+    with open(path) as f:
+        sql = f.read()
+    if not sql.lstrip().startswith(NO_TRANSACTION):
+        async with conn.transaction():
+            await conn.execute(sql)
+            await conn.execute("INSERT INTO schema_migrations (version) VALUES ($1)", version)
+        return
+    names = _CONCURRENT_INDEX.findall(sql)
+    for row in await conn.fetch(INVALID_INDEXES_QUERY, names) if names else ():
+        logger.warning("Dropping invalid index %s left by an interrupted build", row["relname"])
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{row["relname"]}"')
+    for statement in split_statements(sql):
+        await conn.execute(statement)
+    await conn.execute("INSERT INTO schema_migrations (version) VALUES ($1)", version)
+
+
+async def migrate(conn, schema=True, directory=MIGRATIONS_DIR):
+    # Returns the versions applied by this call.
+    if schema:
+        await apply_schema(conn)
+    done = await applied_versions(conn)
+    applied = []
+    for version, path in migration_files(directory):
+        if version in done:
+            continue
+        logger.info("Applying migration %s", version)
+        await apply_migration(conn, version, path)
+        applied.append(version)
+    return applied
+
+
+async def run(args):
+    await init_pool()
+    try:
+        async with acquire() as conn:
+            if args.list:
+                done = await applied_versions(conn)
+                for version, _ in migration_files():
+                    print(f"{'applied' if version in done else 'pending':<9}{version}")
+                return
+            applied = await migrate(conn, schema=not args.skip_schema)
+    finally:
+        await close_pool()
+    print(f"Applied {len(applied)} migration(s): {', '.join(applied)}" if applied else "Database is up to date.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema.sql and pending migrations")
+    parser.add_argument("--list", action="store_true", help="show applied and pending migrations")
+    parser.add_argument("--skip-schema", action="store_true", help="only apply migrations/")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+-- migrate: no-transaction
+-- Secondary indexes for the queries the API issues per call. Built
+-- CONCURRENTLY so applying this to a live database never blocks writes;
+-- check_query_plans.py verifies the planner uses them.
+
+-- Menu snapshot load (menu_cache.py) and create_order's price lookup
+CREATE INDEX CONCURRENTLY IF NOT EXISTS menu_items_restaurant_idx
+    ON menu_items (restaurant_id, id);
+
+-- Availability reads in timeslots.py and the overlap check in reservations.py
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reservations_restaurant_datetime_idx
+    ON reservations (restaurant_id, datetime) INCLUDE (party_size, status);
+
+-- Campaign audiences (campaigns.py) and lookups of a caller's history
+CREATE INDEX CONCURRENTLY IF NOT EXISTS reservations_restaurant_phone_idx
+    ON reservations (restaurant_id, customer_phone);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_restaurant_phone_idx
+    ON orders (restaurant_id, customer_phone);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS orders_restaurant_email_idx
+    ON orders (restaurant_id, customer_email) WHERE customer_email IS NOT NULL;
+
+-- ON DELETE CASCADE from orders would otherwise scan order_items
+CREATE INDEX CONCURRENTLY IF NOT EXISTS order_items_order_idx
+    ON order_items (order_id);
+
+-- Per-day configuration read by timeslots.py
+CREATE INDEX CONCURRENTLY IF NOT EXISTS locations_restaurant_idx
+    ON locations (restaurant_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS opening_hours_restaurant_day_idx
+    ON opening_hours (restaurant_id, day_of_week);
+
+-- Number -> agent joins in tenants.py and bootstrap.py
+CREATE INDEX CONCURRENTLY IF NOT EXISTS phone_numbers_agent_idx
+    ON phone_numbers (retell_agent_id);
+
+-- Due campaigns (campaigns.py)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS campaigns_due_idx
+    ON campaigns (scheduled_at) WHERE status IN ('scheduled', 'sending');
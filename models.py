@@ -10,19 +10,25 @@ class CheckItemAvailabilityPayload(BaseModel):
     item_id: str
     qty: int
 
+class ResolveMenuItemPayload(BaseModel):
+    query: str
+    limit: int = Field(5, ge=1, le=10)
+
 class CreateOrderItem(BaseModel):
     item_id: str
     qty: int
     notes: Optional[str] = None
 
+# Name and phone may be left out for a returning caller; the handlers
+# fill them in from the caller's profile (see callers.py).
 class CreateOrderCustomer(BaseModel):
-    name: str
-    phone: str
+    name: Optional[str] = None
+    phone: Optional[str] = None
     email: Optional[str] = None
 
 class CreateOrderPayload(BaseModel):
-    items: List[CreateOrderItem]
-    customer: CreateOrderCustomer
+    items: List[CreateOrderItem] = Field(min_length=1)
+    customer: CreateOrderCustomer = Field(default_factory=CreateOrderCustomer)
 
 class GetTimeslotsPayload(BaseModel):
     date: date
@@ -31,8 +37,8 @@ class GetTimeslotsPayload(BaseModel):
 class CreateReservationPayload(BaseModel):
     datetime: datetime
     party_size: int
-    name: str
-    phone: str
+    name: Optional[str] = None
+    phone: Optional[str] = None
 
 class CreateReminderPayload(BaseModel):
     assignee: str = Field(..., pattern="^chef$") # Only 'chef' is allowed
@@ -0,0 +1,105 @@
+import logging
+import asyncio
+import asyncpg
+from .database import DATABASE_URL, execute_query
+
+logger = logging.getLogger(__name__)
+
+# One dedicated LISTEN connection per worker process, shared by every cache
+# that reacts to Postgres NOTIFY. Pooled connections can't be used because a
+# listener has to stay attached to the same session.
+
+_callbacks = {}       # channel -> list of callback(payload)
+_reset_callbacks = []  # called whenever notifications may have been missed
+_conn = None
+_task = None
+
+
+def _dispatch(conn, pid, channel, payload):
+    for callback in _callbacks.get(channel, ()):
+        try:
+            callback(payload)
+        except Exception as e:
+            logger.exception("Notification handler for '%s' failed: %s", channel, e)
+
+
+def _reset():
+    for callback in _reset_callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.exception("Notification reset handler failed: %s", e)
+
+
+async def subscribe(channel, callback, on_reset=None):
+    # callback(payload: str) runs on the event loop for every NOTIFY on
+    # channel. on_reset() runs when the connection drops, since anything
+    # published while disconnected is lost.
+    first = channel not in _callbacks
+    _callbacks.setdefault(channel, []).append(callback)
+    if on_reset is not None:
+        _reset_callbacks.append(on_reset)
+    if first and _conn is not None and not _conn.is_closed():
+        await _conn.add_listener(channel, _dispatch)
+
+
+def _on_connection_lost(conn):
+    logger.warning("Notification listener connection lost")
+    _reset()
+
+
+async def _listen_forever():
+    global _conn
+    delay = 1.0
+    while True:
+        try:
+            _conn = await asyncpg.connect(DATABASE_URL)
+            _conn.add_termination_listener(_on_connection_lost)
+            for channel in list(_callbacks):
+                await _conn.add_listener(channel, _dispatch)
+            logger.info("Listening for notifications on %s", ", ".join(_callbacks) or "no channels")
+            # Caches were filled before we were listening; start them clean
+            _reset()
+            delay = 1.0
+            while not _conn.is_closed():
+                await asyncio.sleep(1.0)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Notification listener error: %s", e)
+        _reset()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30.0)
+
+
+async def start_listener():
+    global _task
+    if DATABASE_URL and _task is None:
+        _task = asyncio.create_task(_listen_forever())
+
+
+async def stop_listener():
+    global _task, _conn
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    if _conn is not None and not _conn.is_closed():
+        await _conn.close()
+    _conn = None
+
+
+def is_listening():
+    return _conn is not None and not _conn.is_closed()
+
+
+async def notify(channel, payload: str, conn=None):
+    # Publish on channel. Pass conn to publish inside a transaction, so the
+    # notification is only delivered if it commits.
+    if conn is not None:
+        await conn.execute("SELECT pg_notify($1, $2)", channel, payload)
+        return
+    await execute_query("SELECT pg_notify($1, $2)", channel, payload)
@@ -0,0 +1,30 @@
+# System prompt and tool schema shared by create_agent.py (agent config)
+# and llm_socket.py (the custom-LLM websocket).
+
+SYSTEM_PROMPT = """
+You are the friendly maître d’ for {{RestaurantName}}. Greet callers, announce today’s special if present, then ask: ‘Would you like a reservation, a takeout order, or have a question about events?’
+Rules:
+
+Confirm items, sizes, quantities; never guess allergens. Look up item ids with resolve_menu_item; only use get_menu when the caller wants to hear the menu.
+
+Announce 86’d items immediately and offer alternatives.
+
+For reservations, collect date/time/party size/name/phone; read back to confirm. For a returning caller, confirm the name and number on file instead of asking; create_order and create_reservation fill them in when left out.
+
+For event planning, capture date, party size, type (birthday/corporate), budget, contact; create a reminder to Chef to call within 24 hours.
+
+Payments are via SMS/email link only—never collect card by phone.
+
+If caller is stuck or requests staff, escalate with handover.
+"""
+
+TOOL_SCHEMA = [
+  {"name":"get_menu","description":"List menu items","parameters":{"type":"object","properties":{"tags":{"type":"array","items":{"type":"string"}}}}},
+  {"name":"resolve_menu_item","description":"Find menu items matching what the caller said; returns item ids ranked by score","parameters":{"type":"object","properties":{"query":{"type":"string"},"limit":{"type":"integer"}},"required":["query"]}},
+  {"name":"check_item_availability","parameters":{"type":"object","properties":{"item_id":{"type":"string"},"qty":{"type":"number"}},"required":["item_id","qty"]}},
+  {"name":"create_order","parameters":{"type":"object","properties":{"items":{"type":"array","items":{"type":"object","properties":{"item_id":{"type":"string"},"qty":{"type":"integer"},"notes":{"type":"string"}},"required":["item_id","qty"]}},"customer":{"type":"object","properties":{"name":{"type":"string"},"phone":{"type":"string"},"email":{"type":"string"}}}},"required":["items"]}},
+  {"name":"get_timeslots","parameters":{"type":"object","properties":{"date":{"type":"string","format":"date"},"party_size":{"type":"integer"}},"required":["date","party_size"]}},
+  {"name":"create_reservation","parameters":{"type":"object","properties":{"datetime":{"type":"string","format":"date-time"},"party_size":{"type":"integer"},"name":{"type":"string"},"phone":{"type":"string"}},"required":["datetime","party_size"]}},
+  {"name":"create_reminder","parameters":{"type":"object","properties":{"assignee":{"type":"string","enum":["chef"]},"due_at":{"type":"string","format":"date-time"},"payload":{"type":"object"}},"required":["assignee","due_at","payload"]}},
+  {"name":"handover_human","parameters":{"type":"object","properties":{"reason":{"type":"string"}},"required":["reason"]}}
+]
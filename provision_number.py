@@ -1,17 +1,11 @@
 
 import os
 from dotenv import load_dotenv
-from retell_sdk import Retell
 from retell_sdk.models import CreatePhoneNumberRequest
+from .retell_client import get_retell
 
 load_dotenv()
 
-RETELL_API_KEY = os.getenv("RETELL_API_KEY")
-if not RETELL_API_KEY:
-    raise ValueError("RETELL_API_KEY not found in environment variables.")
-
-retell = Retell(api_key=RETELL_API_KEY)
-
 
 def provision_number(agent_id: str, area_code: str = "", country_code: str = "US"):
     print(f"Provisioning phone number for agent ID: {agent_id}...")
@@ -46,7 +40,7 @@ def provision_number(agent_id: str, area_code: str = "", country_code: str = "US
         # We'll use a placeholder URL for now, assuming it will be updated later.
         create_number_request.webhook_url = "https://your-backend-url/api/voice/retell/webhook"
         
-        new_phone_number = retell.phone_number.create(create_number_request)
+        new_phone_number = get_retell().phone_number.create(create_number_request)
         provisioned_number = new_phone_number.phone_number
 
         print(f"Phone number {provisioned_number} provisioned and assigned to agent {agent_id}.")
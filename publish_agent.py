@@ -1,16 +1,10 @@
 
 import os
 from dotenv import load_dotenv
-from retell_sdk import Retell
+from .retell_client import get_retell
 
 load_dotenv()
 
-RETELL_API_KEY = os.getenv("RETELL_API_KEY")
-if not RETELL_API_KEY:
-    raise ValueError("RETELL_API_KEY not found in environment variables.")
-
-retell = Retell(api_key=RETELL_API_KEY)
-
 
 def publish_agent(agent_id: str):
     print(f"Publishing agent with ID: {agent_id}...")
@@ -22,7 +16,7 @@ def publish_agent(agent_id: str):
         # If it means creating a new version, the API would likely have a versioning endpoint.
         
         # Placeholder: Assuming 'publishing' might involve updating some metadata or status.
-        retell.agent.publish(agent_id)
+        get_retell().agent.publish(agent_id)
         print(f"Agent {agent_id} published successfully.")
         
         # In a real scenario, you would also persist the agent config and version to a DB.
@@ -0,0 +1,225 @@
+import logging
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from .database import fetch_all, execute_query
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# Sustained requests per second and burst, per restaurant, per Retell agent
+# and per caller number. A request is admitted only if every bucket it maps
+# to has a token. A live call sends a few transcript deltas a second, so
+# the caller limit still leaves room for several simultaneous calls.
+RATE_LIMIT_RESTAURANT_RATE = float(os.getenv("RATE_LIMIT_RESTAURANT_RATE", 200))
+RATE_LIMIT_RESTAURANT_BURST = float(os.getenv("RATE_LIMIT_RESTAURANT_BURST", 400))
+RATE_LIMIT_AGENT_RATE = float(os.getenv("RATE_LIMIT_AGENT_RATE", 200))
+RATE_LIMIT_AGENT_BURST = float(os.getenv("RATE_LIMIT_AGENT_BURST", 400))
+RATE_LIMIT_CALLER_RATE = float(os.getenv("RATE_LIMIT_CALLER_RATE", 20))
+RATE_LIMIT_CALLER_BURST = float(os.getenv("RATE_LIMIT_CALLER_BURST", 60))
+# Buckets kept per worker; the least recently used are dropped first.
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+# "postgres" shares consumption across workers through rate_limit_usage;
+# unset keeps every worker's buckets to itself (N workers admit up to N
+# times the limit).
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "")
+# Seconds between exchanges with the shared backend; how stale a worker's
+# view of the other workers' traffic can be.
+RATE_LIMIT_SYNC_INTERVAL = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL", 0.5))
+RATE_LIMIT_PRUNE_INTERVAL = 600.0
+
+LIMITS = {
+    "restaurant": (RATE_LIMIT_RESTAURANT_RATE, RATE_LIMIT_RESTAURANT_BURST),
+    "agent": (RATE_LIMIT_AGENT_RATE, RATE_LIMIT_AGENT_BURST),
+    "caller": (RATE_LIMIT_CALLER_RATE, RATE_LIMIT_CALLER_BURST),
+}
+
+# Keys are only ever added to: each worker adds what it admitted, and reads
+# back the totals to learn what everyone else admitted since its last sync.
+# Sorted keys keep concurrent upserts from deadlocking on each other.
+USAGE_QUERY = (
+    "INSERT INTO rate_limit_usage (key, consumed) SELECT * FROM unnest($1::text[], $2::float8[]) "
+    "ON CONFLICT (key) DO UPDATE SET consumed = rate_limit_usage.consumed + EXCLUDED.consumed, updated_at = CURRENT_TIMESTAMP "
+    "RETURNING key, consumed"
+)
+PRUNE_USAGE_QUERY = "DELETE FROM rate_limit_usage WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1)"
+
+RATE_LIMITED = Counter("rate_limited_total", "Requests rejected with 429 by admission control.", ("endpoint", "scope"))
+
+
+class UsageBackend:
+    # Turns per-key running totals into "consumed by other workers since my
+    # last exchange". A key this worker hasn't exchanged recently starts
+    # fresh rather than being charged for everything since.
+
+    def __init__(self, stale_after=None):
+        self.stale_after = stale_after or 4 * RATE_LIMIT_SYNC_INTERVAL
+        self._seen = OrderedDict()  # key -> (total after our last exchange, monotonic time)
+
+    async def _add(self, usage):
+        # {key: consumed} -> {key: total across workers}
+        raise NotImplementedError
+
+    async def exchange(self, usage, now=None):
+        now = time.monotonic() if now is None else now
+        totals = await self._add(usage)
+        others = {}
+        for key, total in totals.items():
+            previous = self._seen.pop(key, None)
+            if previous is not None and now - previous[1] < self.stale_after:
+                others[key] = max(0.0, total - previous[0] - usage[key])
+            self._seen[key] = (total, now)
+        while self._seen and now - next(iter(self._seen.values()))[1] >= self.stale_after:
+            self._seen.popitem(last=False)
+        return others
+
+
+class PostgresUsageBackend(UsageBackend):
+    def __init__(self, stale_after=None):
+        super().__init__(stale_after)
+        self._last_prune = time.monotonic()
+
+    async def _add(self, usage):
+        keys = sorted(usage)
+        rows = await fetch_all(USAGE_QUERY, keys, [usage[key] for key in keys])
+        if time.monotonic() - self._last_prune > RATE_LIMIT_PRUNE_INTERVAL:
+            self._last_prune = time.monotonic()
+            await execute_query(PRUNE_USAGE_QUERY, RATE_LIMIT_PRUNE_INTERVAL)
+        return {row["key"]: row["consumed"] for row in rows}
+
+
+class MemoryUsageBackend(UsageBackend):
+    # Local stand-in for PostgresUsageBackend: limiters given backends that
+    # share one `totals` dict behave like workers sharing the table.
+
+    def __init__(self, totals, stale_after=None):
+        super().__init__(stale_after)
+        self.totals = totals
+
+    async def _add(self, usage):
+        for key, consumed in usage.items():
+            self.totals[key] = self.totals.get(key, 0.0) + consumed
+        return {key: self.totals[key] for key in usage}
+
+
+class RateLimiter:
+    # Token buckets per (scope, key), checked and debited synchronously on
+    # the request path: no I/O, so a rejected request costs a few dict
+    # lookups. With a backend, each bucket is also debited for what other
+    # workers admitted, so the fleet as a whole converges on the limit.
+
+    def __init__(self, limits=LIMITS, backend=None, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.limits = limits
+        self.backend = backend
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # (scope, key) -> [tokens, monotonic time of last refill]
+        self._pending = {}             # (scope, key) -> tokens taken since the last sync
+        self.stats = {"admitted": 0, "rejected": 0, "syncs": 0, "sync_failures": 0}
+
+    def _bucket(self, scope, key, now):
+        rate, burst = self.limits[scope]
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            bucket = self._buckets[(scope, key)] = [burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((scope, key))
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def admit(self, keys, cost=1.0, now=None):
+        # keys: [(scope, key)]; None keys are skipped. Returns None when
+        # admitted, else (scope, seconds until that bucket has the tokens).
+        now = time.monotonic() if now is None else now
+        taken = []
+        for scope, key in keys:
+            if key is None:
+                continue
+            bucket = self._bucket(scope, key, now)
+            if bucket[0] < cost:
+                self.stats["rejected"] += 1
+                if self.backend is not None:
+                    # Keep syncing a bucket while it sheds, or it would stop
+                    # hearing about other workers' usage and forget its debt
+                    self._pending.setdefault((scope, key), 0.0)
+                return scope, (cost - bucket[0]) / self.limits[scope][0]
+            taken.append(((scope, key), bucket))
+        # Only debit once every bucket had room
+        for bucket_key, bucket in taken:
+            bucket[0] -= cost
+            if self.backend is not None:
+                self._pending[bucket_key] = self._pending.get(bucket_key, 0.0) + cost
+        self.stats["admitted"] += 1
+        return None
+
+    async def sync(self, now=None):
+        if self.backend is None or not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            others = await self.backend.exchange({f"{scope}:{key}": used for (scope, key), used in pending.items()}, now)
+        except Exception as e:
+            # Keep limiting locally; the usage is reported next time
+            self.stats["sync_failures"] += 1
+            logger.warning("Rate limit sync failed: %s", e)
+            for bucket_key, used in pending.items():
+                self._pending[bucket_key] = self._pending.get(bucket_key, 0.0) + used
+            return
+        self.stats["syncs"] += 1
+        for scope, key in pending:
+            bucket = self._buckets.get((scope, key))
+            if bucket is not None:
+                # May go negative: the fleet is over the limit and this
+                # worker sheds until the bucket refills
+                bucket[0] -= others.get(f"{scope}:{key}", 0.0)
+
+    async def run(self, interval=RATE_LIMIT_SYNC_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            await self.sync()
+
+
+_limiter = RateLimiter(backend=PostgresUsageBackend() if RATE_LIMIT_BACKEND == "postgres" else None)
+_sync_task = None
+
+
+def check_rate_limit(endpoint, restaurant_id=None, agent_id=None, caller=None):
+    # Returns None to admit, or the Retry-After seconds for a 429.
+    if not RATE_LIMIT_ENABLED:
+        return None
+    limited = _limiter.admit((("restaurant", restaurant_id), ("agent", agent_id), ("caller", caller)))
+    if limited is None:
+        return None
+    scope, retry_after = limited
+    RATE_LIMITED.inc(endpoint, scope)
+    return retry_after
+
+
+async def start_rate_limiter():
+    global _sync_task
+    if _limiter.backend is not None and _sync_task is None:
+        _sync_task = asyncio.create_task(_limiter.run())
+
+
+async def stop_rate_limiter():
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        try:
+            await _sync_task
+        except asyncio.CancelledError:
+            pass
+        _sync_task = None
+
+
+def rate_limit_stats():
+    return {
+        **_limiter.stats,
+        "enabled": RATE_LIMIT_ENABLED,
+        "backend": RATE_LIMIT_BACKEND or "local",
+        "keys": len(_limiter._buckets),
+    }
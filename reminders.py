@@ -0,0 +1,239 @@
+import logging
+import os
+import json
+import time
+import heapq
+import asyncio
+from datetime import datetime, timezone
+from .database import fetch_all, execute_query
+from .notifications import subscribe
+from .metrics import Counter, REMINDER_DISPATCH_LAG
+from .tools import dumps
+
+try:
+    import httpx
+except ImportError:  # Only needed for REMINDER_WEBHOOK_URL
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# Rows claimed per statement.
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", 100))
+# Upcoming reminders kept in the in-memory timer heap; later ones are loaded
+# when the heap runs past them.
+REMINDER_HEAP_SIZE = int(os.getenv("REMINDER_HEAP_SIZE", 5000))
+# Seconds between full re-syncs, which pick up reminders whose notification
+# was missed and claims abandoned by a crashed worker.
+REMINDER_RESYNC_INTERVAL = float(os.getenv("REMINDER_RESYNC_INTERVAL", 60.0))
+# A claimed reminder that isn't marked delivered within this many seconds
+# may be claimed again.
+REMINDER_CLAIM_LEASE = float(os.getenv("REMINDER_CLAIM_LEASE", 60.0))
+REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", 5))
+# POSTed one JSON reminder per request; unset only logs reminders.
+REMINDER_WEBHOOK_URL = os.getenv("REMINDER_WEBHOOK_URL")
+REMINDER_DELIVERY_TIMEOUT = float(os.getenv("REMINDER_DELIVERY_TIMEOUT", 10.0))
+
+NOTIFY_CHANNEL = "reminders_changed"
+
+# Due rows are claimed with SKIP LOCKED, so any number of workers and
+# replicas can run dispatchers: each row goes to exactly one of them, and
+# claimed_at keeps it from being re-claimed until the lease runs out.
+CLAIM_QUERY = (
+    "UPDATE reminders r SET claimed_at = CURRENT_TIMESTAMP, attempts = r.attempts + 1 "
+    "FROM (SELECT id FROM reminders WHERE NOT is_completed AND due_at <= to_timestamp($1) AND attempts < $3 "
+    "AND (claimed_at IS NULL OR claimed_at < CURRENT_TIMESTAMP - make_interval(secs => $4)) "
+    "ORDER BY due_at LIMIT $2 FOR UPDATE SKIP LOCKED) due "
+    "WHERE r.id = due.id "
+    "RETURNING r.id, r.restaurant_id, r.assignee, r.due_at, r.payload, r.attempts"
+)
+UPCOMING_QUERY = (
+    "SELECT id, extract(epoch FROM due_at)::float8 AS due FROM reminders "
+    "WHERE NOT is_completed AND attempts < $2 ORDER BY due_at LIMIT $1"
+)
+COMPLETE_QUERY = "UPDATE reminders SET is_completed = TRUE, delivered_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE id = ANY($1::int[])"
+
+REMINDERS_DELIVERED = Counter("reminders_delivered_total", "Reminders delivered, or failed delivery attempts.", ("outcome",))
+
+_client = None
+
+
+async def deliver_reminder(reminder):
+    # Default sink. Raising leaves the reminder claimed, so it is retried
+    # once the lease expires.
+    payload = reminder["payload"]
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    if not REMINDER_WEBHOOK_URL:
+        logger.warning("Reminder for %s: %s", reminder["assignee"], payload, extra={"restaurant_id": reminder["restaurant_id"]})
+        return
+    global _client
+    if httpx is None:
+        raise RuntimeError("REMINDER_WEBHOOK_URL requires the httpx package.")
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=REMINDER_DELIVERY_TIMEOUT)
+    due_at = reminder["due_at"]
+    response = await _client.post(REMINDER_WEBHOOK_URL, content=dumps({
+        "id": reminder["id"],
+        "restaurant_id": reminder["restaurant_id"],
+        "assignee": reminder["assignee"],
+        "due_at": due_at.isoformat() if isinstance(due_at, datetime) else due_at,
+        "payload": payload,
+    }), headers={"Content-Type": "application/json"})
+    response.raise_for_status()
+
+
+def _epoch(value):
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+    return float(value)
+
+
+class ReminderDispatcher:
+    # Sleeps until the earliest due_at in its heap (or a NOTIFY about an
+    # earlier one), then claims and delivers everything due. The heap only
+    # decides when to wake; which rows go out is always decided by the claim.
+
+    def __init__(self, deliver=deliver_reminder, batch_size=REMINDER_BATCH_SIZE, heap_size=REMINDER_HEAP_SIZE):
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.heap_size = heap_size
+        self._heap = []             # (due epoch, id)
+        self._horizon = float("inf")  # due of the last row loaded when the heap was truncated
+        self._next_resync = 0.0
+        self._wake = asyncio.Event()
+        self._task = None
+        self.stats = {"delivered": 0, "failed": 0, "claims": 0, "syncs": 0, "wakeups": 0, "lag_max_ms": 0.0}
+
+    def on_notify(self, payload):
+        # {"id": ..., "due": epoch seconds} from the reminders trigger
+        try:
+            data = json.loads(payload)
+            due = float(data["due"])
+        except (ValueError, KeyError, TypeError):
+            self.request_resync()
+            return
+        if due > self._horizon:
+            return  # picked up by the sync that runs at the horizon
+        if not self._heap or due < self._heap[0][0]:
+            self._wake.set()
+        heapq.heappush(self._heap, (due, data.get("id")))
+        if len(self._heap) > 2 * self.heap_size:
+            # Keep the earliest; the rest come back with the next sync
+            self._heap = heapq.nsmallest(self.heap_size, self._heap)
+            self._horizon = self._heap[-1][0]
+
+    def request_resync(self):
+        self._next_resync = 0.0
+        self._wake.set()
+
+    async def sync(self):
+        rows = await fetch_all(UPCOMING_QUERY, self.heap_size, REMINDER_MAX_ATTEMPTS)
+        self._heap = [(row["due"], row["id"]) for row in rows]
+        heapq.heapify(self._heap)
+        self._horizon = rows[-1]["due"] if len(rows) >= self.heap_size else float("inf")
+        self._next_resync = time.time() + REMINDER_RESYNC_INTERVAL
+        self.stats["syncs"] += 1
+
+    async def _claim(self, now):
+        rows = await fetch_all(CLAIM_QUERY, now, self.batch_size, REMINDER_MAX_ATTEMPTS, REMINDER_CLAIM_LEASE)
+        self.stats["claims"] += 1
+        return rows
+
+    async def _deliver_one(self, reminder):
+        try:
+            await self.deliver(reminder)
+        except Exception as e:
+            self.stats["failed"] += 1
+            REMINDERS_DELIVERED.inc("failed")
+            logger.warning("Reminder %s delivery failed (attempt %s): %s", reminder["id"], reminder["attempts"], e)
+            # Wake again when its lease runs out
+            heapq.heappush(self._heap, (time.time() + REMINDER_CLAIM_LEASE, reminder["id"]))
+            return None
+        lag = max(0.0, time.time() - _epoch(reminder["due_at"]))
+        REMINDER_DISPATCH_LAG.observe(lag)
+        REMINDERS_DELIVERED.inc("delivered")
+        self.stats["delivered"] += 1
+        self.stats["lag_max_ms"] = max(self.stats["lag_max_ms"], lag * 1000)
+        return reminder["id"]
+
+    async def dispatch_due(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            heapq.heappop(self._heap)
+        while True:
+            rows = await self._claim(now)
+            if not rows:
+                return
+            delivered = await asyncio.gather(*(self._deliver_one(row) for row in rows))
+            delivered = [reminder_id for reminder_id in delivered if reminder_id is not None]
+            if delivered:
+                await execute_query(COMPLETE_QUERY, delivered)
+            if len(rows) < self.batch_size:
+                return
+
+    async def run(self):
+        while True:
+            try:
+                now = time.time()
+                if now >= self._next_resync or now >= self._horizon:
+                    await self.sync()
+                    now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    self.stats["wakeups"] += 1
+                    await self.dispatch_due(now)
+                    continue
+                self._wake.clear()
+                wake_at = min(self._heap[0][0] if self._heap else float("inf"), self._horizon, self._next_resync)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), max(0.0, wake_at - time.time()))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Reminder dispatcher error, re-syncing shortly: %s", e)
+                self._next_resync = time.time() + 1.0
+                await asyncio.sleep(1.0)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_dispatcher = None
+
+
+async def start_reminders():
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = ReminderDispatcher()
+        await subscribe(NOTIFY_CHANNEL, _dispatcher.on_notify, on_reset=_dispatcher.request_resync)
+    _dispatcher.start()
+
+
+async def stop_reminders():
+    global _client
+    if _dispatcher is not None:
+        await _dispatcher.stop()
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def reminder_stats():
+    if _dispatcher is None:
+        return {"running": False}
+    return {
+        **_dispatcher.stats,
+        "running": _dispatcher._task is not None,
+        "scheduled": len(_dispatcher._heap),
+        "next_due_in_s": round(_dispatcher._heap[0][0] - time.time(), 3) if _dispatcher._heap else None,
+    }
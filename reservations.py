@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+from .database import transaction
+from .analytics import Delta, rollup_rows, write_rollups
+from .timeslots import get_day_availability, localize, record_reservation, invalidate_timeslots
+
+INSERT_RESERVATION_QUERY = "INSERT INTO reservations (restaurant_id, customer_name, customer_phone, datetime, party_size, status) VALUES ($1, $2, $3, $4, $5, $6) RETURNING id"
+OVERLAPPING_QUERY = "SELECT datetime, party_size FROM reservations WHERE restaurant_id = $1 AND datetime > $2 AND datetime < $3 AND status <> 'cancelled'"
+
+
+class SlotUnavailableError(Exception):
+    def __init__(self, message, alternatives=None):
+        super().__init__(message)
+        self.alternatives = alternatives or []
+
+
+async def _service_day(restaurant_id, when: datetime):
+    # Returns the availability (hours + capacity) that governs `when`. A
+    # 00:30 booking belongs to the previous day's service if that day runs
+    # past midnight.
+    any_day = await get_day_availability(restaurant_id, when.date())
+    local = localize(any_day, when).astimezone(any_day.tz)
+    current = any_day if any_day.day == local.date() else await get_day_availability(restaurant_id, local.date())
+    previous = await get_day_availability(restaurant_id, local.date() - timedelta(days=1))
+    if previous.within_hours(previous.slot_of(local)):
+        return previous, local
+    return current, local
+
+
+async def book_reservation(restaurant_id, when: datetime, party_size: int, name: str, phone: str):
+    # Checks capacity and inserts under a per-restaurant, per-day advisory
+    # lock so concurrent callers can't both take the last seats. Raises
+    # SlotUnavailableError when the party doesn't fit.
+    restaurant_id = int(restaurant_id)
+    availability, local = await _service_day(restaurant_id, when)
+    if party_size <= 0 or party_size > availability.max_covers:
+        raise SlotUnavailableError(f"We can't seat a party of {party_size}.")
+    if not availability.within_hours(availability.slot_of(local)):
+        raise SlotUnavailableError("The restaurant isn't taking reservations at that time.",
+                                   availability.open_slots(party_size))
+
+    dining = timedelta(minutes=availability.dining_slots * availability.slot_minutes)
+    day = local.date()
+    async with transaction() as conn:
+        # Any two bookings that can overlap fall within 24 hours of each
+        # other, so both hold the lock for at least one shared date. Locks are
+        # always taken in date order to avoid deadlocks.
+        for lock_day in (day - timedelta(days=1), day):
+            await conn.execute("SELECT pg_advisory_xact_lock($1, $2)", restaurant_id, lock_day.toordinal())
+
+        rows = await conn.fetch(OVERLAPPING_QUERY, restaurant_id, local - dining, local + dining)
+        # Rebuild covers from committed rows rather than trusting the cache,
+        # which other workers don't update.
+        booked = availability.empty_copy()
+        booked.load([(row["datetime"], row["party_size"]) for row in rows])
+        reservation_id = None
+        if booked.fits(local, party_size):
+            reservation_id = await conn.fetchval(INSERT_RESERVATION_QUERY, restaurant_id, name, phone, local, party_size, "pending")
+            # Dashboard rollup, bucketed by when the booking was made
+            rollup = Delta(restaurant_id, datetime.now(timezone.utc), reservations=1, covers=party_size)
+            await write_rollups(conn, rollup_rows([rollup], {restaurant_id: availability.tz}))
+
+    if reservation_id is None:
+        # Our cached copy was stale; reload it before offering alternatives
+        invalidate_timeslots(restaurant_id)
+        fresh = await get_day_availability(restaurant_id, availability.day)
+        raise SlotUnavailableError("That time is no longer available.", fresh.open_slots(party_size))
+
+    record_reservation(restaurant_id, local, party_size)
+    return reservation_id
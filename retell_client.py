@@ -0,0 +1,23 @@
+# The synchronous Retell SDK client shared by the single-agent scripts
+# (create_agent.py, publish_agent.py, provision_number.py). Fleet-wide
+# provisioning uses bootstrap.RetellClient instead.
+
+import os
+from dotenv import load_dotenv
+from retell_sdk import Retell
+
+load_dotenv()
+
+RETELL_API_KEY = os.getenv("RETELL_API_KEY")
+
+_retell = None
+
+
+def get_retell():
+    # Built on first use so importing a script never needs the key.
+    global _retell
+    if _retell is None:
+        if not RETELL_API_KEY:
+            raise ValueError("RETELL_API_KEY not found in environment variables.")
+        _retell = Retell(api_key=RETELL_API_KEY)
+    return _retell
@@ -0,0 +1,219 @@
+import logging
+import os
+import re
+import asyncio
+from datetime import datetime, timedelta, timezone
+from .database import acquire
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# call_logs and call_transcript_segments are range-partitioned by time (see
+# schema.sql). Retention never DELETEs rows: once a whole partition is older
+# than the window it is detached and dropped, which costs no vacuum work.
+
+# Days of calls and transcripts to keep.
+CALL_RETENTION_DAYS = int(os.getenv("CALL_RETENTION_DAYS", 30))
+# Partition size for new partitions: "week" or "month".
+CALL_PARTITION_INTERVAL = os.getenv("CALL_PARTITION_INTERVAL", "week")
+# Partitions created ahead of time so inserts never find their range missing.
+CALL_PARTITIONS_AHEAD = int(os.getenv("CALL_PARTITIONS_AHEAD", 2))
+# Longest a detach waits for its lock before giving up until the next run,
+# so it never queues every call_logs write behind a long-running query.
+RETENTION_LOCK_TIMEOUT = os.getenv("RETENTION_LOCK_TIMEOUT", "5s")
+# Seconds between maintenance runs.
+RETENTION_CHECK_INTERVAL = float(os.getenv("RETENTION_CHECK_INTERVAL", 3600))
+
+# Partitioned table -> partition key
+PARTITION_KEYS = {
+    "call_logs": "start_time",
+    "call_transcript_segments": "created_at",
+}
+# Only one worker across the fleet runs maintenance at a time
+_ADVISORY_LOCK_KEY = 0x63616c6c  # "call"
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+RETENTION_PARTITIONS = Counter("retention_partitions_total", "Call partitions created or dropped by retention.", ("action",))
+
+_task = None
+
+_stats = {
+    "runs": 0,
+    "skipped": 0,
+    "failures": 0,
+    "created": 0,
+    "dropped": 0,
+    "last_run": None,
+}
+
+
+def partition_start(day, interval=CALL_PARTITION_INTERVAL):
+    if interval == "month":
+        return day.replace(day=1)
+    return day - timedelta(days=day.weekday())
+
+
+def next_partition_start(start, interval=CALL_PARTITION_INTERVAL):
+    if interval == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=7)
+
+
+def partition_name(table, start):
+    return f"{table}_p{start:%Y%m%d}"
+
+
+def partition_bounds(first_day, today, interval=CALL_PARTITION_INTERVAL, ahead=CALL_PARTITIONS_AHEAD):
+    # [(start, end)] from the partition holding first_day through `ahead`
+    # partitions past the one holding today
+    start = partition_start(first_day, interval)
+    last = partition_start(today, interval)
+    for _ in range(ahead):
+        last = next_partition_start(last, interval)
+    bounds = []
+    while start <= last:
+        end = next_partition_start(start, interval)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+async def _create_partition(conn, table, name, start, end):
+    # Rows that landed in the DEFAULT partition (schema.sql) while this range
+    # had no partition would make CREATE ... PARTITION OF fail; they move
+    # into the new partition in the same transaction.
+    lower, upper = f"'{start.isoformat()} 00:00+00'", f"'{end.isoformat()} 00:00+00'"
+    key = PARTITION_KEYS[table]
+    async with conn.transaction():
+        await conn.execute(f"CREATE TEMP TABLE {name}_moved (LIKE {table}) ON COMMIT DROP")
+        await conn.execute(
+            f"WITH moved AS (DELETE FROM {table}_default WHERE {key} >= {lower} AND {key} < {upper} RETURNING *) "
+            f"INSERT INTO {name}_moved SELECT * FROM moved"
+        )
+        await conn.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ({lower}) TO ({upper})")
+        moved = await conn.execute(f"INSERT INTO {table} SELECT * FROM {name}_moved")
+    if moved.split()[-1] not in ("0", "OK"):
+        logger.warning("Moved %s rows from %s_default into %s", moved.split()[-1], table, name)
+
+
+async def ensure_partitions(conn, cutoff, today):
+    # Covers the whole retention window too, so late or replayed events for
+    # calls that are still retained always have somewhere to go. Anything
+    # written before its partition exists waits in the DEFAULT partition.
+    created = 0
+    for table in PARTITION_KEYS:
+        for start, end in partition_bounds(cutoff.date(), today):
+            name = partition_name(table, start)
+            if await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name):
+                continue
+            try:
+                await _create_partition(conn, table, name, start, end)
+            except Exception as e:
+                # e.g. CALL_PARTITION_INTERVAL changed and the range overlaps
+                # an existing partition, which then covers it anyway
+                logger.warning("Could not create partition %s: %s", name, e)
+                continue
+            created += 1
+            RETENTION_PARTITIONS.inc("created")
+            logger.info("Created partition %s", name)
+    return created
+
+
+async def _drop_expired(conn, cutoff):
+    dropped = 0
+    for table, key in PARTITION_KEYS.items():
+        partitions = await conn.fetch(
+            "SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound, i.inhdetachpending AS pending "
+            "FROM pg_inherits i JOIN pg_class child ON child.oid = i.inhrelid "
+            "WHERE i.inhparent = $1::regclass",
+            table
+        )
+        for row in partitions:
+            match = _UPPER_BOUND.search(row["bound"] or "")
+            if not match or datetime.fromisoformat(match.group(1)) > cutoff:
+                continue
+            if row["pending"]:
+                # Left half-detached by a CONCURRENTLY detach from before
+                # the DEFAULT partitions existed
+                await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {row['name']} FINALIZE")
+                await conn.execute(f"DROP TABLE {row['name']}")
+            else:
+                # Postgres refuses DETACH ... CONCURRENTLY while a DEFAULT
+                # partition exists; a plain detach holds ACCESS EXCLUSIVE on
+                # the parent only briefly, and gives up after the lock timeout
+                async with conn.transaction():
+                    await conn.execute(f"SET LOCAL lock_timeout = '{RETENTION_LOCK_TIMEOUT}'")
+                    await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {row['name']}")
+                    await conn.execute(f"DROP TABLE {row['name']}")
+            dropped += 1
+            RETENTION_PARTITIONS.inc("dropped")
+            logger.info("Dropped partition %s (older than %s days)", row["name"], CALL_RETENTION_DAYS)
+
+        # Rows the DEFAULT partition holds past the window would otherwise stay
+        await conn.execute(f"DELETE FROM {table}_default WHERE {key} < $1", cutoff)
+
+    return dropped
+
+
+async def run_retention(now=None):
+    # Creates upcoming partitions and drops expired ones. Returns False when
+    # another worker holds the maintenance lock.
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=CALL_RETENTION_DAYS)
+    # Runs on one session with a session-level advisory lock; each
+    # partition is created or detached in its own short transaction.
+    async with acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", _ADVISORY_LOCK_KEY):
+            _stats["skipped"] += 1
+            return False
+        try:
+            _stats["created"] += await ensure_partitions(conn, cutoff, now.date())
+            _stats["dropped"] += await _drop_expired(conn, cutoff)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", _ADVISORY_LOCK_KEY)
+    _stats["runs"] += 1
+    _stats["last_run"] = now.isoformat()
+    return True
+
+
+async def _run_safely():
+    try:
+        await run_retention()
+    except Exception as e:
+        _stats["failures"] += 1
+        logger.error("Call retention run failed: %s", e)
+
+
+async def _retention_loop():
+    while True:
+        await asyncio.sleep(RETENTION_CHECK_INTERVAL)
+        await _run_safely()
+
+
+async def start_retention():
+    # The first run is awaited so a fresh database has its partitions
+    # before the first call.started is written. If it fails, writes land in
+    # the DEFAULT partitions until a later run creates the right ones.
+    global _task
+    if _task is None:
+        await _run_safely()
+        _task = asyncio.create_task(_retention_loop())
+
+
+async def stop_retention():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def retention_stats():
+    return {
+        **_stats,
+        "retention_days": CALL_RETENTION_DAYS,
+        "partition_interval": CALL_PARTITION_INTERVAL,
+    }
@@ -37,13 +37,17 @@ CREATE TABLE IF NOT EXISTS locations (
 CREATE TABLE IF NOT EXISTS retell_agents (
     id SERIAL PRIMARY KEY,
     restaurant_id INTEGER REFERENCES restaurants(id) ON DELETE CASCADE,
+    location_id INTEGER REFERENCES locations(id) ON DELETE SET NULL, -- Set for agents provisioned per location (bootstrap.py)
     retell_agent_id VARCHAR(255) UNIQUE NOT NULL, -- Retell's agent ID
     version INTEGER NOT NULL DEFAULT 1,
     config JSONB NOT NULL, -- Store full agent config as JSON
-    is_live BOOLEAN DEFAULT FALSE,
+    is_live BOOLEAN DEFAULT FALSE, -- The stored config has been published
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
+ALTER TABLE retell_agents ADD COLUMN IF NOT EXISTS location_id INTEGER REFERENCES locations(id) ON DELETE SET NULL;
+-- One provisioned agent per location
+CREATE UNIQUE INDEX IF NOT EXISTS retell_agents_location_idx ON retell_agents (location_id);
 
 -- Table for Phone Numbers (provisioned via Retell)
 CREATE TABLE IF NOT EXISTS phone_numbers (
@@ -57,6 +61,28 @@ CREATE TABLE IF NOT EXISTS phone_numbers (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Table for Opening Hours (one row per sitting; several rows per day for split service)
+CREATE TABLE IF NOT EXISTS opening_hours (
+    id SERIAL PRIMARY KEY,
+    restaurant_id INTEGER REFERENCES restaurants(id) ON DELETE CASCADE,
+    location_id INTEGER REFERENCES locations(id) ON DELETE CASCADE,
+    day_of_week SMALLINT NOT NULL CHECK (day_of_week BETWEEN 1 AND 7), -- ISO: 1 = Monday, 7 = Sunday
+    open_time TIME NOT NULL,
+    close_time TIME NOT NULL, -- Earlier than open_time when service runs past midnight
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Table for Reservation Settings (dining room capacity used by get_timeslots)
+CREATE TABLE IF NOT EXISTS reservation_settings (
+    restaurant_id INTEGER PRIMARY KEY REFERENCES restaurants(id) ON DELETE CASCADE,
+    max_covers INTEGER NOT NULL, -- Guests that can be seated at the same time
+    slot_minutes INTEGER NOT NULL DEFAULT 15, -- Booking granularity
+    dining_minutes INTEGER NOT NULL DEFAULT 90, -- How long a party holds its seats
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Table for Menu Items
 CREATE TABLE IF NOT EXISTS menu_items (
     id SERIAL PRIMARY KEY,
@@ -111,22 +137,115 @@ CREATE TABLE IF NOT EXISTS reservations (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
--- Table for Call Logs (from Retell webhooks)
+-- Call logs and transcript segments are range-partitioned by time so
+-- retention can drop whole partitions instead of DELETEing rows (see
+-- retention.py, which also creates the partitions). Tables from before
+-- partitioning are renamed to *_legacy here, copied into the partitioned
+-- tables below and dropped, all in the one transaction schema.sql runs in.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('call_logs') AND relkind = 'r') THEN
+        ALTER TABLE call_logs RENAME TO call_logs_legacy;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('call_transcript_segments') AND relkind = 'r') THEN
+        ALTER TABLE call_transcript_segments RENAME TO call_transcript_segments_legacy;
+        ALTER INDEX IF EXISTS call_transcript_segments_call_seq_idx RENAME TO call_transcript_segments_legacy_call_seq_idx;
+    END IF;
+END;
+$$;
+
+-- Table for Call Logs (from Retell webhooks; one row per call)
 CREATE TABLE IF NOT EXISTS call_logs (
-    id SERIAL PRIMARY KEY,
-    retell_call_id VARCHAR(255) UNIQUE NOT NULL,
+    id BIGSERIAL,
+    retell_call_id VARCHAR(255) NOT NULL,
     restaurant_id INTEGER REFERENCES restaurants(id) ON DELETE CASCADE,
     agent_id VARCHAR(255),
-    start_time TIMESTAMP WITH TIME ZONE,
+    start_time TIMESTAMP WITH TIME ZONE NOT NULL, -- Partition key
     end_time TIMESTAMP WITH TIME ZONE,
     status VARCHAR(50),
     transcript TEXT,
-    raw_event_data JSONB, -- Store raw webhook event for debugging/auditing
+    raw_event BYTEA, -- zlib-compressed JSON of the last event Retell sent (call.ended or error)
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, start_time),
+    UNIQUE (retell_call_id, start_time)
+) PARTITION BY RANGE (start_time);
+-- Already compressed; stop TOAST from trying again
+ALTER TABLE call_logs ALTER COLUMN raw_event SET STORAGE EXTERNAL;
+-- Catches rows whose range partition retention.py hasn't created (e.g. its
+-- startup run failed); they move to the right partition once it exists
+CREATE TABLE IF NOT EXISTS call_logs_default PARTITION OF call_logs DEFAULT;
+
+-- Table for Call Transcript Segments (append-only; one row per transcript.delta)
+CREATE TABLE IF NOT EXISTS call_transcript_segments (
+    id BIGSERIAL,
+    retell_call_id VARCHAR(255) NOT NULL,
+    seq INTEGER NOT NULL, -- Order of the delta within the call (Retell's sequence; 0 if it sent none)
+    sent_at_ms BIGINT, -- Retell's timestamp for the delta; orders deltas with equal seq
+    raw_text TEXT NOT NULL, -- Delta exactly as Retell sent it
+    normalized_text TEXT NOT NULL, -- Whitespace-collapsed copy for search/analytics
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP, -- Partition key
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE INDEX IF NOT EXISTS call_transcript_segments_call_seq_idx
+    ON call_transcript_segments (retell_call_id, seq, id);
+ALTER TABLE call_transcript_segments ADD COLUMN IF NOT EXISTS sent_at_ms BIGINT;
+CREATE TABLE IF NOT EXISTS call_transcript_segments_default PARTITION OF call_transcript_segments DEFAULT;
+
+-- Rows from before partitioning land in the DEFAULT partitions, and
+-- retention.py moves them into range partitions as it creates those. The
+-- old raw_event_data JSONB is kept as uncompressed JSON bytes, which
+-- ingest.unpack_event reads as well as the zlib-compressed kind.
+DO $$
+BEGIN
+    IF to_regclass('call_logs_legacy') IS NOT NULL THEN
+        INSERT INTO call_logs (retell_call_id, restaurant_id, agent_id, start_time, end_time, status, transcript, raw_event, created_at, updated_at)
+        SELECT retell_call_id, restaurant_id, agent_id, COALESCE(start_time, created_at, CURRENT_TIMESTAMP), end_time, status, transcript,
+               convert_to(raw_event_data::text, 'UTF8'), created_at, updated_at
+        FROM call_logs_legacy ORDER BY id
+        ON CONFLICT (retell_call_id, start_time) DO NOTHING;
+        DROP TABLE call_logs_legacy;
+    END IF;
+    IF to_regclass('call_transcript_segments_legacy') IS NOT NULL THEN
+        INSERT INTO call_transcript_segments (retell_call_id, seq, raw_text, normalized_text, created_at)
+        SELECT retell_call_id, seq, raw_text, normalized_text, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM call_transcript_segments_legacy ORDER BY id;
+        DROP TABLE call_transcript_segments_legacy;
+    END IF;
+END;
+$$;
+
+-- Table for Webhook Event Keys (deduplicates Retell redeliveries across workers)
+CREATE TABLE IF NOT EXISTS webhook_event_keys (
+    event_key VARCHAR(512) PRIMARY KEY, -- call_id + event_name + sequence/timestamp
+    retell_call_id VARCHAR(255),
+    event_name VARCHAR(100),
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS webhook_event_keys_received_at_idx ON webhook_event_keys (received_at);
+
+-- Per-call state shared by every worker handling the call (see sessions.py).
+-- Created at call.started, deleted at call.ended; rows whose call.ended
+-- never arrived are pruned after expires_at.
+CREATE TABLE IF NOT EXISTS call_sessions (
+    retell_call_id VARCHAR(255) PRIMARY KEY,
+    version BIGINT NOT NULL, -- Bumped on every write; updates compare-and-set on it
+    state JSONB NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
+CREATE INDEX IF NOT EXISTS call_sessions_expires_at_idx ON call_sessions (expires_at);
 
--- Table for Reminders (e.g., for Chef)
+-- Running totals of requests admitted per rate-limit bucket, shared by the
+-- workers when RATE_LIMIT_BACKEND=postgres (see ratelimit.py). Unlogged:
+-- losing it in a crash only forgets a few seconds of usage.
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_usage (
+    key VARCHAR(255) PRIMARY KEY, -- scope:key, e.g. caller:+14155550100
+    consumed DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Table for Reminders (e.g., for Chef; delivered by reminders.py)
 CREATE TABLE IF NOT EXISTS reminders (
     id SERIAL PRIMARY KEY,
     restaurant_id INTEGER REFERENCES restaurants(id) ON DELETE CASCADE,
@@ -134,9 +253,17 @@ CREATE TABLE IF NOT EXISTS reminders (
     due_at TIMESTAMP WITH TIME ZONE NOT NULL,
     payload JSONB NOT NULL, -- Details of the reminder
     is_completed BOOLEAN DEFAULT FALSE,
+    claimed_at TIMESTAMP WITH TIME ZONE, -- Set when a dispatcher claims the row; a lease, not a lock
+    attempts INTEGER NOT NULL DEFAULT 0, -- Delivery attempts so far
+    delivered_at TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
+ALTER TABLE reminders ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE reminders ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE reminders ADD COLUMN IF NOT EXISTS delivered_at TIMESTAMP WITH TIME ZONE;
+-- Pending reminders in due order, for the dispatcher's claim and heap sync
+CREATE INDEX IF NOT EXISTS reminders_pending_due_idx ON reminders (due_at) WHERE NOT is_completed;
 
 -- Table for Social Media Posts
 CREATE TABLE IF NOT EXISTS social_posts (
@@ -162,10 +289,41 @@ CREATE TABLE IF NOT EXISTS campaigns (
     body TEXT NOT NULL,
     scheduled_at TIMESTAMP WITH TIME ZONE,
     sent_at TIMESTAMP WITH TIME ZONE,
-    status VARCHAR(50), -- 'draft', 'scheduled', 'sent', 'failed'
+    status VARCHAR(50), -- 'draft', 'scheduled', 'sending', 'sent', 'failed'
+    checkpoint VARCHAR(255), -- Last recipient before which every outcome is recorded; a resumed send starts after it
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS checkpoint VARCHAR(255);
+
+-- Per-recipient outcome of a campaign send (see campaigns.py)
+CREATE TABLE IF NOT EXISTS campaign_deliveries (
+    campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
+    recipient VARCHAR(255) NOT NULL,
+    status VARCHAR(50) NOT NULL, -- 'sending' (claimed, outcome not written yet), 'sent', 'failed'
+    provider_message_id VARCHAR(255),
+    error TEXT,
+    attempted_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (campaign_id, recipient)
+);
+
+-- Dashboard rollups per restaurant and hour / local day, kept current by
+-- the writes they count (see analytics.py; backfill with python -m api.analytics)
+CREATE TABLE IF NOT EXISTS analytics_rollups (
+    restaurant_id INTEGER REFERENCES restaurants(id) ON DELETE CASCADE,
+    granularity VARCHAR(10) NOT NULL, -- 'hour', 'day'
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL, -- UTC hour, or local midnight for 'day'
+    calls INTEGER NOT NULL DEFAULT 0, -- counted at call.started
+    timed_calls INTEGER NOT NULL DEFAULT 0, -- calls that ended, for the average duration
+    call_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    handovers INTEGER NOT NULL DEFAULT 0,
+    orders INTEGER NOT NULL DEFAULT 0,
+    order_revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    reservations INTEGER NOT NULL DEFAULT 0,
+    covers INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (restaurant_id, granularity, bucket)
+);
 
 -- Table for Customer Opt-ins (TCPA/CAN-SPAM compliance)
 CREATE TABLE IF NOT EXISTS customer_optins (
@@ -179,6 +337,80 @@ CREATE TABLE IF NOT EXISTS customer_optins (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
+-- Latest opt-in row per contact, for the campaign audience join
+CREATE INDEX IF NOT EXISTS customer_optins_contact_latest_idx
+    ON customer_optins (restaurant_id, optin_type, phone_or_email, optin_timestamp DESC);
+
+
+
+
+-- Publish menu_items changes so API workers can patch their in-memory menu
+-- snapshots (see menu_cache.py) instead of re-reading the whole menu.
+CREATE OR REPLACE FUNCTION notify_menu_items_changed() RETURNS trigger AS $$
+DECLARE
+    item RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        item := OLD;
+    ELSE
+        item := NEW;
+    END IF;
+    PERFORM pg_notify(
+        'menu_items_changed',
+        json_build_object('op', TG_OP, 'id', item.id, 'restaurant_id', item.restaurant_id)::text
+    );
+    -- An item moved between restaurants must also leave the old snapshot
+    IF TG_OP = 'UPDATE' AND OLD.restaurant_id IS DISTINCT FROM NEW.restaurant_id THEN
+        PERFORM pg_notify(
+            'menu_items_changed',
+            json_build_object('op', 'DELETE', 'id', OLD.id, 'restaurant_id', OLD.restaurant_id)::text
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS menu_items_notify ON menu_items;
+CREATE TRIGGER menu_items_notify
+    AFTER INSERT OR UPDATE OR DELETE ON menu_items
+    FOR EACH ROW EXECUTE FUNCTION notify_menu_items_changed();
+
+-- Tell API workers to reload their agent/number -> restaurant mapping (see tenants.py)
+CREATE OR REPLACE FUNCTION notify_tenants_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('tenants_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS retell_agents_notify ON retell_agents;
+CREATE TRIGGER retell_agents_notify
+    AFTER INSERT OR UPDATE OR DELETE ON retell_agents
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_tenants_changed();
+
+DROP TRIGGER IF EXISTS phone_numbers_notify ON phone_numbers;
+CREATE TRIGGER phone_numbers_notify
+    AFTER INSERT OR UPDATE OR DELETE ON phone_numbers
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_tenants_changed();
 
+DROP TRIGGER IF EXISTS locations_notify ON locations;
+CREATE TRIGGER locations_notify
+    AFTER INSERT OR UPDATE OR DELETE ON locations
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_tenants_changed();
 
+-- Wake reminder dispatchers (see reminders.py) when a reminder is added or
+-- rescheduled, so they never have to poll.
+CREATE OR REPLACE FUNCTION notify_reminders_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        'reminders_changed',
+        json_build_object('id', NEW.id, 'due', extract(epoch FROM NEW.due_at))::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
+DROP TRIGGER IF EXISTS reminders_notify ON reminders;
+CREATE TRIGGER reminders_notify
+    AFTER INSERT OR UPDATE OF due_at ON reminders
+    FOR EACH ROW EXECUTE FUNCTION notify_reminders_changed();
@@ -0,0 +1,281 @@
+import logging
+import os
+import time
+import random
+import asyncio
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from .database import fetch_one, execute_query
+from .tools import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# "postgres" shares sessions between workers and replicas through
+# call_sessions; "memory" keeps them in this process (single worker only).
+CALL_SESSION_BACKEND = os.getenv("CALL_SESSION_BACKEND", "postgres")
+# Seconds a worker trusts its own copy of a session before re-reading the
+# shared one. Updates are never based on a stale copy for long: a
+# compare-and-set against the shared version rejects them and they retry.
+CALL_SESSION_LOCAL_TTL = float(os.getenv("CALL_SESSION_LOCAL_TTL", 1.0))
+CALL_SESSION_LOCAL_MAX = int(os.getenv("CALL_SESSION_LOCAL_MAX", 5000))
+# Sessions whose call.ended never arrived are dropped this long after their
+# last update.
+CALL_SESSION_TTL = float(os.getenv("CALL_SESSION_TTL", 4 * 3600))
+CALL_SESSION_MAX_RETRIES = int(os.getenv("CALL_SESSION_MAX_RETRIES", 8))
+# Writers that lost a compare-and-set back off with jitter before retrying,
+# so a burst of updates to one call spreads out instead of colliding again.
+CALL_SESSION_RETRY_BASE_DELAY = float(os.getenv("CALL_SESSION_RETRY_BASE_DELAY", 0.002))
+CALL_SESSION_PRUNE_INTERVAL = 600.0
+
+SESSION_GET_QUERY = "SELECT version, state FROM call_sessions WHERE retell_call_id = $1 AND expires_at > CURRENT_TIMESTAMP"
+# Version 1 for a new call; an expired row not yet pruned is taken over
+SESSION_INSERT_QUERY = (
+    "INSERT INTO call_sessions (retell_call_id, version, state, expires_at) "
+    "VALUES ($1, 1, $2::jsonb, CURRENT_TIMESTAMP + make_interval(secs => $3)) "
+    "ON CONFLICT (retell_call_id) DO UPDATE SET version = call_sessions.version + 1, state = EXCLUDED.state, "
+    "expires_at = EXCLUDED.expires_at, updated_at = CURRENT_TIMESTAMP "
+    "WHERE call_sessions.expires_at <= CURRENT_TIMESTAMP RETURNING version"
+)
+SESSION_UPDATE_QUERY = (
+    "UPDATE call_sessions SET version = version + 1, state = $3::jsonb, "
+    "expires_at = CURRENT_TIMESTAMP + make_interval(secs => $4), updated_at = CURRENT_TIMESTAMP "
+    "WHERE retell_call_id = $1 AND version = $2 AND expires_at > CURRENT_TIMESTAMP RETURNING version"
+)
+SESSION_DELETE_QUERY = "DELETE FROM call_sessions WHERE retell_call_id = $1"
+SESSION_PRUNE_QUERY = "DELETE FROM call_sessions WHERE expires_at <= CURRENT_TIMESTAMP"
+
+
+class Session(NamedTuple):
+    # state is what the call has built up so far; treat it as read-only and
+    # change it through update_session:
+    #     restaurant_id, location_id   tenant resolved at call.started
+    #     items      {item_id: {"name", "qty"}} checked available, not yet ordered
+    #     orders / reservations        ids created on this call
+    #     handover   {"reason", "at"} once staff were asked to take over
+    call_id: str
+    version: int
+    state: dict
+
+
+class SessionConflictError(Exception):
+    pass
+
+
+class SessionBackend:
+    # Shared tier. Versions only ever go up; 0 means "no session".
+
+    async def get(self, call_id):
+        # -> (version, state) or None
+        raise NotImplementedError
+
+    async def compare_and_set(self, call_id, version, state):
+        # Writes `state` only if the stored version is still `version`.
+        # -> the new version, or None if another writer got there first
+        raise NotImplementedError
+
+    async def delete(self, call_id):
+        raise NotImplementedError
+
+    async def prune(self):
+        pass
+
+
+class PostgresSessionBackend(SessionBackend):
+    async def get(self, call_id):
+        row = await fetch_one(SESSION_GET_QUERY, call_id)
+        return (row["version"], loads(row["state"])) if row else None
+
+    async def compare_and_set(self, call_id, version, state):
+        state = dumps(state).decode("utf-8")
+        if version == 0:
+            row = await fetch_one(SESSION_INSERT_QUERY, call_id, state, CALL_SESSION_TTL)
+        else:
+            row = await fetch_one(SESSION_UPDATE_QUERY, call_id, version, state, CALL_SESSION_TTL)
+        return row["version"] if row else None
+
+    async def delete(self, call_id):
+        await execute_query(SESSION_DELETE_QUERY, call_id)
+
+    async def prune(self):
+        await execute_query(SESSION_PRUNE_QUERY)
+
+
+class MemorySessionBackend(SessionBackend):
+    # Local stand-in for PostgresSessionBackend: stores given one `sessions`
+    # dict behave like workers sharing the table. `latency` seconds per
+    # operation give concurrent writers a chance to interleave.
+
+    def __init__(self, sessions=None, latency=0.0):
+        self.sessions = {} if sessions is None else sessions  # call_id -> (version, JSON, expires monotonic)
+        self.latency = latency
+
+    async def _roundtrip(self):
+        await asyncio.sleep(self.latency)
+
+    async def get(self, call_id):
+        await self._roundtrip()
+        stored = self.sessions.get(call_id)
+        if stored is None or stored[2] <= time.monotonic():
+            return None
+        return stored[0], loads(stored[1])
+
+    async def compare_and_set(self, call_id, version, state):
+        await self._roundtrip()
+        stored = self.sessions.get(call_id)
+        live = stored is not None and stored[2] > time.monotonic()
+        if (stored[0] if live else 0) != version:
+            return None
+        new_version = (stored[0] if stored else 0) + 1
+        self.sessions[call_id] = (new_version, dumps(state), time.monotonic() + CALL_SESSION_TTL)
+        return new_version
+
+    async def delete(self, call_id):
+        await self._roundtrip()
+        self.sessions.pop(call_id, None)
+
+    async def prune(self):
+        now = time.monotonic()
+        for call_id in [call_id for call_id, stored in self.sessions.items() if stored[2] <= now]:
+            del self.sessions[call_id]
+
+
+class SessionStore:
+    # Per-call state keyed by retell_call_id: a local tier of recently seen
+    # sessions in front of the shared backend. Reads within local_ttl of the
+    # last fetch or write are served locally; updates are read-modify-write
+    # with compare-and-set on the version, retried on conflict, so two
+    # workers updating one call at once both land.
+
+    def __init__(self, backend, local_ttl=CALL_SESSION_LOCAL_TTL, local_max=CALL_SESSION_LOCAL_MAX):
+        self.backend = backend
+        self.local_ttl = local_ttl
+        self.local_max = local_max
+        self._local = OrderedDict()  # call_id -> (Session, monotonic time fetched)
+        self.stats = {"local_hits": 0, "shared_reads": 0, "writes": 0, "unchanged": 0, "conflicts": 0, "deletes": 0}
+
+    def _remember(self, session):
+        self._local[session.call_id] = (session, time.monotonic())
+        self._local.move_to_end(session.call_id)
+        if len(self._local) > self.local_max:
+            self._local.popitem(last=False)
+
+    async def get(self, call_id, max_age=None) -> Optional[Session]:
+        max_age = self.local_ttl if max_age is None else max_age
+        cached = self._local.get(call_id)
+        if cached is not None and time.monotonic() - cached[1] < max_age:
+            self.stats["local_hits"] += 1
+            return cached[0]
+        self.stats["shared_reads"] += 1
+        stored = await self.backend.get(call_id)
+        if stored is None:
+            self._local.pop(call_id, None)
+            return None
+        session = Session(call_id, *stored)
+        self._remember(session)
+        return session
+
+    async def update(self, call_id, mutate) -> Optional[Session]:
+        # mutate(state) changes a private copy of the state in place (an
+        # empty dict for a call with no session yet) and may run more than
+        # once. Nothing is written if it leaves the state as it was.
+        session = await self.get(call_id)
+        for attempt in range(CALL_SESSION_MAX_RETRIES + 1):
+            current = session.state if session is not None else {}
+            state = loads(dumps(current))
+            mutate(state)
+            if state == current:
+                self.stats["unchanged"] += 1
+                return session
+            version = await self.backend.compare_and_set(call_id, session.version if session is not None else 0, state)
+            if version is not None:
+                self.stats["writes"] += 1
+                session = Session(call_id, version, state)
+                self._remember(session)
+                return session
+            # Someone else wrote first: start over from their version
+            self.stats["conflicts"] += 1
+            await asyncio.sleep(random.uniform(0, CALL_SESSION_RETRY_BASE_DELAY * 2 ** attempt))
+            session = await self.get(call_id, max_age=0)
+        raise SessionConflictError(f"Session for call {call_id} kept changing; gave up after {CALL_SESSION_MAX_RETRIES} retries.")
+
+    async def delete(self, call_id):
+        self._local.pop(call_id, None)
+        self.stats["deletes"] += 1
+        await self.backend.delete(call_id)
+
+
+def _backend():
+    if CALL_SESSION_BACKEND == "memory":
+        return MemorySessionBackend()
+    return PostgresSessionBackend()
+
+
+_store = SessionStore(_backend())
+_prune_task = None
+
+
+async def get_session(call_id, max_age=None):
+    return await _store.get(call_id, max_age)
+
+
+async def update_session(call_id, mutate):
+    return await _store.update(call_id, mutate)
+
+
+async def open_session(call_id, tenant):
+    # call.started; a tool call that got here first has already created it
+    def start(state):
+        state.setdefault("restaurant_id", tenant.restaurant_id)
+        state.setdefault("location_id", tenant.location_id)
+    return await _store.update(call_id, start)
+
+
+async def close_session(call_id):
+    # call.ended
+    await _store.delete(call_id)
+
+
+async def note_session(call_id, mutate):
+    # For tool handlers: the session is bookkeeping, so a failure to update
+    # it is logged rather than failing the tool.
+    if not call_id:
+        return None
+    try:
+        return await _store.update(call_id, mutate)
+    except Exception as e:
+        logger.warning("Could not update call session: %s", e, extra={"call_id": call_id})
+        return None
+
+
+async def _prune_loop():
+    while True:
+        await asyncio.sleep(CALL_SESSION_PRUNE_INTERVAL)
+        try:
+            await _store.backend.prune()
+        except Exception as e:
+            logger.warning("Call session prune failed: %s", e)
+
+
+async def start_sessions():
+    global _prune_task
+    if _prune_task is None:
+        _prune_task = asyncio.create_task(_prune_loop())
+
+
+async def stop_sessions():
+    global _prune_task
+    if _prune_task is not None:
+        _prune_task.cancel()
+        try:
+            await _prune_task
+        except asyncio.CancelledError:
+            pass
+        _prune_task = None
+
+
+def session_stats():
+    return {
+        **_store.stats,
+        "backend": CALL_SESSION_BACKEND,
+        "local": len(_store._local),
+    }
@@ -0,0 +1,211 @@
+import logging
+import os
+import re
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import NamedTuple, Optional
+from .database import fetch_all, fetch_one
+from .notifications import subscribe
+
+logger = logging.getLogger(__name__)
+
+# Full mapping tables are reloaded after this many seconds even without a NOTIFY.
+TENANT_CACHE_TTL = float(os.getenv("TENANT_CACHE_TTL", 300.0))
+# Unknown agents/numbers are remembered for this long so a misconfigured
+# agent can't turn every request into a lookup query.
+TENANT_NEGATIVE_TTL = float(os.getenv("TENANT_NEGATIVE_TTL", 30.0))
+# Single-tenant deployments can opt in to routing every unknown agent and
+# number to this restaurant. Leave it unset with more than one restaurant:
+# a misconfigured agent would write its orders and reservations there.
+# Every use is logged as a warning.
+DEFAULT_RESTAURANT_ID = os.getenv("RESTAURANT_ID")
+TENANT_NOTIFY_CHANNEL = "tenants_changed"
+
+_NON_DIGITS = re.compile(r"[^\d+]")
+
+TENANTS_QUERY = """
+SELECT 'agent' AS kind, retell_agent_id AS key, restaurant_id, location_id
+  FROM retell_agents
+UNION ALL
+SELECT 'number', p.retell_phone_number, p.restaurant_id, COALESCE(l.id, a.location_id)
+  FROM phone_numbers p
+  LEFT JOIN locations l ON l.restaurant_id = p.restaurant_id AND l.phone = p.retell_phone_number
+  LEFT JOIN retell_agents a ON a.retell_agent_id = p.retell_agent_id
+ WHERE p.is_active
+"""
+AGENT_QUERY = "SELECT restaurant_id, location_id FROM retell_agents WHERE retell_agent_id = $1"
+NUMBER_QUERY = (
+    "SELECT p.restaurant_id, COALESCE(l.id, a.location_id) AS location_id FROM phone_numbers p "
+    "LEFT JOIN locations l ON l.restaurant_id = p.restaurant_id AND l.phone = p.retell_phone_number "
+    "LEFT JOIN retell_agents a ON a.retell_agent_id = p.retell_agent_id "
+    "WHERE p.retell_phone_number = $1 AND p.is_active"
+)
+
+
+class Tenant(NamedTuple):
+    restaurant_id: int
+    location_id: Optional[int] = None
+
+
+class UnknownTenantError(Exception):
+    pass
+
+
+def normalize_number(number):
+    if not number:
+        return None
+    return _NON_DIGITS.sub("", str(number)) or None
+
+
+_by_agent = {}
+_by_number = {}
+_misses = {}  # ("agent" | "number", key) -> monotonic time of the failed lookup
+_loaded_at = None
+_loading = None
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "lookups": 0,
+    "reloads": 0,
+    "fallbacks": 0,
+}
+
+_current_tenant = ContextVar("current_tenant", default=None)
+
+
+async def _load_all():
+    global _loaded_at
+    rows = await fetch_all(TENANTS_QUERY)
+    by_agent, by_number = {}, {}
+    for row in rows:
+        tenant = Tenant(row["restaurant_id"], row["location_id"])
+        if row["kind"] == "agent":
+            by_agent[row["key"]] = tenant
+        else:
+            by_number[normalize_number(row["key"])] = tenant
+    # No awaits between clear and update, so readers never see a half-built mapping
+    _by_agent.clear()
+    _by_agent.update(by_agent)
+    _by_number.clear()
+    _by_number.update(by_number)
+    _misses.clear()
+    _loaded_at = time.monotonic()
+    _stats["reloads"] += 1
+
+
+async def _ensure_loaded():
+    global _loading
+    if _loaded_at is not None and time.monotonic() - _loaded_at < TENANT_CACHE_TTL:
+        return
+    if _loading is None:
+        _loading = asyncio.ensure_future(_load_all())
+
+        def _done(_):
+            global _loading
+            _loading = None
+        _loading.add_done_callback(_done)
+    await asyncio.shield(_loading)
+
+
+async def _lookup(kind, key):
+    # A mapping added since the last full load; fetch just that one row
+    _stats["lookups"] += 1
+    if kind == "agent":
+        row = await fetch_one(AGENT_QUERY, key)
+    else:
+        row = await fetch_one(NUMBER_QUERY, key)
+    if row is None:
+        _misses[(kind, key)] = time.monotonic()
+        return None
+    tenant = Tenant(row["restaurant_id"], row["location_id"])
+    (_by_agent if kind == "agent" else _by_number)[key] = tenant
+    return tenant
+
+
+async def _find(kind, key):
+    cache = _by_agent if kind == "agent" else _by_number
+    tenant = cache.get(key)
+    if tenant is not None:
+        _stats["hits"] += 1
+        return tenant
+    missed_at = _misses.get((kind, key))
+    if missed_at is not None and time.monotonic() - missed_at < TENANT_NEGATIVE_TTL:
+        _stats["misses"] += 1
+        return None
+    _stats["misses"] += 1
+    return await _lookup(kind, key)
+
+
+async def resolve_tenant(agent_id=None, to_number=None) -> Tenant:
+    # The called number identifies a location; the agent identifies the
+    # restaurant (and the location, for agents bootstrap.py provisioned
+    # per location). Raises UnknownTenantError if neither maps to one and no
+    # RESTAURANT_ID fallback is configured.
+    await _ensure_loaded()
+    tenant = None
+    number = normalize_number(to_number)
+    if number:
+        tenant = await _find("number", number)
+    if tenant is None and agent_id:
+        tenant = await _find("agent", agent_id)
+    if tenant is None:
+        if DEFAULT_RESTAURANT_ID is None:
+            raise UnknownTenantError(f"No restaurant configured for agent {agent_id!r} / number {to_number!r}.")
+        _stats["fallbacks"] += 1
+        logger.warning("No restaurant configured for agent %r / number %r, falling back to RESTAURANT_ID=%s",
+                       agent_id, to_number, DEFAULT_RESTAURANT_ID)
+        tenant = Tenant(int(DEFAULT_RESTAURANT_ID))
+    return tenant
+
+
+def peek_tenant(agent_id=None, to_number=None) -> Optional[Tenant]:
+    # resolve_tenant from the cache alone, for callers that must not touch
+    # the database (admission control). None if it isn't cached.
+    number = normalize_number(to_number)
+    tenant = _by_number.get(number) if number else None
+    if tenant is None and agent_id:
+        tenant = _by_agent.get(agent_id)
+    return tenant
+
+
+def set_current_tenant(tenant: Tenant):
+    return _current_tenant.set(tenant)
+
+
+def reset_current_tenant(token):
+    _current_tenant.reset(token)
+
+
+def current_tenant() -> Tenant:
+    tenant = _current_tenant.get()
+    if tenant is None:
+        if DEFAULT_RESTAURANT_ID is None:
+            raise UnknownTenantError("No restaurant resolved for this request.")
+        tenant = Tenant(int(DEFAULT_RESTAURANT_ID))
+    return tenant
+
+
+def current_restaurant_id() -> int:
+    return current_tenant().restaurant_id
+
+
+def invalidate_tenants():
+    global _loaded_at
+    _loaded_at = None
+    _misses.clear()
+
+
+async def subscribe_tenant_changes():
+    await subscribe(TENANT_NOTIFY_CHANNEL, lambda payload: invalidate_tenants(), on_reset=invalidate_tenants)
+
+
+def tenant_cache_stats():
+    return {
+        **_stats,
+        "agents": len(_by_agent),
+        "numbers": len(_by_number),
+        "negative_entries": len(_misses),
+        "age_seconds": round(time.monotonic() - _loaded_at, 1) if _loaded_at is not None else None,
+    }
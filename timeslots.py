@@ -0,0 +1,220 @@
+import logging
+import os
+import time
+import asyncio
+from datetime import datetime, date, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from .database import fetch_one, fetch_all
+
+logger = logging.getLogger(__name__)
+
+# Used when a restaurant has no reservation_settings row.
+DEFAULT_MAX_COVERS = int(os.getenv("DEFAULT_MAX_COVERS", 40))
+DEFAULT_SLOT_MINUTES = int(os.getenv("DEFAULT_SLOT_MINUTES", 15))
+DEFAULT_DINING_MINUTES = int(os.getenv("DEFAULT_DINING_MINUTES", 90))
+# Used when a restaurant has no opening_hours rows at all, e.g. "17:00-22:00".
+DEFAULT_OPENING_HOURS = os.getenv("DEFAULT_OPENING_HOURS", "17:00-22:00")
+# Other workers book tables too, so cached days are reloaded after this long.
+TIMESLOT_CACHE_TTL = float(os.getenv("TIMESLOT_CACHE_TTL", 30.0))
+TIMESLOT_CACHE_MAX_DAYS = int(os.getenv("TIMESLOT_CACHE_MAX_DAYS", 5000))
+
+MINUTES_PER_DAY = 24 * 60
+
+DAY_CONFIG_QUERY = """
+SELECT
+    (SELECT timezone FROM locations WHERE restaurant_id = $1 ORDER BY id LIMIT 1) AS timezone,
+    s.max_covers, s.slot_minutes, s.dining_minutes,
+    (SELECT COUNT(*) FROM opening_hours WHERE restaurant_id = $1) AS hours_configured,
+    (SELECT array_agg(ARRAY[to_char(open_time, 'HH24:MI'), to_char(close_time, 'HH24:MI')] ORDER BY open_time)
+       FROM opening_hours WHERE restaurant_id = $1 AND day_of_week = $2) AS hours
+FROM (SELECT 1) AS one
+LEFT JOIN reservation_settings s ON s.restaurant_id = $1
+"""
+DAY_RESERVATIONS_QUERY = "SELECT datetime, party_size FROM reservations WHERE restaurant_id = $1 AND datetime >= $2 AND datetime < $3 AND status <> 'cancelled'"
+
+
+def _minutes(value) -> int:
+    if isinstance(value, str):
+        hours, minutes = value.strip().split(":")
+        return int(hours) * 60 + int(minutes)
+    return value.hour * 60 + value.minute
+
+
+def _parse_hours(spec):
+    intervals = []
+    for part in spec.split(","):
+        if part.strip():
+            opens, closes = part.split("-")
+            intervals.append((_minutes(opens), _minutes(closes)))
+    return intervals
+
+
+class DayAvailability:
+    # Covers booked per slot for one restaurant on one date. covers[i] is the
+    # number of guests seated during slot i, where slot i starts
+    # i * slot_minutes after local midnight. The array runs past midnight so
+    # late sittings fit.
+
+    def __init__(self, restaurant_id, day, tz, hours, max_covers, slot_minutes, dining_minutes):
+        self.restaurant_id = restaurant_id
+        self.day = day
+        self.tz = tz
+        self.hours = hours  # list of (open_minute, close_minute); close may exceed 24:00
+        self.max_covers = max_covers
+        self.slot_minutes = slot_minutes
+        self.dining_slots = -(-dining_minutes // slot_minutes)
+        last_close = max((close for _, close in hours), default=MINUTES_PER_DAY)
+        self.covers = [0] * (max(last_close, MINUTES_PER_DAY) // slot_minutes + self.dining_slots)
+        self.loaded_at = time.monotonic()
+
+    def slot_of(self, when: datetime):
+        local = when.astimezone(self.tz) if when.tzinfo else when
+        offset = (local.date() - self.day).days * MINUTES_PER_DAY + local.hour * 60 + local.minute
+        return offset // self.slot_minutes
+
+    def empty_copy(self):
+        return DayAvailability(
+            self.restaurant_id, self.day, self.tz, self.hours, self.max_covers,
+            self.slot_minutes, self.dining_slots * self.slot_minutes
+        )
+
+    def load(self, reservations):
+        # One pass over the day's bookings using a difference array
+        diff = [0] * (len(self.covers) + 1)
+        for when, party_size in reservations:
+            start = self.slot_of(when)
+            end = min(start + self.dining_slots, len(self.covers))
+            start = max(start, 0)
+            if start < end:
+                diff[start] += party_size
+                diff[end] -= party_size
+        running = 0
+        for i in range(len(self.covers)):
+            running += diff[i]
+            self.covers[i] = running
+
+    def add(self, when: datetime, party_size: int):
+        start = max(self.slot_of(when), 0)
+        for i in range(start, min(start + self.dining_slots, len(self.covers))):
+            self.covers[i] += party_size
+
+    def fits(self, when: datetime, party_size: int) -> bool:
+        start = self.slot_of(when)
+        if start < 0 or not self.within_hours(start):
+            return False
+        return max(self.covers[start:start + self.dining_slots]) + party_size <= self.max_covers
+
+    def within_hours(self, slot) -> bool:
+        minute = slot * self.slot_minutes
+        # Guests may be seated until the kitchen closes; the table stays busy afterwards
+        return any(opens <= minute < closes for opens, closes in self.hours)
+
+    def open_slots(self, party_size: int, not_before: datetime = None):
+        first = 0
+        if not_before is not None:
+            first = max(self.slot_of(not_before) + 1, 0)
+        slots = []
+        for opens, closes in self.hours:
+            start = max(-(-opens // self.slot_minutes), first)
+            for slot in range(start, -(-closes // self.slot_minutes)):
+                if max(self.covers[slot:slot + self.dining_slots]) + party_size <= self.max_covers:
+                    minute = slot * self.slot_minutes
+                    slots.append(f"{minute // 60 % 24:02d}:{minute % 60:02d}")
+        return slots
+
+    def slot_start(self, slot) -> datetime:
+        midnight = datetime.combine(self.day, datetime.min.time(), self.tz)
+        return midnight + timedelta(minutes=slot * self.slot_minutes)
+
+    def is_expired(self) -> bool:
+        return time.monotonic() - self.loaded_at > TIMESLOT_CACHE_TTL
+
+
+_days = {}
+_loading = {}
+
+
+def load_zone(name):
+    try:
+        return ZoneInfo(name) if name else timezone.utc
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning("Unknown timezone %r, using UTC", name)
+        return timezone.utc
+
+
+async def _load_day(restaurant_id, day: date):
+    config = await fetch_one(DAY_CONFIG_QUERY, restaurant_id, day.isoweekday())
+    tz = load_zone(config["timezone"])
+    if config["hours_configured"]:
+        hours = []
+        for opens, closes in config["hours"] or []:
+            open_minute, close_minute = _minutes(opens), _minutes(closes)
+            if close_minute <= open_minute:
+                close_minute += MINUTES_PER_DAY  # Closes after midnight
+            hours.append((open_minute, close_minute))
+    else:
+        hours = _parse_hours(DEFAULT_OPENING_HOURS)
+
+    availability = DayAvailability(
+        restaurant_id, day, tz, hours,
+        config["max_covers"] or DEFAULT_MAX_COVERS,
+        config["slot_minutes"] or DEFAULT_SLOT_MINUTES,
+        config["dining_minutes"] or DEFAULT_DINING_MINUTES,
+    )
+    day_start = availability.slot_start(0)
+    day_end = availability.slot_start(len(availability.covers))
+    rows = await fetch_all(
+        DAY_RESERVATIONS_QUERY,
+        restaurant_id, day_start - timedelta(minutes=availability.dining_slots * availability.slot_minutes), day_end
+    )
+    availability.load([(row["datetime"], row["party_size"]) for row in rows])
+
+    if len(_days) >= TIMESLOT_CACHE_MAX_DAYS:
+        _days.pop(next(iter(_days)))
+    _days[(restaurant_id, day)] = availability
+    return availability
+
+
+async def get_day_availability(restaurant_id, day: date) -> DayAvailability:
+    key = (int(restaurant_id), day)
+    availability = _days.get(key)
+    if availability is not None and not availability.is_expired():
+        return availability
+    # Concurrent callers for the same day share one load
+    pending = _loading.get(key)
+    if pending is None:
+        pending = asyncio.ensure_future(_load_day(*key))
+        _loading[key] = pending
+        pending.add_done_callback(lambda _: _loading.pop(key, None))
+    return await asyncio.shield(pending)
+
+
+def localize(availability: DayAvailability, when: datetime) -> datetime:
+    # Naive datetimes from callers are in the restaurant's local time
+    return when if when.tzinfo else when.replace(tzinfo=availability.tz)
+
+
+async def find_open_slots(restaurant_id, day: date, party_size: int):
+    availability = await get_day_availability(restaurant_id, day)
+    now = datetime.now(availability.tz)
+    return availability.open_slots(party_size, not_before=now if now.date() == day else None)
+
+
+def record_reservation(restaurant_id, when: datetime, party_size: int):
+    # Called after a reservation commits so cached days reflect it without a reload.
+    restaurant_id = int(restaurant_id)
+    for (cached_restaurant, day), availability in _days.items():
+        if cached_restaurant != restaurant_id:
+            continue
+        local = localize(availability, when).astimezone(availability.tz)
+        # A late booking can spill into the previous day's past-midnight slots
+        if day == local.date() or day == local.date() - timedelta(days=1):
+            availability.add(local, party_size)
+
+
+def invalidate_timeslots(restaurant_id=None):
+    if restaurant_id is None:
+        _days.clear()
+        return
+    for key in [key for key in _days if key[0] == int(restaurant_id)]:
+        del _days[key]
@@ -0,0 +1,147 @@
+import logging
+import os
+import json
+import time
+import asyncio
+from pydantic import TypeAdapter, ValidationError
+from .metrics import Gauge, TOOL_LATENCY, TOOL_ERRORS
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder is the fallback
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds a tool may run before the caller gets a "still working" answer
+# instead of dead air.
+TOOL_DEFAULT_TIMEOUT = float(os.getenv("TOOL_DEFAULT_TIMEOUT", 5.0))
+
+
+class UnknownToolError(Exception):
+    pass
+
+
+class ToolValidationError(Exception):
+    def __init__(self, tool_name, errors):
+        super().__init__(f"Invalid parameters for {tool_name}.")
+        self.errors = errors
+
+
+class Tool:
+    def __init__(self, name, handler, payload_model, timeout, max_concurrency, writes=False):
+        self.name = name
+        self.handler = handler
+        self.payload_model = payload_model
+        self.timeout = timeout
+        self.writes = writes
+        # Built once at registration so each call only runs pydantic-core
+        self.validator = TypeAdapter(payload_model)
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.in_flight = 0
+        self.calls = 0
+        self.timeouts = 0
+
+
+TOOLS = {}
+
+
+def register_tool(name, payload_model, timeout=TOOL_DEFAULT_TIMEOUT, max_concurrency=None, writes=False):
+    # Decorator: @register_tool("get_menu", GetMenuPayload) makes the handler
+    # reachable from retell_action. max_concurrency caps how many calls of
+    # this tool run at once in this worker. writes=True for handlers that
+    # commit something the caller would duplicate by retrying: their timeout
+    # only covers waiting for a slot, and once started they run to the end.
+    def decorator(handler):
+        TOOLS[name] = Tool(name, handler, payload_model, timeout, max_concurrency, writes)
+        return handler
+    return decorator
+
+
+async def _run(tool, payload):
+    if tool.semaphore is None:
+        return await tool.handler(payload)
+    async with tool.semaphore:
+        return await tool.handler(payload)
+
+
+async def _run_to_completion(tool, payload):
+    # Times out only while nothing has happened yet. The handler itself is
+    # shielded: cancelling it after its transaction committed would tell
+    # the caller to try again and create the order twice.
+    if tool.semaphore is not None:
+        await asyncio.wait_for(tool.semaphore.acquire(), tool.timeout)
+
+    async def run():
+        try:
+            return await tool.handler(payload)
+        finally:
+            if tool.semaphore is not None:
+                tool.semaphore.release()
+    return await asyncio.shield(asyncio.ensure_future(run()))
+
+
+async def dispatch_tool(tool_name: str, parameters: dict):
+    tool = TOOLS.get(tool_name)
+    if tool is None:
+        TOOL_ERRORS.inc("unknown", "unknown_tool")
+        raise UnknownToolError(f"Unknown tool: {tool_name}")
+    try:
+        payload = tool.validator.validate_python(parameters or {})
+    except ValidationError as e:
+        TOOL_ERRORS.inc(tool_name, "validation")
+        raise ToolValidationError(tool_name, e.errors(include_url=False, include_context=False))
+
+    tool.calls += 1
+    tool.in_flight += 1
+    started = time.perf_counter()
+    try:
+        if tool.writes:
+            return await _run_to_completion(tool, payload)
+        # The timeout covers waiting for a concurrency slot as well as the run
+        return await asyncio.wait_for(_run(tool, payload), tool.timeout)
+    except asyncio.TimeoutError:
+        tool.timeouts += 1
+        TOOL_ERRORS.inc(tool_name, "timeout")
+        logger.warning("Tool %s timed out after %ss", tool_name, tool.timeout, extra={"tool": tool_name})
+        return {"status": "error", "message": "That is taking longer than expected. Please try again in a moment."}
+    except Exception:
+        TOOL_ERRORS.inc(tool_name, "exception")
+        raise
+    finally:
+        tool.in_flight -= 1
+        TOOL_LATENCY.since(started, tool_name)
+
+
+def _default(value):
+    return str(value)
+
+
+def dumps(result) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(result, default=_default)
+    return json.dumps(result, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def loads(body: bytes):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+TOOLS_IN_FLIGHT = Gauge(
+    "tool_in_flight", "retell_action tool calls currently running or waiting for a slot.", ("tool",),
+    callback=lambda: {(name,): tool.in_flight for name, tool in TOOLS.items()},
+)
+
+
+def tool_stats():
+    return {
+        name: {
+            "calls": tool.calls,
+            "in_flight": tool.in_flight,
+            "timeouts": tool.timeouts,
+            "timeout_seconds": tool.timeout,
+        }
+        for name, tool in TOOLS.items()
+    }
@@ -0,0 +1,210 @@
+import logging
+import os
+import re
+import time
+import asyncio
+from .database import execute_many, execute_query, fetch_one
+
+logger = logging.getLogger(__name__)
+
+# A call's buffered deltas are written as soon as this many are pending...
+TRANSCRIPT_FLUSH_SEGMENTS = int(os.getenv("TRANSCRIPT_FLUSH_SEGMENTS", 20))
+# ...and everything pending is written at least this often (seconds).
+TRANSCRIPT_FLUSH_INTERVAL = float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", 2.0))
+# Segments kept buffered while writes fail (e.g. the database is down);
+# past this the oldest are dropped rather than growing without bound.
+TRANSCRIPT_MAX_PENDING = int(os.getenv("TRANSCRIPT_MAX_PENDING", 100000))
+# Seconds after call.ended before a stitched transcript is stitched again:
+# by then every worker's flusher has written the deltas it held for the
+# call, which the first stitch, from this worker alone, may have missed.
+TRANSCRIPT_RESTITCH_DELAY = float(os.getenv("TRANSCRIPT_RESTITCH_DELAY", TRANSCRIPT_FLUSH_INTERVAL * 2 + 1))
+
+INSERT_SEGMENT_QUERY = (
+    "INSERT INTO call_transcript_segments (retell_call_id, seq, sent_at_ms, raw_text, normalized_text) VALUES ($1, $2, $3, $4, $5)"
+)
+# Segments are ordered by Retell's sequence, then by when Retell sent them:
+# both come from the event, so the order holds whichever worker or process
+# wrote each one. The created_at bound keeps the lookup to the newest
+# partitions.
+TRANSCRIPT_QUERY = (
+    "SELECT string_agg(raw_text, '' ORDER BY seq, sent_at_ms, id) AS transcript FROM call_transcript_segments "
+    "WHERE retell_call_id = $1 AND created_at > CURRENT_TIMESTAMP - interval '2 days'"
+)
+
+RESTITCH_QUERY = (
+    "UPDATE call_logs SET transcript = s.transcript, updated_at = CURRENT_TIMESTAMP "
+    f"FROM ({TRANSCRIPT_QUERY}) s "
+    "WHERE retell_call_id = $1 AND start_time > to_timestamp($2::numeric / 1000.0) - interval '2 days' "
+    "AND s.transcript IS DISTINCT FROM call_logs.transcript"
+)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_segment(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class TranscriptBuffer:
+    # Per-call in-memory buffer of transcript deltas. Rows are
+    # (call_id, seq, sent_at_ms, raw_text, normalized_text) tuples ready for
+    # executemany.
+
+    def __init__(self, flush_segments=TRANSCRIPT_FLUSH_SEGMENTS, max_pending=TRANSCRIPT_MAX_PENDING):
+        self.flush_segments = flush_segments
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending = {}
+
+    def append(self, call_id, text, seq=None, sent_at_ms=None):
+        # Returns True once the call has enough pending segments to flush.
+        # Without Retell's sequence (seq 0) the event's timestamp orders the
+        # segment, or failing that the time it arrived.
+        if sent_at_ms is None:
+            sent_at_ms = int(time.time() * 1000)
+        rows = self._pending.setdefault(call_id, [])
+        rows.append((call_id, seq if seq is not None else 0, sent_at_ms, text, normalize_segment(text)))
+        return len(rows) >= self.flush_segments
+
+    def drain(self, call_id=None):
+        if call_id is not None:
+            return self._pending.pop(call_id, [])
+        rows = [row for call_rows in self._pending.values() for row in call_rows]
+        self._pending.clear()
+        return rows
+
+    def restore(self, rows):
+        # Put rows from a failed flush back ahead of anything newer, keeping
+        # the newest max_pending in all
+        room = max(0, self.max_pending - self.pending_count())
+        if len(rows) > room:
+            dropped = len(rows) - room
+            self.dropped += dropped
+            logger.error("Transcript buffer full, dropping %s unwritten segments", dropped)
+            rows = rows[dropped:]
+        for row in reversed(rows):
+            self._pending.setdefault(row[0], []).insert(0, row)
+
+    def forget(self, call_id):
+        self._pending.pop(call_id, None)
+
+    def pending_count(self):
+        return sum(len(rows) for rows in self._pending.values())
+
+
+_buffer = TranscriptBuffer()
+_flush_task = None
+_restitching = {}  # task waiting out TRANSCRIPT_RESTITCH_DELAY -> (call_id, since_ms)
+_writing = {}  # call_id -> futures of the writes holding its rows right now
+
+
+async def _write(rows):
+    if not rows:
+        return True
+    calls = {row[0] for row in rows}
+    done = asyncio.get_running_loop().create_future()
+    for call_id in calls:
+        _writing.setdefault(call_id, set()).add(done)
+    try:
+        await execute_many(INSERT_SEGMENT_QUERY, rows)
+        return True
+    except Exception as e:
+        # Keep the rows buffered; the flusher retries them on its next tick
+        logger.warning("Failed to write %s transcript segments, will retry: %s", len(rows), e)
+        _buffer.restore(rows)
+        return False
+    finally:
+        for call_id in calls:
+            _writing[call_id].discard(done)
+            if not _writing[call_id]:
+                del _writing[call_id]
+        done.set_result(None)
+
+
+async def _settle(call_id):
+    # Waits out writes already holding this call's rows, e.g. the flusher's
+    # drain-all; rows from one that failed are back in the buffer after.
+    while _writing.get(call_id):
+        await asyncio.gather(*_writing[call_id])
+
+
+async def append_transcript_delta(call_id: str, text: str, seq: int = None, sent_at_ms: int = None):
+    if not text:
+        return
+    if _buffer.append(call_id, text, seq, sent_at_ms):
+        await _write(_buffer.drain(call_id))
+
+
+async def flush_transcripts(call_id: str = None):
+    return await _write(_buffer.drain(call_id))
+
+
+async def finish_transcript(call_id: str, final_transcript: str = None):
+    # Called once at call.ended. Returns the full transcript to store on
+    # call_logs: Retell's final copy if it sent one, otherwise the segments
+    # written so far stitched together in order (ingest.py then calls
+    # restitch_later for the ones other workers still held).
+    await _settle(call_id)
+    flushed = await flush_transcripts(call_id)
+    if final_transcript:
+        _buffer.forget(call_id)
+        return final_transcript
+    if not flushed:
+        raise RuntimeError(f"Could not flush transcript segments for call {call_id}")
+    _buffer.forget(call_id)
+    row = await fetch_one(TRANSCRIPT_QUERY, call_id)
+    return row["transcript"] if row else None
+
+
+async def _restitch(call_id, since_ms, delay):
+    await asyncio.sleep(delay)
+    try:
+        await execute_query(RESTITCH_QUERY, call_id, since_ms)
+    except Exception as e:
+        logger.warning("Could not re-stitch transcript: %s", e, extra={"call_id": call_id})
+
+
+def restitch_later(call_id: str, since_ms):
+    # For a call.ended stored with a transcript stitched from segments:
+    # other workers may still have held some of the call's deltas, so the
+    # stored copy is rebuilt once they have all flushed. since_ms bounds the
+    # call_logs partitions searched, as in ingest.WRITE_QUERIES.
+    task = asyncio.ensure_future(_restitch(call_id, since_ms, TRANSCRIPT_RESTITCH_DELAY))
+    _restitching[task] = (call_id, since_ms)
+    task.add_done_callback(lambda t: _restitching.pop(t, None))
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(TRANSCRIPT_FLUSH_INTERVAL)
+        await flush_transcripts()
+
+
+async def start_transcript_flusher():
+    global _flush_task
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop_transcript_flusher():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    waiting = dict(_restitching)
+    for task in waiting:
+        task.cancel()
+    await asyncio.gather(*waiting, return_exceptions=True)
+    if not await flush_transcripts():
+        logger.error("Dropping %s unflushed transcript segments on shutdown", _buffer.pending_count())
+    # Re-stitched now rather than never, with whatever has been written
+    for call_id, since_ms in waiting.values():
+        await _restitch(call_id, since_ms, 0)
+
+
+def transcript_buffer_stats():
+    return {"pending_segments": _buffer.pending_count(), "dropped_segments": _buffer.dropped, "restitches_pending": len(_restitching)}